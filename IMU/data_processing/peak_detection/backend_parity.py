@@ -0,0 +1,61 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+from classification import Classification, FILTER_MODES, NUMBA_AVAILABLE
+from benchmark import read_samples
+
+LOGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+
+def replay(samples, **classifier_options):
+    """
+    Feed samples to a fresh classifier.
+
+    Returns:
+        tuple: The labels returned by add_data, and the elapsed time in seconds.
+    """
+    classification = Classification(**classifier_options)
+    start = time.perf_counter()
+    labels = [classification.add_data(sample) for sample in samples]
+    return labels, time.perf_counter() - start
+
+def check(paths, filter_modes=FILTER_MODES):
+    """
+    Replay every log through the NumPy and the Numba backends and compare the labels.
+
+    Parameters:
+        paths (list): Paths of the CSV logs.
+        filter_modes (sequence): Filter modes to check.
+
+    Returns:
+        bool: True if both backends gave the same labels on every log.
+    """
+    # Compile the kernel before timing it
+    replay(read_samples(paths[0])[:100], backend="numba")
+
+    identical = True
+    for filter_mode in filter_modes:
+        for path in paths:
+            samples = read_samples(path)
+            expected, numpy_time = replay(samples, filter_mode=filter_mode, backend="numpy")
+            labels, numba_time = replay(samples, filter_mode=filter_mode, backend="numba")
+            mismatches = [i for i, (a, b) in enumerate(zip(expected, labels)) if a != b]
+            identical &= not mismatches
+            status = "OK" if not mismatches else f"{len(mismatches)} MISMATCHES, first at sample {mismatches[0]}"
+            print(f"[PARITY] {filter_mode:<10}{os.path.basename(path):<22}{status:<12}"
+                  f"numpy {numpy_time:.2f} s, numba {numba_time:.2f} s ({numpy_time / numba_time:.1f}x)")
+    return identical
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the NumPy and Numba backends give the same labels.")
+    parser.add_argument("paths", nargs="*", help="CSV logs (default: every log in peak_detection/logs)")
+    args = parser.parse_args()
+
+    if not NUMBA_AVAILABLE:
+        print("[PARITY] Numba is not installed, nothing to compare.")
+        sys.exit(1)
+
+    paths = args.paths or sorted(glob.glob(os.path.join(LOGS_PATH, "*.csv")))
+    sys.exit(0 if check(paths) else 1)
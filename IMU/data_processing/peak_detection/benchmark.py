@@ -0,0 +1,215 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from classification import BACKENDS, Classification, DETECTORS, FILTER_MODES, GESTURES, NUMERIC_MODES, load_log
+
+LOGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+SAMPLING_RATE = 52  # Hz, rate of the recorded logs
+
+def read_samples(path):
+    """
+    Read the samples of a log as the raw lines a BLE notification carries.
+
+    Parameters:
+        path (str): Path to the CSV log.
+
+    Returns:
+        list: One bytes object per sample.
+    """
+    with open(path, "rb") as file:
+        return [line.strip() for line in file if line[:1].isdigit()]
+
+def replay(samples, classifier_options, realtime=False):
+    """
+    Feed samples to a fresh classifier and time every add_data call.
+
+    Parameters:
+        samples (list): Raw samples (see read_samples).
+        classifier_options (dict): Keyword arguments of Classification.
+        realtime (bool): Pace the samples at SAMPLING_RATE instead of as fast as possible.
+
+    Returns:
+        dict: Throughput, latency percentiles, missed deadlines and number of gestures detected.
+    """
+    classification = Classification(**classifier_options)
+    latencies = np.empty(len(samples), dtype=np.int64)
+    gestures = dict.fromkeys(GESTURES, 0)
+    period_ns = int(1e9 / SAMPLING_RATE)
+
+    start = time.perf_counter_ns()
+    for i, sample in enumerate(samples):
+        if realtime:
+            # Wait for the time the sample would have been received
+            delay = start + i * period_ns - time.perf_counter_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+        t0 = time.perf_counter_ns()
+        label = classification.add_data(sample)
+        latencies[i] = time.perf_counter_ns() - t0
+        if label in gestures:
+            gestures[label] += 1
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+
+    latencies_us = latencies / 1e3
+    return {
+        "samples": len(samples),
+        "elapsed_s": elapsed,
+        # Time spent in the classifier only, so the realtime pacing does not count
+        "throughput_samples_per_s": len(samples) / (latencies.sum() / 1e9),
+        "latency_us": {
+            "mean": float(np.mean(latencies_us)),
+            "p50": float(np.percentile(latencies_us, 50)),
+            "p95": float(np.percentile(latencies_us, 95)),
+            "p99": float(np.percentile(latencies_us, 99)),
+            "max": float(np.max(latencies_us)),
+        },
+        "deadline_misses": int(np.count_nonzero(latencies > period_ns)),
+        "gestures": gestures,
+    }
+
+def replay_recording(path, classifier_options, limit=None):
+    """
+    Time the vectorized Classification.classify_recording on a whole log.
+    Only the decision tree has a vectorized path.
+
+    Returns:
+        dict: Samples, elapsed time and throughput.
+    """
+    data = load_log(path)[:limit]
+    classification = Classification(**classifier_options)
+    start = time.perf_counter()
+    classification.classify_recording(data)
+    elapsed = time.perf_counter() - start
+    return {"samples": len(data), "elapsed_s": elapsed, "throughput_samples_per_s": len(data) / elapsed}
+
+def peak_memory(samples, classifier_options):
+    """
+    Peak memory allocated while replaying samples, measured apart from the timed
+    runs because tracemalloc slows every allocation down.
+
+    Returns:
+        int: Peak traced memory in bytes.
+    """
+    tracemalloc.start()
+    classification = Classification(**classifier_options)
+    for sample in samples:
+        classification.add_data(sample)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def git_commit():
+    """
+    Returns:
+        str or None: Current commit hash of the repository, if available.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(paths, classifier_options, realtime=False, limit=None):
+    """
+    Benchmark every log.
+
+    Parameters:
+        paths (list): Paths of the CSV logs.
+        classifier_options (dict): Keyword arguments of Classification.
+        realtime (bool): Also replay each log at SAMPLING_RATE.
+        limit (int): Only replay the first `limit` samples of each log.
+
+    Returns:
+        dict: The report written to the results file.
+    """
+    results = []
+    for path in paths:
+        samples = read_samples(path)[:limit]
+        log = os.path.basename(path)
+        print(f"[BENCHMARK] {log} ({len(samples)} samples)")
+
+        fast = {"log": log, "mode": "fast", **replay(samples, classifier_options)}
+        fast["peak_memory_bytes"] = peak_memory(samples, classifier_options)
+        results.append(fast)
+        if realtime:
+            results.append({"log": log, "mode": "realtime", **replay(samples, classifier_options, realtime=True)})
+        if classifier_options.get("detector", "tree") == "tree":
+            results.append({"log": log, "mode": "recording", **replay_recording(path, classifier_options, limit)})
+
+    return {
+        "date": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "classifier": classifier_options,
+        "results": results,
+    }
+
+def print_report(report, previous=None):
+    """
+    Print a summary table, with the throughput ratio to a previous report if given.
+    """
+    reference = {}
+    if previous:
+        reference = {(r["log"], r["mode"]): r for r in previous["results"]}
+
+    print(f"{'log':<22}{'mode':<11}{'samples/s':>12}{'p50 us':>9}{'p95 us':>9}{'p99 us':>9}{'peak KiB':>10}"
+          f"{'1_shake':>9}{'2_shake':>9}{'vs ref':>8}")
+    for result in report["results"]:
+        latency = result.get("latency_us", {})
+        gestures = result.get("gestures", {})
+        line = (
+            f"{result['log']:<22}{result['mode']:<11}{result['throughput_samples_per_s']:>12.0f}"
+            f"{latency.get('p50', float('nan')):>9.1f}{latency.get('p95', float('nan')):>9.1f}"
+            f"{latency.get('p99', float('nan')):>9.1f}"
+            f"{result.get('peak_memory_bytes', float('nan')) / 1024:>10.1f}"
+            f"{gestures.get('1_shake', '-'):>9}{gestures.get('2_shake', '-'):>9}"
+        )
+        old = reference.get((result["log"], result["mode"]))
+        if old:
+            line += f"{result['throughput_samples_per_s'] / old['throughput_samples_per_s']:>7.2f}x"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the IMU gesture classifier on the recorded logs.")
+    parser.add_argument("paths", nargs="*", help="CSV logs (default: every log in peak_detection/logs)")
+    parser.add_argument("--filter-mode", choices=FILTER_MODES, default="offline")
+    parser.add_argument("--numeric", choices=NUMERIC_MODES, default="float")
+    parser.add_argument("--detector", choices=DETECTORS, default="tree")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy")
+    parser.add_argument("--hop", type=int, default=1)
+    parser.add_argument("--hold", type=int, default=0)
+    parser.add_argument("--realtime", action="store_true", help=f"also replay the logs at {SAMPLING_RATE} Hz")
+    parser.add_argument("--limit", type=int, help="number of samples replayed per log")
+    parser.add_argument("--output", help="results file (default: benchmarks/benchmark_<date>.json)")
+    parser.add_argument("--compare", help="previous results file to compare the throughput with")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(LOGS_PATH, "*.csv")))
+    options = {"filter_mode": args.filter_mode, "numeric": args.numeric, "detector": args.detector, "backend": args.backend, "hop": args.hop, "hold": args.hold}
+    report = run(paths, options, realtime=args.realtime, limit=args.limit)
+
+    output = args.output or os.path.join(RESULTS_PATH, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=4)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    print_report(report, previous)
+    print(f"[BENCHMARK] Results written to {output}")
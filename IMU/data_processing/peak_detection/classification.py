@@ -1,7 +1,6 @@
+import os
 import sys
-import asyncio
-from collections import deque
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -9,69 +8,1358 @@ from PyQt5.QtWidgets import (
     QLabel,
     QPushButton,
     QTextEdit,
-    QMessageBox,
 )
-from bleak import BleakClient
-from qasync import QEventLoop
+import time
+from collections import Counter
+from dataclasses import dataclass, replace
+from functools import lru_cache, wraps
 import numpy as np
-from scipy.signal import butter, filtfilt
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import butter, filtfilt, sosfilt, sosfilt_zi
 
-class Classification:
-    def __init__(self):
-        self.WINDOW_LENGTH = 52
-
-        self.time_buffer = deque(maxlen=self.WINDOW_LENGTH)
-        self.acc_x_buffer = deque(maxlen=self.WINDOW_LENGTH)
-        self.acc_y_buffer = deque(maxlen=self.WINDOW_LENGTH)
-        self.acc_z_buffer = deque(maxlen=self.WINDOW_LENGTH)
-        self.gyro_x_buffer = deque(maxlen=self.WINDOW_LENGTH)
-        self.gyro_y_buffer = deque(maxlen=self.WINDOW_LENGTH)
-        self.gyro_z_buffer = deque(maxlen=self.WINDOW_LENGTH)
-
-    def add_data(self, data_string):
-        # try:
-        values = data_string.split(',')
-        if len(values) == 7:  # Ensure correct data format
-            self.time_buffer.append(float(values[0]))
-            self.acc_x_buffer.append(float(values[1]))
-            self.acc_y_buffer.append(float(values[2]))
-            self.acc_z_buffer.append(float(values[3]))
-            self.gyro_x_buffer.append(float(values[4]))
-            self.gyro_y_buffer.append(float(values[5]))
-            self.gyro_z_buffer.append(float(values[6]))
-            if len(self.time_buffer) == self.WINDOW_LENGTH:  # Once the window is full, classify
-                return self.classify()
+from kernels import NUMBA_AVAILABLE, sample_step
+
+# The BLE session manager is shared with the IMU tools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "tools"))
+from ble_discovery import DiscoveryCache
+from ble_frames import as_bytes, decode_imu, is_frame, is_imu_payload, payload_text
+from ble_session import SessionEventsMixin
+
+FILTER_MODES = ("offline", "streaming")
+NUMERIC_MODES = ("float", "int")
+DETECTORS = ("tree", "goertzel")
+BACKENDS = ("numpy", "numba")
+GESTURES = ("1_shake", "2_shake")
+
+@dataclass(frozen=True)
+class ClassifierConfig:
+    """
+    Parameters of the gesture decision tree. The defaults are the values tuned
+    on the recorded logs, and match the hand module firmware.
+    """
+    window_length: int = 52  # Samples per window (1 s)
+    fs: float = 52  # Sampling frequency (Hz)
+    cutoff: float = 10  # Low-pass filter cutoff frequency (Hz)
+    filter_order: int = 4
+    acc_std_threshold: float = 100  # Below: "low energy motion" (mg)
+    gyro_std_threshold: float = 1000  # Below, with low energy motion: "stationary" (mdps)
+    acc_peak_threshold: float = 3e3  # Minimum filtered acc norm of a peak (mg)
+    gyro_peak_threshold: float = 1.5e6  # Minimum filtered gyro norm of a peak (mdps)
+
+@dataclass(frozen=True)
+class ShakeBandConfig:
+    """
+    Parameters of the Goertzel shake detector. The band covers bins 1 to 5 of a
+    26-sample window, i.e. 2 to 10 Hz at 52 Hz. A single tap keeps the band
+    above the threshold for about one window length, two shakes for longer.
+    """
+    window_length: int = 26  # Samples per Goertzel window (0.5 s)
+    bins: tuple = (1, 2, 3, 4, 5)  # DFT bins of the shake band, at k * fs / window_length Hz
+    amplitude_threshold: float = 300  # Above: shake band active (mg)
+    min_duration: int = 20  # Shorter bursts are ignored (samples)
+    two_shake_duration: int = 31  # Longer bursts are "2_shake" (samples)
+
+@dataclass(frozen=True)
+class CalibrationConfig:
+    """
+    Parameters of the adaptive thresholds. The std gates follow the rider's
+    noise floor (a low quantile of the window stds), the peak thresholds follow
+    the amplitude of the rider's gestures (a high quantile of the heights of the
+    filtered norm peaks above the baseline of the norm, its median: gravity for
+    the acc). Each std threshold is clamped to [min_ratio, max_ratio] times its
+    tuned value, each peak threshold to the baseline plus [min_ratio, max_ratio]
+    times the height of its tuned value.
+    """
+    noise_quantile: float = 0.1
+    amplitude_quantile: float = 0.9
+    std_factor: float = 3  # Std thresholds = std_factor * noise floor
+    peak_factor: float = 0.8  # Peak thresholds = baseline + peak_factor * gesture peak height
+    min_ratio: float = 0.5
+    max_ratio: float = 4
+    warmup: int = 520  # Samples (10 s) before the thresholds adapt
+
+@lru_cache(maxsize=None)
+def butter_lowpass_coefficients(cutoff, fs, order=4, output='ba'):
+    """
+    Design a Butterworth low-pass filter, once per set of parameters.
+
+    Parameters:
+        cutoff (float): Cutoff frequency of the filter in Hz.
+        fs (float): Sampling frequency in Hz.
+        order (int): Order of the filter.
+        output (str): 'ba' for (b, a) coefficients, 'sos' for second-order sections.
+
+    Returns:
+        tuple or array: (b, a) or the SOS array. Cached, do not modify in place.
+    """
+    nyquist = 0.5 * fs
+    normal_cutoff = cutoff / nyquist
+    return butter(order, normal_cutoff, btype='low', analog=False, output=output)
+
+def sosfilt_step(sos, state, x):
+    """
+    Advance a cascade of second-order sections by one sample, in direct form II
+    transposed as scipy.signal.sosfilt (and kernels.sample_step), without the
+    overhead of a sosfilt call per sample.
+
+    Parameters:
+        sos (list): Rows (b0, b1, b2, a0, a1, a2) of the sections, as floats, with a0 = 1.
+        state (list): The two delays [z0, z1] of each section, updated in place.
+        x (float): Input sample.
+
+    Returns:
+        float: Output sample.
+    """
+    for (b0, b1, b2, _, a1, a2), delays in zip(sos, state):
+        y = b0 * x + delays[0]
+        delays[0] = b1 * x - a1 * y + delays[1]
+        delays[1] = b2 * x - a2 * y
+        x = y
+    return x
+
+def load_log(path):
+    """
+    Load an IMU log recorded by BLE_visualizer (3 header rows, then
+    time[us],acc_x[mg],acc_y[mg],acc_z[mg],gyro_x[mdps],gyro_y[mdps],gyro_z[mdps]).
+
+    Parameters:
+        path (str): Path to the CSV file.
+
+    Returns:
+        np.ndarray: A (N, 7) float array.
+    """
+    return np.loadtxt(path, delimiter=',', skiprows=3, ndmin=2)
+
+def parse_samples(payload, n_channels=7, dtype=float):
+    """
+    Parse one or more "time,acc_x,acc_y,acc_z,gyro_x,gyro_y,gyro_z" lines, or a
+    binary frame of several samples (see ble_frames), without decoding them to
+    Python strings or floats one by one.
+
+    Parameters:
+        payload (bytes, bytearray, memoryview, str or list): Raw notification payload,
+            lines separated by newlines, or a list of payloads.
+        n_channels (int): Number of values per line.
+        dtype (type): Type of the values (e.g. np.int64 for the integer mg/mdps stream).
+
+    Returns:
+        np.ndarray: A (samples, n_channels) array.
+
+    Raises:
+        ValueError: If a payload is neither a frame nor complete numeric lines.
+    """
+    if isinstance(payload, (list, tuple)):
+        payloads = [as_bytes(data) for data in payload]
+        if not any(is_frame(data) for data in payloads):
+            return decode_imu(b"\n".join(data.strip() for data in payloads), n_channels, dtype)
+        return np.concatenate([decode_imu(data, n_channels, dtype) for data in payloads])
+    return decode_imu(payload, n_channels, dtype)
+
+def peak_kernel(signals, thresholds, return_amplitudes=False):
+    """
+    Count the peaks of a stack of signals for several thresholds in one pass.
+
+    A peak is where the derivative changes from positive to negative. As in
+    Classification.count_peaks, the first derivative sample is ignored and the
+    threshold is tested on the sample just before the peak.
+
+    Parameters:
+        signals (np.ndarray): Signals along the last axis, e.g. (signals, length)
+            or (windows, signals, length).
+        thresholds (float or sequence): Minimum value(s) to qualify as a peak.
+        return_amplitudes (bool): Also return the value at each counted peak.
+
+    Returns:
+        np.ndarray: Peak counts, shape signals.shape[:-1] + (thresholds,).
+        np.ndarray: If return_amplitudes, the amplitudes, shape
+            signals.shape[:-1] + (thresholds, length - 2), NaN where no peak is counted.
+    """
+    signals = np.asarray(signals, dtype=float)
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+
+    derivative = np.diff(signals, axis=-1)
+    derivative[..., 0] = 0
+    is_peak = (derivative[..., :-1] > 0) & (derivative[..., 1:] < 0)  # Peak at index i + 1
+
+    tested = np.where(is_peak, signals[..., :-2], -np.inf)
+    counted = tested[..., np.newaxis, :] > thresholds[:, np.newaxis]
+    counts = np.count_nonzero(counted, axis=-1)
+    if not return_amplitudes:
+        return counts
+    return counts, np.where(counted, signals[..., np.newaxis, 1:-1], np.nan)
+
+def window_features(acc_windows, norm_windows):
+    """
+    Compute the features used by the decision tree for a stack of windows, apart
+    from the peak counts.
+
+    Parameters:
+        acc_windows (np.ndarray): A (windows, 3, window_length) array of acc_x, acc_y, acc_z.
+        norm_windows (np.ndarray): A (windows, 2, window_length) array of acc and gyro norms.
+
+    Returns:
+        dict: One array per feature, with one value per window.
+    """
+    acc_std, gyro_std = np.std(norm_windows, axis=-1).T
+    acc_x_mean, acc_y_mean, acc_z_mean = np.mean(acc_windows, axis=-1).T
+    return {
+        "acc_std": acc_std,
+        "gyro_std": gyro_std,
+        "acc_xz_mean": acc_x_mean + acc_z_mean,
+        "acc_y_mean_abs": np.abs(acc_y_mean),
+        "acc_x_ptp": np.ptp(acc_windows[:, 0], axis=-1),
+        "acc_y_ptp": np.ptp(acc_windows[:, 1], axis=-1),
+    }
+
+def shake_candidates(features, config):
+    """
+    Returns:
+        np.ndarray: Mask of the windows that can still be a shake before counting peaks.
+    """
+    return (features["acc_std"] >= config.acc_std_threshold) & (features["acc_xz_mean"] < features["acc_y_mean_abs"])
+
+def decision_tree(features, acc_peaks, config):
+    """
+    Vectorized version of the decision tree of Classification.classify().
+
+    Parameters:
+        features (dict): Output of window_features.
+        acc_peaks (np.ndarray): Number of peaks in the filtered acc norm of each window.
+        config (ClassifierConfig): Thresholds of the tree.
+
+    Returns:
+        np.ndarray: One label per window (object array).
+    """
+    stationary = (features["acc_std"] < config.acc_std_threshold) & (features["gyro_std"] < config.gyro_std_threshold)
+    labels = np.where(stationary, "stationnary", "unknown").astype(object)
+
+    shake = shake_candidates(features, config)
+    labels[shake & (acc_peaks == 1) & (features["acc_x_ptp"] > features["acc_y_ptp"])] = "1_shake"
+    labels[shake & (acc_peaks >= 2) & (features["acc_y_ptp"] > features["acc_x_ptp"])] = "2_shake"
+    return labels
+
+class ClassificationStats:
+    """
+    Wall time and call counts of each classification stage, and how often each
+    branch of the decision tree is taken. See Classification(instrument=True).
+    """
+
+    STAGES = ("norm", "gate", "filter", "peaks", "decision")
+
+    def __init__(self, log_interval=None):
+        """
+        Parameters:
+            log_interval (float): If given, print a summary line every `log_interval` seconds.
+        """
+        self.time_ns = dict.fromkeys(self.STAGES, 0)
+        self.calls = dict.fromkeys(self.STAGES, 0)
+        self.branches = Counter()
+        self.log_interval = log_interval
+        self.last_log = time.monotonic()
+
+    def timed(self, stage, function):
+        """
+        Wrap a function so that its calls are accounted to a stage.
+        """
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            result = function(*args, **kwargs)
+            self.time_ns[stage] += time.perf_counter_ns() - start
+            self.calls[stage] += 1
+            return result
+        return wrapper
+
+    def timed_decision(self, classification, classify):
+        """
+        Wrap classify() (or band_decision()) so that its own time, minus the
+        stages it calls, is accounted to "decision", and the branch it took is counted.
+        """
+        @wraps(classify)
+        def wrapper(*args):
+            stages_before = sum(self.time_ns.values())
+            start = time.perf_counter_ns()
+            label = classify(*args)
+            elapsed = time.perf_counter_ns() - start
+            self.time_ns["decision"] += elapsed - (sum(self.time_ns.values()) - stages_before)
+            self.calls["decision"] += 1
+            self.branches[classification.branch] += 1
+
+            if self.log_interval is not None and time.monotonic() - self.last_log >= self.log_interval:
+                self.last_log = time.monotonic()
+                print(f"[STATS] {self.log_line()}")
+            return label
+        return wrapper
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Calls, total and mean time of each stage, and branch counts.
+        """
+        return {
+            "classifications": self.calls["decision"],
+            "stages": {
+                stage: {
+                    "calls": self.calls[stage],
+                    "total_ms": self.time_ns[stage] / 1e6,
+                    "mean_us": self.time_ns[stage] / self.calls[stage] / 1e3 if self.calls[stage] else 0.0,
+                }
+                for stage in self.STAGES
+            },
+            "branches": dict(self.branches),
+        }
+
+    def log_line(self):
+        """
+        Returns:
+            str: A one-line summary of the mean time per stage and the branch counts.
+        """
+        stages = " ".join(
+            f"{stage}={self.time_ns[stage] / self.calls[stage] / 1e3:.1f}us" if self.calls[stage] else f"{stage}=-"
+            for stage in self.STAGES
+        )
+        branches = " ".join(f"{branch}={count}" for branch, count in self.branches.most_common())
+        return f"{self.calls['decision']} classifications | {stages} | {branches}"
+
+class ShakeBandDetector:
+    """
+    Track the amplitude of the acc norm in the shake band with one sliding
+    Goertzel recurrence per bin, in O(1) per sample and per bin, and emit a
+    gesture at the end of each burst of band energy depending on its duration.
+    """
+    def __init__(self, config=None):
+        """
+        Parameters:
+            config (ShakeBandConfig): Band and burst parameters (default: ShakeBandConfig()).
+        """
+        self.config = config or ShakeBandConfig()
+        length = self.config.window_length
+        bins = np.asarray(self.config.bins)
+        if np.any(bins < 1) or np.any(bins >= length / 2):
+            raise ValueError(f"bins must be between 1 and {length} / 2, got {self.config.bins}.")
+
+        # Integer bins: the twiddle factor is 1 after a full window, so the sample
+        # leaving the window is subtracted as is and the mean (gravity) cancels out
+        self.twiddles = np.exp(2j * np.pi * bins / length)
+        # Weights of the direct DFT of the window, newest sample first
+        self.weights = self.twiddles[:, np.newaxis] ** np.arange(length)
+        # |X_k| = amplitude * length / 2, compared squared
+        self.energy_threshold = (self.config.amplitude_threshold * length / 2) ** 2
+
+        self.buffer = np.zeros(length)
+        self.state = np.zeros(len(bins), dtype=complex)
+        self.index = 0
+        self.started = False
+        self.duration = 0  # Samples since the band became active
+
+    def update(self, value):
+        """
+        Advance every bin by one sample.
+
+        Args:
+            value (float): The new acc norm.
+
+        Returns:
+            str or None: "1_shake" or "2_shake" when a burst ends, else None.
+        """
+        if not self.started:
+            # Start on a constant window, whose band is empty, to avoid a transient
+            self.buffer.fill(value)
+            self.started = True
+
+        old = self.buffer[self.index]
+        self.buffer[self.index] = value
+        self.state = self.twiddles * self.state + (value - old)
+        self.index = (self.index + 1) % self.config.window_length
+        if self.index == 0:
+            self.resync()
+
+        if self.energy() > self.energy_threshold:
+            self.duration += 1
+            return None
+
+        duration, self.duration = self.duration, 0
+        if duration >= self.config.two_shake_duration:
+            return "2_shake"
+        if duration >= self.config.min_duration:
+            return "1_shake"
+        return None
+
+    def energy(self):
+        """
+        Returns:
+            float: Sum of the squared magnitudes of the band bins.
+        """
+        return np.sum(np.square(self.state.real) + np.square(self.state.imag))
+
+    def band_amplitude(self):
+        """
+        Returns:
+            float: Amplitude of the acc norm in the shake band (mg).
+        """
+        return 2 * np.sqrt(self.energy()) / self.config.window_length
+
+    def resync(self):
+        """
+        Recompute the bins from the window with a direct DFT, once per window
+        (amortized O(1)), so that rounding errors of the recurrence cannot accumulate.
+        Called when the newest sample is the last of the buffer.
+        """
+        self.state = self.weights @ self.buffer[::-1]
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain and
+    Chlamtac, 1985): five markers whose heights are adjusted with a parabolic
+    prediction as observations arrive. Constant memory, no sorting once started.
+    """
+    def __init__(self, quantile):
+        """
+        Parameters:
+            quantile (float): The quantile to estimate, between 0 and 1.
+        """
+        if not 0 < quantile < 1:
+            raise ValueError(f"quantile must be between 0 and 1, got {quantile}.")
+        self.quantile = quantile
+        self.heights = []  # Marker heights, the first observations until there are 5
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5]
+        self.increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+        self.count = 0
+
+    def update(self, value):
+        """
+        Add one observation.
+
+        Args:
+            value (float): The observation.
+        """
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Cell of the observation, extending the extreme markers if needed
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        positions = self.positions
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in range(1, 4):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+                    (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+                    + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1])
+                )
+                if not heights[i - 1] < height < heights[i + 1]:
+                    # Parabolic prediction out of order, fall back to linear
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def value(self):
+        """
+        Returns:
+            float or None: The current estimate, None before the first observation.
+        """
+        if not self.heights:
+            return None
+        if self.count < 5:
+            return self.heights[min(int(self.quantile * len(self.heights)), len(self.heights) - 1)]
+        return self.heights[2]
+
+class ThresholdCalibration:
+    """
+    Derive the thresholds of the decision tree from the rider's own baseline,
+    tracked with P-square quantile estimators of the window stds, of the norms
+    and of the heights of their filtered peaks.
+    """
+    def __init__(self, config=None):
+        """
+        Parameters:
+            config (CalibrationConfig): Quantiles, factors and clamps (default: CalibrationConfig()).
+        """
+        self.config = config or CalibrationConfig()
+        self.acc_std = P2Quantile(self.config.noise_quantile)
+        self.gyro_std = P2Quantile(self.config.noise_quantile)
+        self.acc_baseline = P2Quantile(0.5)
+        self.gyro_baseline = P2Quantile(0.5)
+        self.acc_peak = P2Quantile(self.config.amplitude_quantile)
+        self.gyro_peak = P2Quantile(self.config.amplitude_quantile)
+        self.count = 0
+
+    def update(self, acc_std, gyro_std, acc_norm, gyro_norm):
+        """
+        Add the window stds and the norms of one sample.
+        """
+        self.acc_std.update(acc_std)
+        self.gyro_std.update(gyro_std)
+        self.acc_baseline.update(acc_norm)
+        self.gyro_baseline.update(gyro_norm)
+        self.count += 1
+
+    def update_peaks(self, acc_amplitudes, gyro_amplitudes, base_config):
+        """
+        Add the filtered norm values at the peaks of a window. Only their height
+        above the baseline is kept, so that gravity does not set the acc
+        threshold, and only for the peaks the lowest threshold allowed would
+        count: the bumps of a quiet ride are not gestures.
+
+        Args:
+            acc_amplitudes (np.ndarray): Filtered acc norm at each peak.
+            gyro_amplitudes (np.ndarray): Filtered gyro norm at each peak.
+            base_config (ClassifierConfig): The tuned configuration.
+        """
+        for amplitudes, baseline, peak, tuned in (
+                (acc_amplitudes, self.acc_baseline, self.acc_peak, base_config.acc_peak_threshold),
+                (gyro_amplitudes, self.gyro_baseline, self.gyro_peak, base_config.gyro_peak_threshold)):
+            floor = self.config.min_ratio * max(tuned - baseline.value(), 0)
+            for height in amplitudes - baseline.value():
+                if height > floor:
+                    peak.update(height)
+
+    def ready(self):
+        """
+        Returns:
+            bool: True once the warmup is over.
+        """
+        return self.count >= self.config.warmup
+
+    def thresholds(self, base_config):
+        """
+        Get the adapted thresholds.
+
+        Args:
+            base_config (ClassifierConfig): The tuned configuration, which sets the clamps.
+
+        Returns:
+            ClassifierConfig: base_config with adapted std and peak thresholds.
+        """
+        config = self.config
+
+        def clamp(value, tuned):
+            return float(min(max(value, config.min_ratio * tuned), config.max_ratio * tuned))
+
+        def peak_threshold(baseline, peak, tuned):
+            # Kept as tuned until a gesture peak is seen
+            if peak.value() is None:
+                return tuned
+            baseline = baseline.value()
+            return baseline + clamp(config.peak_factor * peak.value(), max(tuned - baseline, 0))
+
+        return replace(
+            base_config,
+            acc_std_threshold=clamp(config.std_factor * self.acc_std.value(), base_config.acc_std_threshold),
+            gyro_std_threshold=clamp(config.std_factor * self.gyro_std.value(), base_config.gyro_std_threshold),
+            acc_peak_threshold=peak_threshold(self.acc_baseline, self.acc_peak, base_config.acc_peak_threshold),
+            gyro_peak_threshold=peak_threshold(self.gyro_baseline, self.gyro_peak, base_config.gyro_peak_threshold),
+        )
+
+class Resampler:
+    """
+    Resample a stream of samples onto a uniform time grid, from the time[us] of
+    each sample, with linear interpolation vectorized over each batch. Irregular
+    or bunched BLE delivery then reaches the classifier at exactly `rate` Hz,
+    and a firmware running faster is decimated on the host.
+    """
+    def __init__(self, rate, max_gap=0.25, smoothing=0.05):
+        """
+        Parameters:
+            rate (float): Output rate (Hz).
+            max_gap (float): Longer gaps between two samples (s) are not
+                interpolated: the grid restarts on the next sample.
+            smoothing (float): Weight of each new interval in the input rate estimate.
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}.")
+        self.rate = rate
+        self.period = 1e6 / rate  # us
+        self.max_gap = max_gap * 1e6
+        self.smoothing = smoothing
+
+        self.last = None  # Last input sample, start of the next interpolation interval
+        self.next_time = None  # Next grid time (us)
+        self.mean_interval = None  # Smoothed input interval (us)
+        self.restarts = 0  # Gaps and backward jumps of time[us]
+
+    def push(self, samples):
+        """
+        Add input samples and get the grid samples they complete.
+
+        Args:
+            samples (np.ndarray): A (N, 7) array, time[us] first, in time order.
+
+        Returns:
+            np.ndarray: A (M, 7) array of resampled samples, with their grid times.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if self.last is not None:
+            samples = np.concatenate((self.last[np.newaxis], samples))
+        times = samples[:, 0]
+
+        # Restart the grid after a gap, or when time[us] goes back (module reset)
+        intervals = np.diff(times)
+        broken = (intervals <= 0) | (intervals > self.max_gap)
+        for interval in intervals[~broken]:  # A few intervals per batch
+            if self.mean_interval is None:
+                self.mean_interval = interval
             else:
-                return "stationnary"
-        # except ValueError:
-        #     print(f"[ERREUR] Impossible de convertir les données : {data_string}")
-        # except Exception as e:
-        #     print(f"[ERREUR] Erreur inattendue lors de l'ajout des données : {e}")
+                self.mean_interval += self.smoothing * (interval - self.mean_interval)
+
+        if self.next_time is None:
+            self.next_time = times[0]
+        segments = np.split(samples, np.flatnonzero(broken) + 1)
+        output = [self.interpolate(segments[0])]
+        for segment in segments[1:]:
+            self.restarts += 1
+            self.next_time = segment[0, 0]
+            output.append(self.interpolate(segment))
+
+        self.last = samples[-1]
+        return np.concatenate(output)
+
+    def interpolate(self, segment):
+        """
+        Interpolate the grid times of a segment with increasing times.
+
+        Returns:
+            np.ndarray: A (M, 7) array.
+        """
+        times = segment[:, 0]
+        count = int(np.floor((times[-1] - self.next_time) / self.period)) + 1
+        if count <= 0:
+            return np.empty((0, segment.shape[1]))
+        grid = self.next_time + self.period * np.arange(count)
+        self.next_time = grid[-1] + self.period
 
-    def calculate_norm(self, buffer_x, buffer_y, buffer_z):
+        # Interval of each grid time, then one weighted sum for every channel.
+        # The grid lies within the segment, so the index is in range.
+        index = np.searchsorted(times, grid, side='right') - 1
+        following = np.minimum(index + 1, len(times) - 1)
+        span = times[following] - times[index]
+        weight = np.divide(grid - times[index], span, out=np.zeros(count), where=span > 0)
+        resampled = segment[index] + weight[:, np.newaxis] * (segment[following] - segment[index])
+        resampled[:, 0] = grid
+        return resampled
+
+    def input_rate(self):
         """
-        Calculate the norm for a deque buffer containing X, Y, and Z components.
+        Returns:
+            float or None: Effective input rate (Hz), from the smoothed interval
+            between time[us] stamps. None before two samples.
+        """
+        if self.mean_interval is None:
+            return None
+        return 1e6 / self.mean_interval
+
+class Classification:
+    def __init__(self, filter_mode="offline", hop=1, hold=0, instrument=False, log_interval=None, config=None,
+                 numeric="float", detector="tree", band_config=None, backend="numpy", scales=(),
+                 calibration=None, resample=False):
+        """
+        Parameters:
+            filter_mode (str): "offline" applies a zero-phase filtfilt to the whole
+                window at each classification (most accurate, used to tune the
+                decision tree). "streaming" advances a causal filter by one sample
+                in add_sample and classifies on the filtered ring buffer.
+            hop (int): Classify every `hop` samples. The window is also classified
+                as soon as it enters or leaves the stationary state.
+            hold (int): After a gesture is emitted, further gesture decisions are
+                suppressed until `hold` samples pass without one, so each gesture
+                is emitted once. 0 disables the debounce. Should be >= hop.
+            instrument (bool): Record per-stage timings and branch counts, see stats().
+                Nothing is wrapped nor timed when disabled.
+            log_interval (float): With instrument, print a stats line every `log_interval` seconds.
+            config (ClassifierConfig): Thresholds and filter parameters (default: ClassifierConfig()).
+            numeric (str): "float" keeps the samples as floats. "int" keeps the integer
+                mg/mdps samples as integers, sums their squared norms exactly in int64
+                and compares the norm variances with pre-squared std thresholds. The
+                norms are then only square-rooted per sample when a stage needs them
+                (streaming filter, scales, "goertzel" detector, calibration), else for
+                the window when it is gated or classified (see window_norms).
+            detector (str): "tree" classifies the window with the decision tree
+                (see classify). "goertzel" tracks the shake band energy of every
+                sample instead (see ShakeBandDetector), which ignores `hop`.
+            band_config (ShakeBandConfig): Parameters of the "goertzel" detector.
+            backend (str): "numpy" runs add_sample as a few NumPy calls. "numba" runs
+                it as one compiled kernel per sample (see kernels.py), which in
+                "streaming" filter mode also keeps the peak flags up to date. Falls
+                back to "numpy" when Numba is not installed. Only for numeric="float".
+            scales (sequence): Extra window lengths (samples), e.g. (26, 104) for 0.5 s
+                and 2 s. Prefix sums over the longest one are kept, so that the means
+                and variances of every scale come out in O(1) (see scale_features).
+            calibration (CalibrationConfig): If given, adapt the std and peak
+                thresholds to the rider once per window, from running quantiles
+                of the window stds, norms and peak heights (see
+                ThresholdCalibration). `config` then holds the current thresholds
+                and `base_config` the tuned ones.
+            resample (bool): Resample the input onto a uniform `config.fs` grid from
+                its time[us] column (see Resampler), so that the filter design holds
+                whatever the firmware rate and the BLE jitter.
+        """
+        if filter_mode not in FILTER_MODES:
+            raise ValueError(f"filter_mode must be one of {FILTER_MODES}, got {filter_mode!r}.")
+        if numeric not in NUMERIC_MODES:
+            raise ValueError(f"numeric must be one of {NUMERIC_MODES}, got {numeric!r}.")
+        if detector not in DETECTORS:
+            raise ValueError(f"detector must be one of {DETECTORS}, got {detector!r}.")
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}.")
+        if backend == "numba" and numeric != "float":
+            raise ValueError("The numba backend only supports numeric=\"float\".")
+        if backend == "numba" and not NUMBA_AVAILABLE:
+            print("[KERNELS] Numba is not installed, falling back to the NumPy backend.")
+            backend = "numpy"
+        if any(length < 1 for length in scales):
+            raise ValueError(f"scales must be positive window lengths, got {scales}.")
+        if hop < 1:
+            raise ValueError(f"hop must be at least 1, got {hop}.")
+        if hold < 0:
+            raise ValueError(f"hold must be positive or 0, got {hold}.")
+
+        self.config = config or ClassifierConfig()
+        self.WINDOW_LENGTH = self.config.window_length
+        self.N_CHANNELS = 7  # time, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z
+        self.filter_mode = filter_mode
+        self.numeric = numeric
+        # int64 rather than int32: time[us] overflows int32 after 35 minutes
+        dtype = np.int64 if numeric == "int" else float
+
+        # Ring buffer holding one row per sample. Each sample is written twice,
+        # WINDOW_LENGTH rows apart, so the last WINDOW_LENGTH samples are always
+        # available as a contiguous, chronologically ordered slice.
+        self.buffer = np.zeros((2 * self.WINDOW_LENGTH, self.N_CHANNELS), dtype=dtype)
+        # Same layout for the (acc_norm, gyro_norm) of each sample
+        self.norm_buffer = np.zeros((2 * self.WINDOW_LENGTH, 2))
+        self.write_index = 0
+        self.sample_count = 0
+
+        # Sliding-window statistics, updated in O(1) per sample. The empty
+        # buffer is a window of zeros, so they are exact once it is full.
+        self.norm_mean = np.zeros(2)  # Mean of (acc_norm, gyro_norm)
+        self.norm_m2 = np.zeros(2)  # Sum of squared deviations (Welford)
+        self.axis_sum = np.zeros(self.N_CHANNELS - 1, dtype=dtype)  # Sum of each sensor axis
+        if numeric == "int":
+            # Variance of the norms as E[norm^2] - E[norm]^2, with E[norm^2] exact
+            self.sq_norm_buffer = np.zeros((2 * self.WINDOW_LENGTH, 2), dtype=np.int64)
+            self.sq_norm_sum = np.zeros(2, dtype=np.int64)
+        # Without a stage reading the norm of each sample, the int path leaves
+        # norm_buffer empty and takes the square roots of the window on demand
+        self.lazy_norms = numeric == "int" and filter_mode == "offline" and not scales \
+            and detector == "tree" and calibration is None
+        self.lazy_window = (None, None, None)  # (sample_count, norms of the window, their sums)
+        self.lazy_gate = (None, None)  # (sample_count, gate())
+        self.base_config = self.config
+        self.set_thresholds(self.config)
+        self.calibration = ThresholdCalibration(calibration) if calibration is not None else None
+        self.resampler = Resampler(self.config.fs) if resample else None
+
+        # Streaming filter: coefficients, carried state and filtered norms (same layout as norm_buffer)
+        self.sos = butter_lowpass_coefficients(self.config.cutoff, self.config.fs, self.config.filter_order, output='sos')
+        self.sos_rows = self.sos.tolist()  # For sosfilt_step
+        self.filter_zi = None
+        self.filtered_buffer = np.zeros((2 * self.WINDOW_LENGTH, 2))
+
+        # Prefix sums of (acc_norm, gyro_norm, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z)
+        # and of their squares, for the last history_length samples. Row prefix_index
+        # holds the sums up to the newest sample.
+        self.scales = tuple(sorted(scales))
+        self.history_length = max(self.scales, default=0)
+        self.prefix_sum = np.zeros((self.history_length + 1, 8))
+        self.prefix_sq_sum = np.zeros((self.history_length + 1, 8))
+        self.prefix_index = 0
+
+        self.backend = backend
+        if backend == "numba":
+            # Peaks of the filtered norms (same layout as norm_buffer) and last gate, kept by the kernel
+            self.peak_flags = np.zeros((2 * self.WINDOW_LENGTH, 2), dtype=np.int8)
+            self.gate_state = 0
+
+        # Decision scheduler
+        self.hop = hop
+        self.hold = hold
+        self.samples_since_evaluation = hop  # Classify as soon as the window is full
+        self.was_stationary = None
+        self.hold_remaining = 0
+
+        self.detector = detector
+        self.band_detector = ShakeBandDetector(band_config) if detector == "goertzel" else None
+
+        # Last decision tree branch taken by classify()
+        self.branch = None
+        self.instrumentation = None
+        if instrument:
+            self.enable_instrumentation(log_interval)
+
+    def enable_instrumentation(self, log_interval=None):
+        """
+        Time every classification stage by wrapping the methods that implement it
+        on this instance. The class methods are left untouched, so a classifier
+        created without instrumentation pays nothing.
+
+        Args:
+            log_interval (float): If given, print a stats line every `log_interval` seconds.
+        """
+        self.instrumentation = ClassificationStats(log_interval)
+        stages = {
+            "calculate_norm": "norm",
+            "calculate_squared_norm": "norm",
+            "gate": "gate",
+            "axis_mean": "gate",
+            "butter_lowpass_filter": "filter",
+            "lowpass_step": "filter",
+            "count_peaks": "peaks",
+            "count_peaks_batch": "peaks",
+        }
+        for method, stage in stages.items():
+            setattr(self, method, self.instrumentation.timed(stage, getattr(self, method)))
+        self.classify = self.instrumentation.timed_decision(self, self.classify)
+        if self.band_detector is not None:
+            # The Goertzel recurrences are the filter of the "goertzel" detector
+            self.band_detector.update = self.instrumentation.timed("filter", self.band_detector.update)
+            self.band_decision = self.instrumentation.timed_decision(self, self.band_decision)
+
+    def stats(self):
+        """
+        Get a snapshot of the instrumentation (see ClassificationStats.snapshot).
+
+        Returns:
+            dict or None: The snapshot, or None if instrumentation is disabled.
+        """
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.snapshot()
+
+    def add_data(self, data):
+        """
+        Add one "time,acc_x,acc_y,acc_z,gyro_x,gyro_y,gyro_z" sample, or the samples
+        of one binary frame, and classify if scheduled.
+
+        Args:
+            data (bytes, bytearray, memoryview or str): The raw sample, as received over BLE.
+
+        Returns:
+            str or None: The classification, or None when the sample is malformed,
+            when the scheduler skipped the classification or when a gesture
+            decision was debounced. For several samples, the first gesture, else
+            the result of the last sample.
+        """
+        try:
+            samples = parse_samples(data, self.N_CHANNELS, self.buffer.dtype)
+        except ValueError:
+            return None
+        if len(samples) != 1 and not is_frame(data):  # Ensure correct data format
+            return None
+        if self.resampler is not None:
+            # A sample completes zero, one or a few grid samples
+            samples = self.resample(samples)
+        labels = [self.add_values(sample) for sample in samples]
+        gestures = [label for label in labels if label in GESTURES]
+        return gestures[0] if gestures else (labels[-1] if labels else None)
+
+    def add_data_batch(self, data):
+        """
+        Add several newline-separated samples parsed from one buffer in a single call.
+
+        Args:
+            data (bytes, bytearray, memoryview, str or list): The raw samples, or
+                a list of notification payloads (text or binary frames).
+
+        Returns:
+            list: The result of add_data for each sample, or for each grid sample
+            when resampling.
+
+        Raises:
+            ValueError: If the buffer is not made of complete numeric lines.
+        """
+        samples = parse_samples(data, self.N_CHANNELS, self.buffer.dtype)
+        if self.resampler is not None:
+            samples = self.resample(samples)
+        return [self.add_values(sample) for sample in samples]
+
+    def resample(self, samples):
+        """
+        Pass parsed samples through the resampler.
+
+        Returns:
+            np.ndarray: The grid samples, rounded in "int" mode.
+        """
+        resampled = self.resampler.push(samples)
+        return np.rint(resampled) if self.numeric == "int" else resampled
+
+    def add_values(self, sample):
+        """
+        Add one parsed sample and classify if scheduled.
 
         Args:
-            buffer_x (deque): Deque containing X-component data.
-            buffer_y (deque): Deque containing Y-component data.
-            buffer_z (deque): Deque containing Z-component data.
+            sample (np.ndarray): The 7 values of the sample.
+
+        Returns:
+            str or None: See add_data.
+        """
+        self.add_sample(sample)
+        if self.calibration is not None and self.sample_count >= self.WINDOW_LENGTH:
+            self.calibrate()
+        if self.band_detector is not None:
+            return self.classify_band()
+        if self.sample_count >= self.WINDOW_LENGTH:  # Once the window is full, classify
+            return self.schedule()
+        else:
+            return "stationnary"
+
+    def schedule(self):
+        """
+        Classify the window every `hop` samples or when it enters or leaves the
+        stationary state, and debounce the gesture decisions.
 
         Returns:
-            list: A list of norms corresponding to each index in the buffer.
+            str or None: The classification, or None if it was skipped or debounced.
         """
-        # Ensure all buffers have the same length
-        if not (len(buffer_x) == len(buffer_y) == len(buffer_z)):
-            raise ValueError("All buffers must have the same length.")
+        self.samples_since_evaluation += 1
+        if self.hold_remaining > 0:
+            self.hold_remaining -= 1
 
-        # Compute norms
-        norms = [
-            np.sqrt(x**2 + y**2 + z**2)
-            for x, y, z in zip(buffer_x, buffer_y, buffer_z)
-        ]
+        # Cheap trigger: same test as the first branch of classify(), in O(1)
+        low_energy, low_rotation = self.gate()
+        stationary = low_energy and low_rotation
+        triggered = stationary != self.was_stationary
+        self.was_stationary = stationary
 
+        if self.samples_since_evaluation < self.hop and not triggered:
+            return None
+        self.samples_since_evaluation = 0
+
+        return self.debounce(self.classify())
+
+    def calibrate(self):
+        """
+        Feed the window stds and the newest norms to the calibration, and once
+        per window the peaks of the filtered norms, then adapt the thresholds
+        after the warmup.
+        """
+        acc_std, gyro_std = self.norm_std()
+        acc_norm, gyro_norm = self.norm_buffer[self.write_index - 1 + self.WINDOW_LENGTH]
+        self.calibration.update(acc_std, gyro_std, acc_norm, gyro_norm)
+        if self.write_index == 0:
+            # Each sample is in one of these windows, every peak is seen once
+            _, amplitudes = peak_kernel(self.filtered_norms(), -np.inf, return_amplitudes=True)
+            acc_amplitudes, gyro_amplitudes = amplitudes[:, 0]
+            self.calibration.update_peaks(acc_amplitudes[~np.isnan(acc_amplitudes)], gyro_amplitudes[~np.isnan(gyro_amplitudes)],
+                                          self.base_config)
+            if self.calibration.ready():
+                self.set_thresholds(self.calibration.thresholds(self.base_config))
+
+    def set_thresholds(self, config):
+        """
+        Use the thresholds of another configuration. The filter parameters must not change.
+
+        Args:
+            config (ClassifierConfig): The new configuration.
+        """
+        self.config = config
+        # Gate thresholds on the variances, so that no square root is needed
+        self.acc_var_threshold = config.acc_std_threshold ** 2
+        self.gyro_var_threshold = config.gyro_std_threshold ** 2
+        self.lazy_gate = (None, None)
+
+    def classify_band(self):
+        """
+        Feed the newest acc norm to the Goertzel shake detector.
+
+        Returns:
+            str or None: The gesture ending at this sample, else "stationnary" or
+            "unknown" from the first branch of the decision tree.
+        """
+        gesture = self.band_detector.update(self.norm_buffer[self.write_index - 1 + self.WINDOW_LENGTH, 0])
+        if self.sample_count < self.WINDOW_LENGTH:
+            return "stationnary"
+        return self.band_decision(gesture)
+
+    def band_decision(self, gesture):
+        """
+        Decide on a full window in "goertzel" mode, the counterpart of classify().
+
+        Args:
+            gesture (str or None): Output of the shake detector for the newest sample.
+
+        Returns:
+            str or None: See classify_band.
+        """
+        if self.hold_remaining > 0:
+            self.hold_remaining -= 1
+
+        if gesture is not None:
+            self.branch = gesture
+            return self.debounce(gesture)
+        low_energy, low_rotation = self.gate()
+        self.branch = "stationary" if low_energy and low_rotation else "band_inactive"
+        return "stationnary" if low_energy and low_rotation else "unknown"
+
+    def debounce(self, label):
+        """
+        Emit a gesture once, then hold until `hold` samples pass without gesture.
+
+        Args:
+            label (str): Output of classify().
+
+        Returns:
+            str or None: The label, or None for a repeat of a gesture being held.
+        """
+        if self.hold == 0 or label not in GESTURES:
+            return label
+
+        repeat = self.hold_remaining > 0
+        self.hold_remaining = self.hold
+        return None if repeat else label
+
+    def add_sample(self, sample):
+        """
+        Store one sample in the ring buffer.
+
+        Args:
+            sample (sequence): The 7 values (time, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z).
+        """
+        sample = np.asarray(sample, dtype=self.buffer.dtype)
+        if self.backend == "numba":
+            self.add_sample_compiled(sample)
+            if self.scales:
+                self.update_history(self.norm_buffer[self.write_index - 1 + self.WINDOW_LENGTH], sample)
+            return
+
+        if self.numeric == "int":
+            sq_norms = self.calculate_squared_norm(sample[1:].reshape(2, 3))
+            # Exact integer update, with the oldest squared norms of the window
+            self.sq_norm_sum += sq_norms - self.sq_norm_buffer[self.write_index]
+            self.sq_norm_buffer[self.write_index] = sq_norms
+            self.sq_norm_buffer[self.write_index + self.WINDOW_LENGTH] = sq_norms
+            if self.lazy_norms:
+                self.axis_sum += sample[1:] - self.buffer[self.write_index, 1:]
+                self.buffer[self.write_index] = sample
+                self.buffer[self.write_index + self.WINDOW_LENGTH] = sample
+                self.write_index = (self.write_index + 1) % self.WINDOW_LENGTH
+                self.sample_count += 1
+                return
+            norms = np.sqrt(sq_norms)
+        else:
+            norms = self.calculate_norm(sample[1:].reshape(2, 3))
+
+        # The row about to be overwritten is the oldest sample of the window
+        self.update_statistics(self.buffer[self.write_index], self.norm_buffer[self.write_index], sample, norms)
+
+        self.buffer[self.write_index] = sample
+        self.buffer[self.write_index + self.WINDOW_LENGTH] = sample
+        self.norm_buffer[self.write_index] = norms
+        self.norm_buffer[self.write_index + self.WINDOW_LENGTH] = norms
+        if self.filter_mode == "streaming":
+            filtered = self.lowpass_step(norms)
+            self.filtered_buffer[self.write_index] = filtered
+            self.filtered_buffer[self.write_index + self.WINDOW_LENGTH] = filtered
+        self.write_index = (self.write_index + 1) % self.WINDOW_LENGTH
+        self.sample_count += 1
+
+        if self.write_index == 0:
+            self.resync_statistics()
+        if self.scales:
+            self.update_history(norms, sample)
+
+    def add_sample_compiled(self, sample):
+        """
+        Same as add_sample (and gate) with the compiled kernel of the "numba" backend.
+
+        Args:
+            sample (np.ndarray): The 7 values of the sample, as floats.
+        """
+        if self.filter_zi is None:
+            # Steady state on the first sample, as lowpass_step
+            self.filter_zi = sosfilt_zi(self.sos)[:, :, np.newaxis] * self.calculate_norm(sample[1:].reshape(2, 3))
+
+        config = self.config
+        self.gate_state = sample_step(
+            sample, self.buffer, self.norm_buffer, self.filtered_buffer, self.peak_flags,
+            self.norm_mean, self.norm_m2, self.axis_sum, self.sos, self.filter_zi, self.write_index,
+            self.filter_mode == "streaming", config.acc_peak_threshold, config.gyro_peak_threshold,
+            config.acc_std_threshold, config.gyro_std_threshold,
+        )
+        self.write_index = (self.write_index + 1) % self.WINDOW_LENGTH
+        self.sample_count += 1
+
+    def lowpass_step(self, norms):
+        """
+        Advance the streaming low-pass filter by one sample.
+
+        Args:
+            norms (np.ndarray): The (acc_norm, gyro_norm) of the new sample.
+
+        Returns:
+            list: The filtered (acc_norm, gyro_norm).
+        """
+        if self.filter_zi is None:
+            # Start in steady state on the first sample to avoid a step transient,
+            # one [section][delay] state per norm
+            self.filter_zi = [(sosfilt_zi(self.sos) * norm).tolist() for norm in norms]
+
+        return [sosfilt_step(self.sos_rows, state, norm) for state, norm in zip(self.filter_zi, norms.tolist())]
+
+    def update_statistics(self, old_sample, old_norms, sample, norms):
+        """
+        Slide the window statistics by one sample (Welford add/remove, or plain
+        sums in "int" mode).
+
+        Args:
+            old_sample (np.ndarray): The sample leaving the window.
+            old_norms (np.ndarray): Its (acc_norm, gyro_norm).
+            sample (np.ndarray): The sample entering the window.
+            norms (np.ndarray): Its (acc_norm, gyro_norm).
+        """
+        self.axis_sum += sample[1:] - old_sample[1:]
+        if self.numeric == "int":
+            return  # The variances come from sq_norm_sum and window_norms
+
+        delta = norms - old_norms
+        new_mean = self.norm_mean + delta / self.WINDOW_LENGTH
+        self.norm_m2 += delta * (norms - new_mean + old_norms - self.norm_mean)
+        self.norm_mean = new_mean
+
+    def resync_statistics(self):
+        """
+        Recompute the window statistics from scratch.
+
+        Called once per window (amortized O(1)) so that rounding errors of the
+        incremental updates cannot accumulate.
+        """
+        if self.numeric == "int":
+            return  # The integer sums are exact
+
+        norms = self.window_norms()
+        self.norm_mean = np.mean(norms, axis=0)
+        self.norm_m2 = np.sum(np.square(norms - self.norm_mean), axis=0)
+        self.axis_sum = np.sum(self.window()[:, 1:], axis=0)
+
+    def update_history(self, norms, sample):
+        """
+        Append one sample to the prefix sums of the multi-scale history.
+
+        Args:
+            norms (np.ndarray): Its (acc_norm, gyro_norm).
+            sample (np.ndarray): Its 7 values.
+        """
+        values = np.concatenate((norms, sample[1:]))
+        newest = self.prefix_index
+        self.prefix_index = (newest + 1) % (self.history_length + 1)
+        self.prefix_sum[self.prefix_index] = self.prefix_sum[newest] + values
+        self.prefix_sq_sum[self.prefix_index] = self.prefix_sq_sum[newest] + np.square(values)
+
+        if self.prefix_index == 0:
+            # Rebase on the oldest prefix sum once per history (amortized O(1)),
+            # so that the sums stay small and the differences precise
+            oldest = 1
+            self.prefix_sum -= self.prefix_sum[oldest].copy()
+            self.prefix_sq_sum -= self.prefix_sq_sum[oldest].copy()
+
+    def window_statistics(self, length):
+        """
+        Get the means and variances of the last `length` samples from the prefix
+        sums. Before `length` samples, the missing ones count as zeros, as in the
+        main window.
+
+        Args:
+            length (int): Window length, at most the longest of `scales`.
+
+        Returns:
+            tuple: (means, variances) of (acc_norm, gyro_norm, acc_x, acc_y, acc_z,
+            gyro_x, gyro_y, gyro_z).
+        """
+        if not 1 <= length <= self.history_length:
+            raise ValueError(f"length must be between 1 and {self.history_length}, got {length}.")
+
+        start = (self.prefix_index - length) % (self.history_length + 1)
+        mean = (self.prefix_sum[self.prefix_index] - self.prefix_sum[start]) / length
+        mean_sq = (self.prefix_sq_sum[self.prefix_index] - self.prefix_sq_sum[start]) / length
+        return mean, np.maximum(mean_sq - np.square(mean), 0)
+
+    def scale_features(self):
+        """
+        Get the features of the decision tree gate at every scale.
+
+        Returns:
+            dict: For each window length of `scales`, a dict of acc_std, gyro_std,
+            acc_xz_mean and acc_y_mean_abs.
+        """
+        features = {}
+        for length in self.scales:
+            mean, variance = self.window_statistics(length)
+            acc_std, gyro_std = np.sqrt(variance[:2])
+            features[length] = {
+                "acc_std": acc_std,
+                "gyro_std": gyro_std,
+                "acc_xz_mean": mean[2] + mean[4],
+                "acc_y_mean_abs": abs(mean[3]),
+            }
+        return features
+
+    def norm_std(self):
+        """
+        Get the standard deviations of the norms over the window.
+
+        Returns:
+            tuple: (acc_std, gyro_std).
+        """
+        acc_std, gyro_std = np.sqrt(np.maximum(self.norm_var(), 0))
+        return acc_std, gyro_std
+
+    def norm_var(self):
+        """
+        Get the variances of the norms over the window.
+
+        Returns:
+            np.ndarray: (acc_var, gyro_var).
+        """
+        if self.numeric == "int":
+            norm_sum = np.array(self.window_norm_sums())
+            return (self.WINDOW_LENGTH * self.sq_norm_sum - np.square(norm_sum)) / self.WINDOW_LENGTH ** 2
+        return self.norm_m2 / self.WINDOW_LENGTH
+
+    def gate(self):
+        """
+        Evaluate the "low energy motion" and "low rotation" conditions of the
+        decision tree from the sliding-window statistics.
+
+        Returns:
+            tuple: (acc_std < acc_std_threshold, gyro_std < gyro_std_threshold).
+        """
+        if self.backend == "numba":
+            # Evaluated by the kernel on the last sample
+            return bool(self.gate_state & 1), bool(self.gate_state & 2)
+        if self.numeric == "int":
+            if self.lazy_gate[0] == self.sample_count:  # Already gated by schedule()
+                return self.lazy_gate[1]
+            length = self.WINDOW_LENGTH
+            below = []
+            for channel, (sq_sum, threshold) in enumerate(zip(self.sq_norm_sum.tolist(), (self.acc_var_threshold, self.gyro_var_threshold))):
+                # var(norm) <= E[norm^2], so a window of small squared norms (e.g. the
+                # gyro at rest) passes on the exact integer sum, without square roots
+                if sq_sum < length * threshold:
+                    below.append(True)
+                    continue
+                # W^2 var(norm) = W sum(norm^2) - sum(norm)^2, only sum(norm) is a float
+                # (rounded square roots), which the float path matches on the logs
+                norm_sum = self.window_norm_sums()[channel]
+                below.append(length * sq_sum - norm_sum * norm_sum < length * length * threshold)
+            self.lazy_gate = (self.sample_count, (below[0], below[1]))
+            return below[0], below[1]
+
+        acc_std, gyro_std = self.norm_std()
+        return acc_std < self.config.acc_std_threshold, gyro_std < self.config.gyro_std_threshold
+
+    def axis_mean(self):
+        """
+        Get the mean of each sensor axis over the window.
+
+        Returns:
+            np.ndarray: Means of (acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z).
+        """
+        return self.axis_sum / self.WINDOW_LENGTH
+
+    def window(self):
+        """
+        Get the last WINDOW_LENGTH samples, oldest first.
+
+        Returns:
+            np.ndarray: A (WINDOW_LENGTH, 7) view on the ring buffer (no copy).
+        """
+        return self.buffer[self.write_index:self.write_index + self.WINDOW_LENGTH]
+
+    def window_norms(self):
+        """
+        Get the (acc_norm, gyro_norm) of the last WINDOW_LENGTH samples, oldest first.
+
+        Returns:
+            np.ndarray: A (WINDOW_LENGTH, 2) view on the norm ring buffer (no copy).
+            With lazy_norms, the square roots of the squared norms of the window,
+            taken once per sample however many times they are read.
+        """
+        if not self.lazy_norms:
+            return self.norm_buffer[self.write_index:self.write_index + self.WINDOW_LENGTH]
+        count, norms, sums = self.lazy_window
+        if count != self.sample_count:
+            norms = np.sqrt(self.sq_norm_buffer[self.write_index:self.write_index + self.WINDOW_LENGTH])
+            self.lazy_window = (self.sample_count, norms, None)
         return norms
 
+    def window_norm_sums(self):
+        """
+        Get the sums of the (acc_norm, gyro_norm) of the window, for the int path.
+
+        Returns:
+            list: [acc_norm_sum, gyro_norm_sum].
+        """
+        norms = self.window_norms()
+        if not self.lazy_norms:
+            return norms.sum(axis=0).tolist()
+        count, norms, sums = self.lazy_window
+        if sums is None:
+            sums = norms.sum(axis=0).tolist()
+            self.lazy_window = (count, norms, sums)
+        return sums
+
+    def window_filtered(self):
+        """
+        Get the causally filtered (acc_norm, gyro_norm) of the window, oldest first.
+        Only maintained in "streaming" filter mode.
+
+        Returns:
+            np.ndarray: A (WINDOW_LENGTH, 2) view on the filtered ring buffer (no copy).
+        """
+        return self.filtered_buffer[self.write_index:self.write_index + self.WINDOW_LENGTH]
+
+    def calculate_norm(self, vectors):
+        """
+        Calculate the norm of every X, Y, Z vector in an array.
+
+        Args:
+            vectors (np.ndarray): Array whose last axis holds the X, Y and Z components.
+
+        Returns:
+            np.ndarray: The norms, with the same shape as `vectors` minus the last axis.
+        """
+        if vectors.shape[-1] != 3:
+            raise ValueError("The last axis must hold the X, Y and Z components.")
+
+        return np.sqrt(np.sum(np.square(vectors), axis=-1))
+
+    def calculate_squared_norm(self, vectors):
+        """
+        Calculate the squared norm of every X, Y, Z vector in an array. Integer
+        input stays integer, so the result is exact.
+
+        Args:
+            vectors (np.ndarray): Array whose last axis holds the X, Y and Z components.
+
+        Returns:
+            np.ndarray: The squared norms, with the same shape as `vectors` minus the last axis.
+        """
+        if vectors.shape[-1] != 3:
+            raise ValueError("The last axis must hold the X, Y and Z components.")
+
+        return np.sum(np.square(vectors), axis=-1)
+
     def butter_lowpass_filter(self, data, cutoff, fs, order=4):
         """
         Apply a Butterworth low-pass filter to the data.
@@ -85,9 +1373,7 @@ class Classification:
         Returns:
             array: Filtered data.
         """
-        nyquist = 0.5 * fs
-        normal_cutoff = cutoff / nyquist
-        b, a = butter(order, normal_cutoff, btype='low', analog=False)
+        b, a = butter_lowpass_coefficients(cutoff, fs, order)
         y = filtfilt(b, a, data)
         return y
 
@@ -101,115 +1387,389 @@ class Classification:
             threshold (float): Minimum value to qualify as a peak (e.g., 1.5 m/s²).
             
         Returns:
-            list: Indices of detected peaks.
+            int: Number of detected peaks.
+            list: Values at the detected peaks.
         """
-        # Calculate the derivative of the acceleration data
-        derivative = np.diff(data)
-        derivative[0] = 0
-        
-        # Find zero crossings (where the derivative changes sign)
-        zero_crossings = np.where(np.diff(np.sign(derivative)))[0]
-        
-        # Check for peaks: derivative changes from positive to negative
-        peaks = [
-            idx+1 for idx in zero_crossings
-            if derivative[idx] > 0 and derivative[idx + 1] < 0 and data[idx] > threshold
-        ]
-        
-        return len(peaks), [int(data[i]) for i in peaks]
+        counts, amplitudes = peak_kernel(data, threshold, return_amplitudes=True)
+        amplitudes = amplitudes[0]
+        return int(counts[0]), [int(amplitude) for amplitude in amplitudes[~np.isnan(amplitudes)]]
 
     def classify(self):
-        # Calculate norms for accelerometer and gyroscope buffers
-        acc_norm_list = self.calculate_norm(self.acc_x_buffer, self.acc_y_buffer, self.acc_z_buffer)
-        gyro_norm_list = self.calculate_norm(self.gyro_x_buffer, self.gyro_y_buffer, self.gyro_z_buffer)
-
-        # Standard deviation of accelerometer norm
-        acc_std = np.std(acc_norm_list)
-        gyro_std = np.std(gyro_norm_list)
+        # Standard deviation of accelerometer and gyroscope norms against their thresholds, kept up to date by add_sample
+        low_energy, low_rotation = self.gate()
 
         # Decision tree logic
-        if acc_std < 100:  # "Low energy motion" condition
-            if gyro_std < 1000: # "Stationary" condition
+        if low_energy:  # "Low energy motion" condition
+            if low_rotation: # "Stationary" condition
+                self.branch = "stationary"
                 return "stationnary"
+            self.branch = "low_energy_rotation"
             return "unknown"
 
         # Shake detection
-        acc_xz_mean = np.mean(self.acc_x_buffer) + np.mean(self.acc_z_buffer)
-        acc_y_mean_abs = abs(np.mean(self.acc_y_buffer))
+        acc_x_mean, acc_y_mean, acc_z_mean = self.axis_mean()[:3]
+        acc_xz_mean = acc_x_mean + acc_z_mean
+        acc_y_mean_abs = abs(acc_y_mean)
+        if acc_xz_mean >= acc_y_mean_abs:  # Every shake branch below requires the opposite
+            self.branch = "orientation"
+            return "unknown"
 
-        # Low-pass filter parameters
-        fs = 52  # Sampling frequency (Hz)
-        cutoff = 10  # Low-pass filter cutoff frequency (Hz)
+        window = self.window()
+        acc_x, acc_y = window[:, 1], window[:, 2]
 
-        # Apply low-pass filter to the norms
-        acc_norm_filtered = self.butter_lowpass_filter(acc_norm_list, cutoff, fs)
-        gyro_norm_filtered = self.butter_lowpass_filter(gyro_norm_list, cutoff, fs)
-        
-        # Count peaks in the filtered norms
-        acc_peaks, _ = self.count_peaks(acc_norm_filtered, threshold=3e3)
-        gyro_peaks, _ = self.count_peaks(gyro_norm_filtered, threshold=1.5e6)
+        acc_peaks, gyro_peaks = self.window_peaks()
 
         if acc_peaks == 0:
+            self.branch = "no_peak"
             return "unknown"
 
         if acc_peaks == 1:
             if acc_xz_mean < acc_y_mean_abs:
-                if np.ptp(self.acc_x_buffer) > np.ptp(self.acc_y_buffer):
+                if np.ptp(acc_x) > np.ptp(acc_y):
+                    self.branch = "1_shake"
                     return "1_shake"
+            self.branch = "1_peak_rejected"
             return "unknown"
 
         if acc_peaks >= 2:
             if acc_xz_mean < acc_y_mean_abs:
-                if np.ptp(self.acc_y_buffer) > np.ptp(self.acc_x_buffer):
+                if np.ptp(acc_y) > np.ptp(acc_x):
+                    self.branch = "2_shake"
                     return "2_shake"
+            self.branch = "2_peaks_rejected"
             return "unknown"
 
+        self.branch = "no_peak"
         return "unknown"
 
-class BLEClientWorker(QThread):
-    connection_success = pyqtSignal(str)
-    connection_error = pyqtSignal(str)
-    notification_received = pyqtSignal(str)
+    def window_peaks(self):
+        """
+        Count the peaks of the filtered (acc, gyro) norms of the window, each
+        against its own threshold.
 
-    def __init__(self, address, BLEApp):
-        super().__init__()
-        self.address = address
-        self.BLEApp = BLEApp
+        Returns:
+            tuple: (acc_peaks, gyro_peaks).
+        """
+        config = self.config
+        if self.filter_mode == "streaming":
+            if self.backend == "numba":
+                # Flagged sample by sample by the kernel, at the positions peak_kernel can count
+                acc_peaks, gyro_peaks = np.sum(self.peak_flags[self.write_index + 2:self.write_index + self.WINDOW_LENGTH - 1], axis=0)
+                return acc_peaks, gyro_peaks
+        peaks = self.count_peaks_batch(self.filtered_norms(), threshold=[config.acc_peak_threshold, config.gyro_peak_threshold])
+        return peaks[0, 0], peaks[1, 1]
+
+    def filtered_norms(self):
+        """
+        Get the low-passed (acc_norm, gyro_norm) of the window the peaks are counted on.
+
+        Returns:
+            np.ndarray: A (2, WINDOW_LENGTH) array.
+        """
+        if self.filter_mode == "streaming":
+            # Already filtered sample by sample in add_sample
+            return self.window_filtered().T
+        # Apply zero-phase low-pass filter to both norms of the whole window at once
+        config = self.config
+        return self.butter_lowpass_filter(self.window_norms().T, config.cutoff, config.fs, config.filter_order)
+
+    def classify_recording(self, data):
+        """
+        Classify a whole recording at once.
+
+        Gives the same labels as feeding the samples one by one to add_data on a
+        fresh instance with hop=1 and hold=0, but works on zero-copy sliding
+        window views of the recording and evaluates every window with array
+        operations. The ring buffers of this instance are not used nor modified.
+        Only for the decision tree with fixed thresholds, on samples already at
+        the classifier rate: the "goertzel" detector, calibration and resample
+        are stateful per sample and raise a ValueError (resample the recording
+        with a Resampler first).
+
+        Parameters:
+            data (np.ndarray): A (N, 7) array of samples (see load_log).
+
+        Returns:
+            list: One label per sample.
+        """
+        if self.band_detector is not None:
+            raise ValueError("classify_recording only runs the decision tree, not the \"goertzel\" detector.")
+        if self.calibration is not None:
+            raise ValueError("classify_recording uses fixed thresholds, it does not support calibration.")
+        if self.resampler is not None:
+            raise ValueError("classify_recording does not resample, push the recording through a Resampler first.")
+        data = np.asarray(data, dtype=float)
+        if data.ndim != 2 or data.shape[1] != self.N_CHANNELS:
+            raise ValueError(f"Expected a (N, {self.N_CHANNELS}) array, got shape {data.shape}.")
+
+        labels = np.full(len(data), "stationnary", dtype=object)
+        if len(data) < self.WINDOW_LENGTH:  # add_data never classifies before the window is full
+            return labels.tolist()
+
+        # One window per sample from WINDOW_LENGTH - 1 on: (windows, channels, WINDOW_LENGTH)
+        norms = self.calculate_norm(data[:, 1:].reshape(-1, 2, 3))
+        norm_windows = sliding_window_view(norms, self.WINDOW_LENGTH, axis=0)
+        acc_windows = sliding_window_view(data[:, 1:4], self.WINDOW_LENGTH, axis=0)
+        filtered_windows = None
+        if self.filter_mode == "streaming":
+            filtered_windows = sliding_window_view(self.lowpass_recording(norms), self.WINDOW_LENGTH, axis=0)
+
+        labels[self.WINDOW_LENGTH - 1:] = self.classify_windows(acc_windows, norm_windows, filtered_windows)
+        return labels.tolist()
+
+    def classify_windows(self, acc_windows, norm_windows, filtered_windows=None):
+        """
+        Run the decision tree of classify() on a stack of windows with array operations.
+
+        Parameters:
+            acc_windows (np.ndarray): A (windows, 3, WINDOW_LENGTH) array of acc_x, acc_y, acc_z.
+            norm_windows (np.ndarray): A (windows, 2, WINDOW_LENGTH) array of acc and gyro norms.
+            filtered_windows (np.ndarray): The same norms already low-pass filtered
+                ("streaming" mode). If None, they are filtered here with filtfilt.
+
+        Returns:
+            np.ndarray: One label per window (object array).
+        """
+        features = window_features(acc_windows, norm_windows)
+        config = self.config
+
+        # Filter and count peaks only where a shake is still possible
+        acc_peaks = np.zeros(len(features["acc_std"]), dtype=int)
+        candidates = np.flatnonzero(shake_candidates(features, config))
+        if candidates.size:
+            if filtered_windows is not None:
+                filtered = filtered_windows[candidates]
+            else:
+                b, a = butter_lowpass_coefficients(config.cutoff, config.fs, config.filter_order)
+                filtered = filtfilt(b, a, norm_windows[candidates], axis=-1)
+            acc_peaks[candidates] = self.count_peaks_batch(filtered[:, 0], threshold=config.acc_peak_threshold)
+
+        return decision_tree(features, acc_peaks, config)
+
+    def lowpass_recording(self, norms):
+        """
+        Run the streaming low-pass filter over a whole recording, from the same
+        initial state as lowpass_step.
 
-    def run(self):
-        asyncio.run(self.connect_and_listen())
+        Parameters:
+            norms (np.ndarray): A (N, 2) array of (acc_norm, gyro_norm).
+
+        Returns:
+            np.ndarray: The (N, 2) filtered norms.
+        """
+        zi = sosfilt_zi(self.sos)[:, :, np.newaxis] * norms[0]
+        filtered, _ = sosfilt(self.sos, norms, axis=0, zi=zi)
+        return filtered
+
+    def count_peaks_batch(self, data, threshold=1.5):
+        """
+        Count the peaks of many windows at once, with the same rule as count_peaks.
+
+        Parameters:
+            data (np.ndarray): Windows of filtered norm values, along the last axis.
+            threshold (float or sequence): Minimum value to qualify as a peak, or
+                several thresholds to count peaks for each of them (see peak_kernel).
+
+        Returns:
+            np.ndarray: Number of peaks of each window, with a last axis of one
+            count per threshold if several were given.
+        """
+        counts = peak_kernel(data, threshold)
+        return counts[..., 0] if np.ndim(threshold) == 0 else counts
+
+class MultiDeviceClassification:
+    """
+    Classify the streams of several IMU modules (e.g. left and right hand) at once.
+
+    The windows of all devices live in one stacked (devices, 2 * WINDOW_LENGTH, 7)
+    ring buffer, and every device with new data is classified in a single
+    vectorized call to Classification.classify_windows.
+
+    Called after each sample, classify_pending gives the labels of one
+    Classification per device once its window is full (before, "stationnary"
+    every `hop` samples). After several samples, a device whose window
+    entered or left the stationary state meanwhile is classified on its
+    newest window rather than at the sample that triggered it.
+    """
 
-    async def connect_and_listen(self):
+    def __init__(self, device_ids, filter_mode="offline", hop=1, hold=0, config=None):
+        """
+        Parameters:
+            device_ids (list): Identifiers of the devices (e.g. their BLE addresses).
+            filter_mode (str): See Classification.
+            hop (int): A device is classified once it received `hop` new samples,
+                or as soon as its window enters or leaves the stationary state.
+            hold (int): Per-device gesture debounce, see Classification.
+            config (ClassifierConfig): Thresholds and filter parameters shared by
+                all devices (default: ClassifierConfig()).
+        """
+        # Holds the parameters, the filter design and the decision tree shared by all devices
+        self.classification = Classification(filter_mode=filter_mode, hop=hop, hold=hold, config=config)
+        self.WINDOW_LENGTH = self.classification.WINDOW_LENGTH
+        self.N_CHANNELS = self.classification.N_CHANNELS
+
+        self.device_ids = list(device_ids)
+        self.device_index = {device_id: index for index, device_id in enumerate(self.device_ids)}
+        if len(self.device_index) != len(self.device_ids):
+            raise ValueError("Device identifiers must be unique.")
+        n_devices = len(self.device_ids)
+
+        # Same mirrored layout as Classification, one ring buffer per device
+        self.buffer = np.zeros((n_devices, 2 * self.WINDOW_LENGTH, self.N_CHANNELS))
+        self.norm_buffer = np.zeros((n_devices, 2 * self.WINDOW_LENGTH, 2))
+        self.filtered_buffer = np.zeros((n_devices, 2 * self.WINDOW_LENGTH, 2))
+        self.filter_zi = [None] * n_devices
+        self.write_index = np.zeros(n_devices, dtype=int)
+        self.sample_count = np.zeros(n_devices, dtype=int)
+        self.new_samples = np.zeros(n_devices, dtype=int)
+        self.hold_remaining = np.zeros(n_devices, dtype=int)
+
+        # Sliding (Welford) statistics of the norms of each device, for the
+        # stationary trigger of Classification.schedule, in O(1) per sample
+        self.norm_mean = np.zeros((n_devices, 2))
+        self.norm_m2 = np.zeros((n_devices, 2))
+        self.was_stationary = [None] * n_devices
+        self.triggered = np.zeros(n_devices, dtype=bool)
+
+    def add_data(self, device_id, data):
+        """
+        Add raw samples (one or more lines, see parse_samples) received from a device.
+
+        Returns:
+            bool: False if the payload was malformed and ignored.
+        """
         try:
-            print(f"[CONNEXION] Connexion au périphérique BLE à l'adresse {self.address}...")
-            self.BLEApp.client = BleakClient(self.address)
-            await self.BLEApp.client.connect()
-            if self.BLEApp.client.is_connected:
-                self.connection_success.emit(self.address)
+            samples = parse_samples(data, self.N_CHANNELS)
+        except ValueError:
+            return False
+        for sample in samples:
+            self.add_sample(device_id, sample)
+        return True
+
+    def add_sample(self, device_id, sample):
+        """
+        Store one sample of a device in its ring buffer.
 
-                # Enable notifications
-                def handle_notification(sender, data):
-                    self.notification_received.emit(data.decode('utf-8', errors='ignore'))
+        Args:
+            device_id: Identifier of the device.
+            sample (sequence): The 7 values (time, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z).
+        """
+        device = self.device_index[device_id]
+        index = self.write_index[device]
+        sample = np.asarray(sample, dtype=float)
+        norms = self.classification.calculate_norm(sample[1:].reshape(2, 3))
+
+        # The row about to be overwritten is the oldest sample of the window
+        old_norms = self.norm_buffer[device, index]
+        delta = norms - old_norms
+        new_mean = self.norm_mean[device] + delta / self.WINDOW_LENGTH
+        self.norm_m2[device] += delta * (norms - new_mean + old_norms - self.norm_mean[device])
+        self.norm_mean[device] = new_mean
+
+        self.buffer[device, [index, index + self.WINDOW_LENGTH]] = sample
+        self.norm_buffer[device, [index, index + self.WINDOW_LENGTH]] = norms
+        if self.classification.filter_mode == "streaming":
+            filtered = self.lowpass_step(device, norms)
+            self.filtered_buffer[device, [index, index + self.WINDOW_LENGTH]] = filtered
+
+        self.write_index[device] = (index + 1) % self.WINDOW_LENGTH
+        self.sample_count[device] += 1
+        self.new_samples[device] += 1
+        if self.hold_remaining[device] > 0:
+            self.hold_remaining[device] -= 1
+
+        if self.write_index[device] == 0:
+            # Resync once per window, see Classification.resync_statistics
+            norms = self.norm_buffer[device, :self.WINDOW_LENGTH]
+            self.norm_mean[device] = np.mean(norms, axis=0)
+            self.norm_m2[device] = np.sum(np.square(norms - self.norm_mean[device]), axis=0)
+        if self.sample_count[device] >= self.WINDOW_LENGTH:
+            # Same trigger as Classification.schedule
+            config = self.classification.config
+            acc_std, gyro_std = np.sqrt(np.maximum(self.norm_m2[device] / self.WINDOW_LENGTH, 0))
+            stationary = acc_std < config.acc_std_threshold and gyro_std < config.gyro_std_threshold
+            if stationary != self.was_stationary[device]:
+                self.triggered[device] = True
+            self.was_stationary[device] = stationary
+
+    def lowpass_step(self, device, norms):
+        """
+        Advance the streaming low-pass filter of one device by one sample.
 
-                char_uuid = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
-                await self.BLEApp.client.start_notify(char_uuid, handle_notification)
+        Returns:
+            list: The filtered (acc_norm, gyro_norm).
+        """
+        sos = self.classification.sos
+        if self.filter_zi[device] is None:
+            self.filter_zi[device] = [(sosfilt_zi(sos) * norm).tolist() for norm in norms]
 
-                # Continuously listen for notifications
-                while self.BLEApp.client.is_connected:
-                    await asyncio.sleep(1)
+        rows = self.classification.sos_rows
+        return [sosfilt_step(rows, state, norm) for state, norm in zip(self.filter_zi[device], norms.tolist())]
 
-        except Exception as e:
-            self.connection_error.emit(str(e))
+    def classify_pending(self):
+        """
+        Classify every device that received at least `hop` samples since its last
+        classification, or whose window entered or left the stationary state,
+        all in one vectorized call.
+
+        Returns:
+            list: (device_id, label) tuples. Devices whose window is not full yet
+            are reported as "stationnary", like Classification.add_data does.
+            Debounced gesture repeats are left out.
+        """
+        pending = np.flatnonzero((self.new_samples >= self.classification.hop) | self.triggered)
+        if not pending.size:
+            return []
+        self.new_samples[pending] = 0
+        self.triggered[pending] = False
 
-class BLEApp(QWidget):
+        labels = np.full(len(pending), "stationnary", dtype=object)
+        full = self.sample_count[pending] >= self.WINDOW_LENGTH
+        devices = pending[full]
+        if devices.size:
+            # Gather the chronological window of each device: (devices, WINDOW_LENGTH)
+            rows = self.write_index[devices, np.newaxis] + np.arange(self.WINDOW_LENGTH)
+            acc_windows = self.buffer[devices[:, np.newaxis], rows, 1:4].transpose(0, 2, 1)
+            norm_windows = self.norm_buffer[devices[:, np.newaxis], rows].transpose(0, 2, 1)
+            filtered_windows = None
+            if self.classification.filter_mode == "streaming":
+                filtered_windows = self.filtered_buffer[devices[:, np.newaxis], rows].transpose(0, 2, 1)
+            labels[full] = self.classification.classify_windows(acc_windows, norm_windows, filtered_windows)
+
+        results = []
+        for device, label in zip(pending, labels):
+            if self.debounce(device, label):
+                results.append((self.device_ids[device], label))
+        return results
+
+    def debounce(self, device, label):
+        """
+        Per-device version of Classification.debounce.
+
+        Returns:
+            bool: False for a repeat of a gesture being held.
+        """
+        if self.classification.hold == 0 or label not in GESTURES:
+            return True
+
+        repeat = self.hold_remaining[device] > 0
+        self.hold_remaining[device] = self.classification.hold
+        return not repeat
+
+class BLEApp(SessionEventsMixin, QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("BLE Device Manager")
         self.setGeometry(100, 100, 400, 400)
 
-        self.client = None
         self.ble_address = "F8:B3:B7:22:2E:3A"  # Hardcoded BLE address
-        self.classification = Classification()
+        # The BLE link and its notifications, drained 30 times per second (see SessionEventsMixin)
+        self.start_session(DiscoveryCache(addresses=[self.ble_address]))
+        self.event_timer = QTimer(self)
+        self.event_timer.timeout.connect(self.process_events)
+        self.event_timer.start(33)
+        # Classify 13 times per second and emit each gesture once (1 s hold)
+        self.classification = Classification(hop=4, hold=52)
         self.classification_enabled = False  # Flag to control classification
 
         # UI Elements
@@ -237,6 +1797,7 @@ class BLEApp(QWidget):
 
         self.text_area = QTextEdit()
         self.text_area.setReadOnly(True)
+        self.text_area.document().setMaximumBlockCount(1000)  # Only keep the last samples
         layout.addWidget(self.text_area)
 
         self.classification_label = QLabel("Classification : En attente")
@@ -259,64 +1820,46 @@ class BLEApp(QWidget):
     def connect_device(self):
         print(f"[CONNEXION] Tentative de connexion au périphérique à l'adresse : {self.ble_address}")
         self.status_label.setText(f"Statut : Connexion à {self.ble_address}...")
-        self.client_worker = BLEClientWorker(self.ble_address, self)
-        self.client_worker.connection_success.connect(self.on_connection_success)
-        self.client_worker.connection_error.connect(self.on_connection_error)
-        self.client_worker.notification_received.connect(self.on_notification_received)
-        self.client_worker.start()
-
-    def on_connection_success(self, address):
-        print(f"[CONNEXION] Connecté avec succès à {address}.")
-        self.status_label.setText(f"Statut : Connecté à {address}")
         self.connect_button.setEnabled(False)
         self.disconnect_button.setEnabled(True)
+        self.session_manager.connect(self.ble_address)
 
-    def on_connection_error(self, error):
-        print(f"[CONNEXION] Erreur lors de la connexion : {error}")
-        self.status_label.setText(f"Erreur : {error}")
-        QMessageBox.critical(self, "Erreur", f"Une erreur s'est produite : {error}")
-
-    def on_notification_received(self, data):
-        print(f"[NOTIFICATION] {data}")
-        self.text_area.append(data)
+    def on_notifications_received(self, payloads):
+        # One appended block per batch
+        self.text_area.append("\n".join(payload_text(data) for data in payloads))
         if self.classification_enabled:  # Process data only if classification is enabled
-            classification_result = self.classification.add_data(data)
+            # Only the IMU samples, the firmware also sends its classification codes
+            samples = [data for data in payloads if is_imu_payload(data)]
+            try:
+                labels = self.classification.add_data_batch(samples) if samples else []  # Text lines and frames parsed at once
+            except ValueError:  # A malformed sample in the batch, add them one by one
+                labels = [self.classification.add_data(data) for data in samples]
+            # Show the last gesture of the batch, else its last result
+            gestures = [label for label in labels if label in GESTURES]
+            classification_result = gestures[-1] if gestures else next((label for label in reversed(labels) if label), None)
             if classification_result:
                 self.classification_label.setText(f"Classification : {classification_result}")
 
     def disconnect_device(self):
-        if self.client and self.client.is_connected:
-            print("[DÉCONNEXION] Déconnexion en cours...")
-            asyncio.ensure_future(self.async_disconnect_device())
-
-    async def async_disconnect_device(self):
-        try:
-            await self.client.disconnect()
-            print("[DÉCONNEXION] Déconnecté avec succès.")
-            self.on_disconnect_success()
-        except Exception as e:
-            print(f"[DÉCONNEXION] Erreur lors de la déconnexion : {e}")
-            self.on_disconnect_error(str(e))
+        print("[DÉCONNEXION] Déconnexion en cours...")
+        self.disconnect_button.setEnabled(False)
+        self.session_manager.disconnect(self.ble_address)
 
     def on_disconnect_success(self):
+        print("[DÉCONNEXION] Déconnecté avec succès.")
         self.status_label.setText("Statut : Déconnecté.")
         self.connect_button.setEnabled(True)
         self.disconnect_button.setEnabled(False)
-        self.client = None
 
-    def on_disconnect_error(self, error):
-        self.status_label.setText(f"Erreur : {error}")
-        QMessageBox.critical(self, "Erreur", f"Une erreur s'est produite : {error}")
+    def closeEvent(self, event):
+        self.event_timer.stop()
+        self.session_manager.stop()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication([])
 
-    # Boucle événementielle asynchrone
-    loop = QEventLoop(app)
-    asyncio.set_event_loop(loop)
-
     window = BLEApp()
     window.show()
 
-    with loop:
-        loop.run_forever()
+    sys.exit(app.exec_())
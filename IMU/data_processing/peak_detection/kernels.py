@@ -0,0 +1,115 @@
+"""
+Per-sample kernel of Classification for the "numba" backend.
+
+The kernel fuses what add_sample, update_statistics, resync_statistics,
+lowpass_step and gate do with NumPy for one sample, plus the streaming peak
+update, into a single compiled call. It performs the same floating-point
+operations in the same order as the NumPy backend, so both give the same labels.
+Numba is optional: without it, NUMBA_AVAILABLE is False and Classification
+falls back to the NumPy backend.
+"""
+import math
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+
+def sample_step(sample, buffer, norm_buffer, filtered_buffer, peak_flags, norm_mean, norm_m2, axis_sum,
+                sos, zi, write_index, streaming, acc_peak_threshold, gyro_peak_threshold,
+                acc_std_threshold, gyro_std_threshold):
+    """
+    Store one sample in the ring buffers and update the window statistics in place.
+
+    Parameters:
+        sample (np.ndarray): The 7 values of the sample (float64).
+        buffer, norm_buffer, filtered_buffer (np.ndarray): Mirrored ring buffers of
+            Classification, (2 * window_length, 7) and (2 * window_length, 2).
+        peak_flags (np.ndarray): Mirrored (2 * window_length, 2) ring buffer, set to
+            1 where the filtered (acc, gyro) norm has a peak (see peak_kernel).
+        norm_mean, norm_m2, axis_sum (np.ndarray): Window statistics, see Classification.
+        sos (np.ndarray): Second-order sections of the streaming filter.
+        zi (np.ndarray): State of the streaming filter, (sections, 2, 2).
+        write_index (int): Row of the oldest sample, about to be overwritten.
+        streaming (bool): Also advance the filter and the peak flags.
+        acc_peak_threshold, gyro_peak_threshold (float): Peak thresholds of each norm.
+        acc_std_threshold, gyro_std_threshold (float): Gate thresholds of each norm.
+
+    Returns:
+        int: Gate of the updated window, bit 0 for "low energy motion" and bit 1
+        for "low rotation".
+    """
+    window_length = buffer.shape[0] // 2
+    mirror = write_index + window_length
+
+    norms = (
+        math.sqrt(sample[1] * sample[1] + sample[2] * sample[2] + sample[3] * sample[3]),
+        math.sqrt(sample[4] * sample[4] + sample[5] * sample[5] + sample[6] * sample[6]),
+    )
+
+    # Sliding statistics, with the row about to be overwritten (update_statistics)
+    for channel in range(2):
+        old = norm_buffer[write_index, channel]
+        delta = norms[channel] - old
+        new_mean = norm_mean[channel] + delta / window_length
+        norm_m2[channel] += delta * (norms[channel] - new_mean + old - norm_mean[channel])
+        norm_mean[channel] = new_mean
+    for axis in range(6):
+        axis_sum[axis] += sample[axis + 1] - buffer[write_index, axis + 1]
+
+    for column in range(7):
+        buffer[write_index, column] = sample[column]
+        buffer[mirror, column] = sample[column]
+    for channel in range(2):
+        norm_buffer[write_index, channel] = norms[channel]
+        norm_buffer[mirror, channel] = norms[channel]
+
+    if streaming:
+        thresholds = (acc_peak_threshold, gyro_peak_threshold)
+        for channel in range(2):
+            # Direct form II transposed, as scipy.signal.sosfilt
+            x = norms[channel]
+            for section in range(sos.shape[0]):
+                y = sos[section, 0] * x + zi[section, 0, channel]
+                zi[section, 0, channel] = sos[section, 1] * x - sos[section, 4] * y + zi[section, 1, channel]
+                zi[section, 1, channel] = sos[section, 2] * x - sos[section, 5] * y
+                x = y
+            filtered_buffer[write_index, channel] = x
+            filtered_buffer[mirror, channel] = x
+
+            # The previous sample is a peak if the derivative changes sign there,
+            # with the threshold tested on the sample before it
+            before = filtered_buffer[mirror - 2, channel]
+            peak = filtered_buffer[mirror - 1, channel]
+            flag = peak - before > 0 and x - peak < 0 and before > thresholds[channel]
+            previous = (write_index - 1) % window_length
+            peak_flags[previous, channel] = flag
+            peak_flags[previous + window_length, channel] = flag
+
+    if write_index == window_length - 1:
+        # The window is now rows 0 to window_length - 1 (resync_statistics)
+        for channel in range(2):
+            total = 0.0
+            for row in range(window_length):
+                total += norm_buffer[row, channel]
+            mean = total / window_length
+            m2 = 0.0
+            for row in range(window_length):
+                deviation = norm_buffer[row, channel] - mean
+                m2 += deviation * deviation
+            norm_mean[channel] = mean
+            norm_m2[channel] = m2
+        for axis in range(6):
+            total = 0.0
+            for row in range(window_length):
+                total += buffer[row, axis + 1]
+            axis_sum[axis] = total
+
+    acc_std = math.sqrt(max(norm_m2[0] / window_length, 0.0))
+    gyro_std = math.sqrt(max(norm_m2[1] / window_length, 0.0))
+    return int(acc_std < acc_std_threshold) | int(gyro_std < gyro_std_threshold) << 1
+
+if NUMBA_AVAILABLE:
+    sample_step = njit(cache=True)(sample_step)
@@ -0,0 +1,44 @@
+import argparse
+import glob
+import os
+from collections import Counter
+
+from classification import Classification, FILTER_MODES, Resampler, load_log
+
+LOGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+
+def rescore(paths, filter_mode="offline", resample=False):
+    """
+    Classify every sample of the given IMU logs.
+
+    Parameters:
+        paths (list): Paths of the CSV logs.
+        filter_mode (str): Filter mode of the classifier (see Classification).
+        resample (bool): Resample each log onto the classifier rate first (see Resampler).
+
+    Returns:
+        dict: Labels of each log, keyed by path.
+    """
+    classification = Classification(filter_mode=filter_mode)
+    labels = {}
+    for path in paths:
+        data = load_log(path)
+        if resample:
+            resampler = Resampler(classification.config.fs)
+            data = resampler.push(data)
+            print(f"[RESAMPLE] {os.path.basename(path)}: input at {resampler.input_rate():.2f} Hz, "
+                  f"{resampler.restarts} gap(s), resampled to {resampler.rate} Hz")
+        labels[path] = classification.classify_recording(data)
+    return labels
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score recorded IMU logs with the gesture classifier.")
+    parser.add_argument("paths", nargs="*", help="CSV logs (default: every log in peak_detection/logs)")
+    parser.add_argument("--filter-mode", choices=FILTER_MODES, default="offline")
+    parser.add_argument("--resample", action="store_true", help="resample the logs from their time[us] column first")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(LOGS_PATH, "*.csv")))
+    for path, labels in rescore(paths, args.filter_mode, args.resample).items():
+        counts = ", ".join(f"{label}: {count}" for label, count in sorted(Counter(labels).items()))
+        print(f"{os.path.basename(path)} ({len(labels)} samples) -> {counts}")
@@ -0,0 +1,456 @@
+import argparse
+import glob
+import os
+import time
+from collections import Counter
+
+import numpy as np
+from scipy.signal import filtfilt, find_peaks
+
+from classification import butter_lowpass_coefficients, is_frame, load_log, parse_samples
+from threshold_sweep import LOG_LABELS
+
+LOGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "templates.npz")
+
+TEMPLATE_LENGTH = 52  # Samples per template (1 s at 52 Hz)
+BAND = 5  # Sakoe-Chiba band of the DTW between gesture windows, when ranking them (samples)
+STRETCH = 2.0  # A match spans TEMPLATE_LENGTH / STRETCH to TEMPLATE_LENGTH * STRETCH samples
+NEGATIVE_LABELS = ("unknown", "stationnary")
+
+def dtw_distance(window, template, band):
+    """
+    Band-constrained DTW distance (sum of squared Euclidean distances along the
+    warping path) between two series of the same length.
+
+    Parameters:
+        window (np.ndarray): A (length, channels) series.
+        template (np.ndarray): A (length, channels) series.
+        band (int): Half width of the Sakoe-Chiba band.
+
+    Returns:
+        float: The distance.
+    """
+    length = len(window)
+    cost = np.sum(np.square(window[:, np.newaxis] - template[np.newaxis]), axis=-1).tolist()
+    inf = float("inf")
+
+    previous = [inf] * length
+    for i in range(length):
+        row = cost[i]
+        current = [inf] * length
+        for j in range(max(0, i - band), min(length, i + band + 1)):
+            if i == 0 and j == 0:
+                best = 0.0
+            else:
+                best = previous[j]
+                if j > 0:
+                    if previous[j - 1] < best:
+                        best = previous[j - 1]
+                    if current[j - 1] < best:
+                        best = current[j - 1]
+            current[j] = row[j] + best
+        previous = current
+    return previous[length - 1]
+
+def spring_step(cost, distances, starts, time, bounds, max_span):
+    """
+    Advance subsequence DTW (SPRING) by one sample of the stream, for every
+    template at once.
+
+    distances[k, j] is the distance of the best warping path matching the
+    points 0..j of template k with a subsequence of the stream ending at the
+    previous sample, starts[k, j] the first sample of that subsequence. A path
+    may start at any sample (open begin) and each column ends a candidate
+    match of the whole template (open end). The recurrence
+    D[j] = cost[j] + min(D[j - 1], previous D[j], previous D[j - 1]) is a
+    min-plus scan along j, computed with prefix sums instead of a loop:
+    D[j] = C[j] + min over i <= j of (A[i] - C[i - 1]), with C the prefix sums
+    of cost and A[i] the best previous path to extend at i.
+
+    Paths that reach the bound of their template, or span more than max_span
+    samples, can never match: they are set to inf, which keeps them out of the
+    minimum of the next steps (they are still computed, see
+    TemplateSpotter.add_values for the samples skipped altogether).
+
+    Parameters:
+        cost (np.ndarray): A (templates, length) array of the squared distances
+            of the new sample to each point of each template.
+        distances (np.ndarray): A (templates, length) array, see above (inf: no path).
+        starts (np.ndarray): A (templates, length) int array, see above.
+        time (int): Index of the new sample in the stream.
+        bounds (np.ndarray): Distance at which the paths of each template are abandoned.
+        max_span (int): Maximum number of samples of a match.
+
+    Returns:
+        tuple: The (distances, starts) of the paths ending at the new sample.
+    """
+    length = cost.shape[1]
+    # Best path to extend at each point: a new one at the first point, else the
+    # previous path at the same point or at the point before
+    extend = np.empty_like(distances)
+    extend_start = np.empty_like(starts)
+    extend[:, 0] = 0.0
+    extend_start[:, 0] = time
+    diagonal = distances[:, :-1] < distances[:, 1:]
+    extend[:, 1:] = np.where(diagonal, distances[:, :-1], distances[:, 1:])
+    extend_start[:, 1:] = np.where(diagonal, starts[:, :-1], starts[:, 1:])
+
+    cumulated = np.cumsum(cost, axis=1)
+    values = extend - (cumulated - cost)
+    running = np.minimum.accumulate(values, axis=1)
+    # Point where the running minimum was reached, to carry its start along
+    origin = np.maximum.accumulate(np.where(values <= running, np.arange(length), 0), axis=1)
+
+    distances = cumulated + running
+    starts = np.take_along_axis(extend_start, origin, axis=1)
+    distances[(distances >= bounds[:, np.newaxis]) | (time - starts >= max_span)] = np.inf
+    return distances, starts
+
+class TemplateSpotter:
+    """
+    Spot gestures in the IMU stream by matching it against recorded templates
+    with subsequence DTW (SPRING): a match may start and end at any sample and
+    span from length / stretch to length * stretch samples, so a gesture
+    performed faster or slower than its template still aligns.
+
+    Each new sample updates one column of cumulative distances per template,
+    in O(length) and for all the templates with a few array operations,
+    instead of a DTW per window. The paths above the threshold of their
+    template are abandoned. A gesture is emitted once, as soon as no path
+    still running can beat the best match found nor overlaps it, with the
+    label of the closest template, and the overlapping paths are dropped.
+    Adding a gesture only needs new templates.
+
+    While the lower bound of every template (see match_bounds) is above its
+    threshold, e.g. on a still stream, no match can end and the updates are
+    skipped altogether. The columns are brought up to date from the last
+    max_span samples when a bound drops below its threshold (see wake_up).
+    """
+    def __init__(self, templates, labels, thresholds, scale, stretch=STRETCH):
+        """
+        Parameters:
+            templates (np.ndarray): A (templates, length, 6) array of scaled
+                acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z.
+            labels (sequence): Gesture of each template.
+            thresholds (sequence): Maximum DTW distance of a match, per template.
+            scale (np.ndarray): Value each of the 6 axes is divided by.
+            stretch (float): Maximum ratio between the length of a template and
+                the span of a match, either way.
+        """
+        self.templates = np.asarray(templates, dtype=float)
+        self.labels = np.asarray(labels)
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+
+        self.length = self.templates.shape[1]
+        self.min_span = max(1, int(np.ceil(self.length / stretch)))
+        self.max_span = int(self.length * stretch)
+        self.N_CHANNELS = 7  # time, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stream, e.g. before replaying another log.
+        """
+        self.distances = np.full(self.templates.shape[:2], np.inf)
+        self.starts = np.zeros(self.templates.shape[:2], dtype=np.int64)
+        self.sample_count = 0
+        self.recent = np.zeros((self.max_span, self.templates.shape[2]))  # Ring of the last scaled samples, for the rebuilds
+        self.asleep_since = None  # Last sample the columns were updated at, while the updates are skipped
+        # Lower bounds of the match distances (see match_bounds), box of the last
+        # samples they were computed on and sample they were computed at
+        self.bounds = np.zeros(len(self.templates))
+        self.lower = self.upper = None
+        self.bounded = -self.length
+
+        self.match = None  # (distance, label, first sample, last sample) of the best match not emitted yet
+        # Samples updated, skipped while asleep and updated late on waking up
+        self.pruning = Counter()
+
+    @classmethod
+    def load(cls, path=TEMPLATES_PATH, stretch=STRETCH):
+        """
+        Load templates written by save_templates.
+        """
+        with np.load(path) as data:
+            return cls(data["templates"], data["labels"], data["thresholds"], data["scale"], stretch)
+
+    def add_data(self, data):
+        """
+        Add one "time,acc_x,acc_y,acc_z,gyro_x,gyro_y,gyro_z" sample, or the samples
+        of one binary frame.
+
+        Args:
+            data (bytes, bytearray, memoryview or str): The raw sample, as received over BLE.
+
+        Returns:
+            str or None: The gesture spotted, or None.
+        """
+        try:
+            samples = parse_samples(data, self.N_CHANNELS)
+        except ValueError:
+            return None
+        if len(samples) != 1 and not is_frame(data):
+            return None
+        # A binary frame holds several samples, keep the first gesture spotted
+        gestures = [gesture for gesture in map(self.add_values, samples) if gesture]
+        return gestures[0] if gestures else None
+
+    def add_values(self, sample):
+        """
+        Add one parsed sample and emit the gesture whose match is final, if any.
+
+        Args:
+            sample (np.ndarray): The 7 values of the sample.
+
+        Returns:
+            str or None: The gesture spotted, or None.
+        """
+        time = self.sample_count
+        self.sample_count += 1
+        scaled = np.asarray(sample[1:], dtype=float) / self.scale
+        self.recent[time % self.max_span] = scaled
+
+        # While the new samples stay in the box of the samples the bounds were
+        # computed on, the box of the last max_span samples can only shrink and
+        # the bounds only grow. They are computed again every quarter of a
+        # template, to fall asleep, and as soon as a sample leaves the box while asleep
+        refresh = time - self.bounded >= self.length // 4
+        if not refresh and self.asleep_since is not None:
+            refresh = np.any(scaled < self.lower) or np.any(scaled > self.upper)
+        if refresh:
+            window = self.recent[:min(self.sample_count, self.max_span)]
+            self.lower, self.upper = window.min(axis=0), window.max(axis=0)
+            self.bounds = self.match_bounds(self.lower, self.upper)
+            self.bounded = time
+
+        if self.asleep_since is not None:
+            if np.all(self.bounds >= self.thresholds):
+                self.pruning["asleep"] += 1
+                return None  # No match can end at this sample, and none is pending
+            self.wake_up(time)
+        self.pruning["updated"] += 1
+
+        cost = np.sum(np.square(self.templates - scaled), axis=-1)
+        self.distances, self.starts = spring_step(cost, self.distances, self.starts, time, self.thresholds, self.max_span)
+        running = np.isfinite(self.distances)
+
+        gesture = None
+        if self.match is not None:
+            distance, label, _, end = self.match
+            if not np.any(running & (self.distances < distance) & (self.starts <= end)):
+                # No path can beat the match any more: emit it, and drop the paths
+                # overlapping it so that the gesture is not matched twice
+                gesture = label
+                self.match = None
+                self.distances[self.starts <= end] = np.inf
+
+        ends = np.where(time - self.starts[:, -1] + 1 >= self.min_span, self.distances[:, -1], np.inf)
+        best = int(np.argmin(ends))
+        if ends[best] < np.inf and (self.match is None or ends[best] < self.match[0]):
+            self.match = (ends[best], str(self.labels[best]), int(self.starts[best, -1]), time)
+
+        if refresh and self.match is None and np.all(self.bounds >= self.thresholds):
+            self.asleep_since = time
+        return gesture
+
+    def match_bounds(self, lower, upper):
+        """
+        Lower bound of the distance of any match ending at the last sample, per
+        template: a match spans at most max_span samples and each point of the
+        template is aligned with one of them, so it costs at least the distance
+        of each point to the bounding box of the last max_span samples (LB_Keogh,
+        with the envelope on the stream). Tight on a still stream.
+
+        Args:
+            lower (np.ndarray): Minimum of each axis over the last max_span scaled samples.
+            upper (np.ndarray): Maximum of each axis over the same samples.
+
+        Returns:
+            np.ndarray: The bound of each template.
+        """
+        above = np.maximum(self.templates - upper, 0)
+        below = np.maximum(lower - self.templates, 0)
+        return np.sum(np.square(above) + np.square(below), axis=(1, 2))
+
+    def wake_up(self, time):
+        """
+        Bring the columns up to the sample before time, from the ring of the last
+        samples. Columns older than max_span samples are rebuilt from scratch
+        instead: the paths they hold are too long to match (but, unlike at every
+        sample, cannot hide a younger path in the meantime). Waking up never
+        costs more updates than were skipped.
+
+        Args:
+            time (int): Index of the new sample, not added yet.
+        """
+        first = self.asleep_since + 1
+        if time - first >= self.max_span:
+            first = time - self.max_span + 1
+            self.distances[:] = np.inf
+        for past in range(first, time):
+            cost = np.sum(np.square(self.templates - self.recent[past % self.max_span]), axis=-1)
+            self.distances, self.starts = spring_step(cost, self.distances, self.starts, past, self.thresholds, self.max_span)
+        self.pruning["rebuilt"] += time - first
+        self.asleep_since = None
+
+    def scan(self, stream, bounds=None):
+        """
+        Find the closest match of each template anywhere in a stream.
+
+        Args:
+            stream (np.ndarray): A (samples, 6) scaled series.
+            bounds (np.ndarray): Distance above which the matches are not
+                searched, per template (default: none).
+
+        Returns:
+            np.ndarray: The smallest match distance of each template, inf if none is below its bound.
+        """
+        best = np.full(len(self.templates), np.inf) if bounds is None else np.array(bounds, dtype=float)
+        distances = np.full(self.templates.shape[:2], np.inf)
+        starts = np.zeros(self.templates.shape[:2], dtype=np.int64)
+        for time, scaled in enumerate(stream):
+            cost = np.sum(np.square(self.templates - scaled), axis=-1)
+            # Abandoning at the best distance so far prunes most of the paths
+            distances, starts = spring_step(cost, distances, starts, time, best, self.max_span)
+            ends = np.where(time - starts[:, -1] + 1 >= self.min_span, distances[:, -1], np.inf)
+            np.minimum(best, ends, out=best)
+        return best if bounds is None else np.where(best < bounds, best, np.inf)
+
+def gesture_windows(data, length=TEMPLATE_LENGTH, fs=52):
+    """
+    Cut one window around each gesture of a labeled log: the gestures are the
+    peaks of the low-passed acc norm deviation, at least one window apart.
+
+    Parameters:
+        data (np.ndarray): A (N, 7) log.
+        length (int): Samples per window.
+
+    Returns:
+        np.ndarray: A (windows, length, 6) array of raw acc and gyro axes.
+    """
+    norm = np.linalg.norm(data[:, 1:4], axis=1)
+    b, a = butter_lowpass_coefficients(4, fs)
+    deviation = filtfilt(b, a, np.abs(norm - np.median(norm)))
+    peaks, _ = find_peaks(deviation, height=np.percentile(deviation, 75), distance=length)
+    starts = peaks - length // 2
+    starts = starts[(starts >= 0) & (starts + length <= len(data))]
+    return np.stack([data[start:start + length, 1:] for start in starts])
+
+def build_templates(paths, per_class=10, margin=0.8, band=BAND, length=TEMPLATE_LENGTH, stretch=STRETCH):
+    """
+    Build templates from labeled logs.
+
+    The gesture windows of each class are ranked by their total DTW distance
+    to the other windows of the class, and the `per_class` most central ones
+    are kept. The threshold of each template is `margin` times the distance
+    of its closest match (see TemplateSpotter.scan) in the negative logs and
+    in the windows of the other classes.
+
+    Parameters:
+        paths (dict): Label of each log, keyed by path. Logs labeled "unknown"
+            or "stationnary" are negatives.
+        per_class (int): Templates kept per gesture.
+        margin (float): Fraction of the nearest negative distance used as threshold.
+        stretch (float): See TemplateSpotter.
+
+    Returns:
+        TemplateSpotter: A spotter using the templates.
+    """
+    positives, negatives = {}, []
+    for path, label in paths.items():
+        data = load_log(path)
+        if label in NEGATIVE_LABELS:
+            negatives.append(data[:, 1:])
+        else:
+            positives.setdefault(label, []).append(gesture_windows(data, length))
+    positives = {label: np.concatenate(windows) for label, windows in positives.items()}
+    scale = np.std(np.concatenate(list(positives.values())).reshape(-1, 6), axis=0)
+
+    templates, labels = [], []
+    for label, windows in positives.items():
+        scaled = windows / scale
+        distances = np.array([[dtw_distance(a, b, band) for b in scaled] for a in scaled])
+        central = np.argsort(distances.sum(axis=1))[:per_class]
+        templates.append(scaled[central])
+        labels += [label] * len(central)
+    templates = np.concatenate(templates)
+    labels = np.array(labels)
+
+    spotter = TemplateSpotter(templates, labels, np.zeros(len(templates)), scale, stretch)
+    nearest = np.full(len(templates), np.inf)
+    for stream in negatives:
+        nearest = np.minimum(nearest, spotter.scan(stream / scale, nearest))
+    for label, windows in positives.items():
+        others = labels != label  # The windows of a class are negatives for the templates of the others
+        for window in windows / scale:
+            nearest[others] = np.minimum(nearest[others], spotter.scan(window, nearest)[others])
+    spotter.thresholds = margin * nearest
+    return spotter
+
+def save_templates(spotter, path=TEMPLATES_PATH):
+    """
+    Write the templates, labels, thresholds and scale of a spotter to an .npz file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez(path, templates=spotter.templates, labels=spotter.labels, thresholds=spotter.thresholds, scale=spotter.scale)
+
+def evaluate(spotter, paths):
+    """
+    Replay logs sample by sample through the spotter.
+
+    Returns:
+        dict: Per log, the gestures spotted, the pruning counts and the latency per sample.
+    """
+    results = {}
+    for path in paths:
+        spotter.reset()
+        gestures = Counter()
+        latencies = []
+        for sample in load_log(path):
+            start = time.perf_counter_ns()
+            gesture = spotter.add_values(sample)
+            latencies.append(time.perf_counter_ns() - start)
+            if gesture is not None:
+                gestures[gesture] += 1
+        latencies = np.array(latencies) / 1e3
+        results[path] = {
+            "gestures": dict(gestures),
+            "pruning": dict(spotter.pruning),
+            "mean_us": float(np.mean(latencies)),
+            "p99_us": float(np.percentile(latencies, 99)),
+        }
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and evaluate DTW gesture templates from the labeled IMU logs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="build the templates from the labeled logs")
+    build.add_argument("--label", action="append", default=[], help="extra labeled log 'path=label'")
+    build.add_argument("--per-class", type=int, default=10, help="templates per gesture")
+    build.add_argument("--margin", type=float, default=0.8, help="threshold, as a fraction of the nearest negative distance")
+    build.add_argument("--output", default=TEMPLATES_PATH)
+    run = subparsers.add_parser("evaluate", help="replay logs through the spotter")
+    run.add_argument("paths", nargs="*", help="CSV logs (default: every log in peak_detection/logs)")
+    run.add_argument("--templates", default=TEMPLATES_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        paths = {os.path.join(LOGS_PATH, log): label for log, label in LOG_LABELS.items()}
+        for item in args.label:
+            path, label = item.rsplit("=", 1)
+            paths[path] = label
+        start = time.perf_counter()
+        spotter = build_templates(paths, args.per_class, args.margin)
+        save_templates(spotter, args.output)
+        print(f"[TEMPLATES] {Counter(spotter.labels.tolist())} built in {time.perf_counter() - start:.1f} s, written to {args.output}")
+    else:
+        spotter = TemplateSpotter.load(args.templates)
+        paths = args.paths or sorted(glob.glob(os.path.join(LOGS_PATH, "*.csv")))
+        for path, result in evaluate(spotter, paths).items():
+            # Share of the samples updated, skipped and updated late on waking up
+            samples = result["pruning"].get("updated", 0) + result["pruning"].get("asleep", 0)
+            pruned = ", ".join(f"{stage}: {count / samples:.1%}" for stage, count in result["pruning"].items()) if samples else "-"
+            print(f"{os.path.basename(path)} -> {result['gestures']} | {pruned} | "
+                  f"mean {result['mean_us']:.0f} us, p99 {result['p99_us']:.0f} us")
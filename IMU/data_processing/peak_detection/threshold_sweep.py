@@ -0,0 +1,198 @@
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import filtfilt
+
+from classification import (
+    Classification,
+    ClassifierConfig,
+    butter_lowpass_coefficients,
+    decision_tree,
+    load_log,
+    peak_kernel,
+    window_features,
+)
+
+LOGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sweeps")
+
+# Gesture performed during each labeled log. Every window of a log is scored
+# against its label, so the recall of the gestures is a relative measure: it
+# cannot reach 1 because of the rest periods between two gestures.
+LOG_LABELS = {
+    "chest_tap.csv": "1_shake",
+    "d_shake_left.csv": "2_shake",
+    "d_shake_right.csv": "2_shake",
+    "other.csv": "unknown",
+    "stationnary.csv": "stationnary",
+}
+CLASSES = ("stationnary", "unknown", "1_shake", "2_shake")
+GESTURES = ("1_shake", "2_shake")
+
+# Default grid, ~7000 combinations
+DEFAULT_GRID = {
+    "acc_std_threshold": np.linspace(25, 300, 12),
+    "gyro_std_threshold": np.linspace(250, 4000, 8),
+    "acc_peak_threshold": np.linspace(1000, 6000, 11),
+    "cutoff": [4, 6, 8, 10, 12, 15, 20],
+}
+
+def precompute(paths, cutoffs, peak_thresholds, config):
+    """
+    Compute once the window features of every labeled log, and the acc peak
+    counts of every window for each (cutoff, peak threshold) of the grid.
+
+    Parameters:
+        paths (dict): Label of each log, keyed by path.
+        cutoffs (list): Cutoff frequencies of the grid.
+        peak_thresholds (list): Acc peak thresholds of the grid.
+        config (ClassifierConfig): Base configuration (window length, fs, filter order).
+
+    Returns:
+        dict: "features" (see window_features), "truth" (one label per window) and
+        "peak_counts" (peak count of each window keyed by (cutoff, peak threshold)).
+    """
+    classification = Classification(config=config)
+    features, truth, norm_windows = [], [], []
+    for path, label in paths.items():
+        data = load_log(path)
+        norms = classification.calculate_norm(data[:, 1:].reshape(-1, 2, 3))
+        windows = sliding_window_view(norms, config.window_length, axis=0)
+        features.append(window_features(sliding_window_view(data[:, 1:4], config.window_length, axis=0), windows))
+        norm_windows.append(windows[:, 0])
+        truth.append(np.full(len(windows), label, dtype=object))
+
+    features = {name: np.concatenate([f[name] for f in features]) for name in features[0]}
+    acc_norm_windows = np.concatenate(norm_windows)
+    peak_counts = {}
+    for cutoff in cutoffs:
+        b, a = butter_lowpass_coefficients(cutoff, config.fs, config.filter_order)
+        # Counts for every threshold in one pass: (windows, thresholds)
+        counts = peak_kernel(filtfilt(b, a, acc_norm_windows, axis=-1), peak_thresholds)
+        for index, threshold in enumerate(peak_thresholds):
+            peak_counts[cutoff, threshold] = counts[:, index]
+
+    return {"features": features, "truth": np.concatenate(truth), "peak_counts": peak_counts}
+
+def score(labels, truth):
+    """
+    Per-class precision and recall of window labels.
+
+    Returns:
+        dict: "<class>_precision" and "<class>_recall" for each class, and
+        "gesture_f1", the mean F1 score of the gestures.
+    """
+    metrics = {}
+    f1 = []
+    for label in CLASSES:
+        predicted = labels == label
+        expected = truth == label
+        hits = np.count_nonzero(predicted & expected)
+        precision = hits / np.count_nonzero(predicted) if predicted.any() else 0.0
+        recall = hits / np.count_nonzero(expected) if expected.any() else 0.0
+        metrics[f"{label}_precision"] = precision
+        metrics[f"{label}_recall"] = recall
+        if label in GESTURES:
+            f1.append(2 * precision * recall / (precision + recall) if precision + recall else 0.0)
+    metrics["gesture_f1"] = float(np.mean(f1))
+    return metrics
+
+# Precomputed data of each worker process, set once by init_worker
+_windows = None
+
+def init_worker(windows):
+    global _windows
+    _windows = windows
+
+def evaluate(configs):
+    """
+    Score a chunk of configurations on the precomputed windows.
+
+    Returns:
+        list: One dict of parameters and metrics per configuration.
+    """
+    results = []
+    for config in configs:
+        acc_peaks = _windows["peak_counts"][config.cutoff, config.acc_peak_threshold]
+        labels = decision_tree(_windows["features"], acc_peaks, config)
+        results.append({**asdict(config), **score(labels, _windows["truth"])})
+    return results
+
+def sweep(paths, grid, base_config=None, workers=None, chunk_size=256):
+    """
+    Evaluate every combination of the grid against the labeled logs.
+
+    Parameters:
+        paths (dict): Label of each log, keyed by path.
+        grid (dict): Values to try for each ClassifierConfig field.
+        base_config (ClassifierConfig): Values of the fields that are not swept.
+        workers (int): Number of processes (default: one per CPU).
+        chunk_size (int): Configurations evaluated per task.
+
+    Returns:
+        list: Parameters and metrics of each configuration, best gesture F1 first.
+    """
+    base_config = base_config or ClassifierConfig()
+    cutoffs = grid.get("cutoff", [base_config.cutoff])
+    peak_thresholds = grid.get("acc_peak_threshold", [base_config.acc_peak_threshold])
+    windows = precompute(paths, cutoffs, peak_thresholds, base_config)
+
+    names = list(grid)
+    configs = [replace(base_config, **dict(zip(names, values))) for values in itertools.product(*grid.values())]
+    chunks = [configs[i:i + chunk_size] for i in range(0, len(configs), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(windows,)) as executor:
+        results = [result for chunk in executor.map(evaluate, chunks) for result in chunk]
+
+    return sorted(results, key=lambda result: result["gesture_f1"], reverse=True)
+
+def parse_values(text):
+    """
+    Parse "a,b,c" as a list of values, or "start:stop:count" as evenly spaced values.
+    """
+    if ":" in text:
+        start, stop, count = text.split(":")
+        return np.linspace(float(start), float(stop), int(count))
+    return [float(value) for value in text.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the decision tree thresholds over the labeled IMU logs.")
+    for name in DEFAULT_GRID:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=parse_values, help="values 'a,b,c' or 'start:stop:count'")
+    parser.add_argument("--label", action="append", default=[], help="extra labeled log 'path=label'")
+    parser.add_argument("--workers", type=int, help="number of processes (default: one per CPU)")
+    parser.add_argument("--top", type=int, default=10, help="number of configurations printed")
+    parser.add_argument("--output", help="results file (default: sweeps/sweep_<date>.csv)")
+    args = parser.parse_args()
+
+    paths = {os.path.join(LOGS_PATH, log): label for log, label in LOG_LABELS.items()}
+    for item in args.label:
+        path, label = item.rsplit("=", 1)
+        paths[path] = label
+
+    grid = {name: getattr(args, name) if getattr(args, name) is not None else values for name, values in DEFAULT_GRID.items()}
+    print(f"[SWEEP] {np.prod([len(values) for values in grid.values()])} configurations on {len(paths)} logs...")
+    start = time.perf_counter()
+    results = sweep(paths, grid, workers=args.workers)
+    print(f"[SWEEP] Done in {time.perf_counter() - start:.1f} s")
+
+    output = args.output or os.path.join(RESULTS_PATH, f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+    columns = list(grid) + ["gesture_f1"] + [f"{gesture}_{metric}" for gesture in GESTURES for metric in ("precision", "recall")]
+    print("\t".join(columns))
+    for result in results[:args.top]:
+        print("\t".join(f"{result[column]:.3g}" for column in columns))
+    print(f"[SWEEP] Results written to {output}")
@@ -1,16 +1,56 @@
-import asyncio
-from bleak import BleakScanner
+import argparse
+import time
 
-async def scan_ble_devices():
+from ble_discovery import DEVICE_NAME_PREFIX, DiscoveryCache
+
+def scan_ble_devices(timeout, name_prefix=DEVICE_NAME_PREFIX):
+    """
+    Listen to the advertisements for timeout seconds, printing each device the
+    first time it is heard.
+    """
     print("Scanning for BLE devices...")
-    devices = await BleakScanner.discover()
-    if devices:
-        print("Found devices:")
-        for i, device in enumerate(devices, start=1):
-            if device.name != None:
-                print(f"{i}. Name: {device.name}, Address: {device.address}")
-    else:
+    discovery = DiscoveryCache(name_prefix)
+    discovery.start()
+    found = {}
+    stop = time.monotonic() + timeout
+    try:
+        while time.monotonic() < stop:
+            for name, address in discovery.devices().items():
+                if address not in found:
+                    found[address] = name
+                    print(f"{len(found)}. Name: {name}, Address: {address}")
+            time.sleep(0.1)
+    finally:
+        discovery.stop()
+    if not found:
         print("No BLE devices found.")
 
+def find_ble_device(target, timeout, name_prefix=DEVICE_NAME_PREFIX):
+    """
+    Wait for one device and return as soon as its advertisement arrives.
+    """
+    print(f"Looking for {target}...")
+    discovery = DiscoveryCache(name_prefix)
+    start = time.monotonic()
+    discovery.start()
+    try:
+        device = discovery.find(target, timeout).result()
+    finally:
+        discovery.stop()
+    if device is None:
+        print(f"{target} not found after {timeout:.0f} s.")
+    else:
+        print(f"Found {device.name} ({device.address}, {device.rssi} dBm) in {device.seen - start:.2f} s.")
+
 if __name__ == "__main__":
-    asyncio.run(scan_ble_devices())
+    parser = argparse.ArgumentParser(description="List the modules heard, or wait for one of them.")
+    parser.add_argument("--find", metavar="DEVICE", help="Address or name to wait for, stop as soon as it is heard")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Duration of the scan (s)")
+    parser.add_argument("--all", action="store_true", help=f"List every named device, not only {DEVICE_NAME_PREFIX}*")
+    args = parser.parse_args()
+
+    name_prefix = None if args.all else DEVICE_NAME_PREFIX
+    if args.find:
+        find_ble_device(args.find, args.timeout, name_prefix)
+    else:
+        scan_ble_devices(args.timeout, name_prefix)
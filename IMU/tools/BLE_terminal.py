@@ -1,39 +1,91 @@
-import asyncio
-from bleak import BleakClient
+import argparse
+import queue
+import time
+
+import ble_session
+from ble_frames import payload_text
+from ble_session import BLESessionManager, CONNECTED, DISCONNECTED, ERROR, NOTIFICATION
 
 # Replace with the hardcoded BLE address
 TOF_ADDRESS = "24:62:AB:F4:F4:7E"
 IMU_ADDRESS = "F8:B3:B7:22:2E:3A"
 CENTRAL_ADDRESS = "CC:DB:A7:9E:DC:FA"
 
-DEVICE_ADDRESS = CENTRAL_ADDRESS  # Replace with your BLE device address
+DEVICES = {"TOF": TOF_ADDRESS, "IMU": IMU_ADDRESS, "CENTRAL": CENTRAL_ADDRESS}
+DEVICE_ADDRESSES = [CENTRAL_ADDRESS]  # Default devices, e.g. [IMU_ADDRESS, TOF_ADDRESS] to listen to both
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"  # Replace with the correct characteristic UUID
 
-async def connect_and_listen(address):
-    try:
-        print(f"[CONNEXION] Connecting to BLE device at address {address}...")
-        async with BleakClient(address) as client:
-            if client.is_connected:
-                print(f"[CONNEXION] Successfully connected to {address}")
+MAX_PENDING = 1024  # Notifications waiting to be printed, for all the devices
+MAX_PENDING_PER_DEVICE = 512
+REPORT_INTERVAL = 10.0  # Seconds between two link and backpressure reports
+
+def device_name(address):
+    for name, known_address in DEVICES.items():
+        if known_address == address:
+            return name
+    return address
+
+def print_telemetry(manager):
+    print(f"[LINK] {manager.telemetry.status_line({address: name for name, address in DEVICES.items()})}")
 
-                # Define the notification handler
-                def handle_notification(sender, data):
-                    tab = '\t'
-                    print(f"{data.decode('utf-8', errors='ignore').replace(',',tab)}")
+def print_backpressure(manager):
+    for address, counts in manager.events.backpressure().items():
+        print(f"[QUEUE] {device_name(address)}: {counts['received']} received, {counts['dropped']} dropped, "
+              f"{counts['pending']} pending (max {counts['high_water']})")
 
-                # Start receiving notifications from the given characteristic UUID
-                await client.start_notify(CHARACTERISTIC_UUID, handle_notification)
+def listen(addresses):
+    """
+    Connect to every device at once and print their notifications as they arrive,
+    prefixed with the device name.
+    """
+    manager = BLESessionManager(maxsize=MAX_PENDING, device_maxsize=MAX_PENDING_PER_DEVICE)
+    manager.start()
+    for address in addresses:
+        manager.connect(address, CHARACTERISTIC_UUID)
 
-                # Keep the connection open to receive notifications
-                while client.is_connected:
-                    await asyncio.sleep(1)  # Sleep to keep the event loop active
+    tab = '\t'
+    next_report = time.monotonic() + REPORT_INTERVAL
+    try:
+        while True:
+            try:
+                event = manager.events.get(timeout=1.0)
+            except queue.Empty:
+                event = None
+
+            if event is None:
+                pass
+            elif event.kind == NOTIFICATION:
+                for line in payload_text(event.data).split("\n"):  # Text line or binary frame
+                    print(f"{device_name(event.address)}{tab}{line.replace(',',tab)}")
+            elif event.kind == CONNECTED:
+                print(f"[CONNEXION] Successfully connected to {event.address}")
+            elif event.kind == DISCONNECTED:
+                print(f"[CONNEXION] Connection lost with {event.address}, reconnecting...")
+            elif event.kind == ERROR:
+                print(f"[CONNEXION] Error while connecting to {event.address}: {event.data}")
 
-                print(f"[CONNEXION] Notifications stopped for {address}.")
-            else:
-                print(f"[CONNEXION] Failed to connect to {address}.")
-    except Exception as e:
-        print(f"[CONNEXION] Error while connecting: {e}")
+            if time.monotonic() >= next_report:
+                print_telemetry(manager)
+                print_backpressure(manager)
+                next_report += REPORT_INTERVAL
+    except KeyboardInterrupt:
+        print("[CONNEXION] Stopping...")
+    finally:
+        manager.stop()
+        print_telemetry(manager)
+        print_backpressure(manager)
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(connect_and_listen(DEVICE_ADDRESS))
+    parser = argparse.ArgumentParser(description="Print the notifications of one or several BLE devices.")
+    parser.add_argument("devices", nargs="*", help=f"Device names ({', '.join(DEVICES)}) or addresses")
+    parser.add_argument("--replay", metavar="LOG", help="Replay a recorded log for every device instead of connecting to them")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, relative to the recorded rate")
+    args = parser.parse_args()
+
+    if args.replay:
+        import ble_replay
+        ble_replay.add_source(None, args.replay, speed=args.speed)
+        ble_session.BleakClient = ble_replay.ReplayClient
+
+    addresses = [DEVICES.get(device.upper(), device) for device in args.devices] or DEVICE_ADDRESSES
+    listen(addresses)
@@ -1,7 +1,6 @@
 import sys
 import os
-import asyncio
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -13,68 +12,14 @@ from PyQt5.QtWidgets import (
     QMessageBox,
     QSpinBox,
 )
-from bleak import BleakScanner, BleakClient
-from qasync import QEventLoop
 import csv
 from datetime import datetime
 
-class BLEClientWorker(QThread):
-    connection_success = pyqtSignal(str)
-    connection_error = pyqtSignal(str)
-    notification_received = pyqtSignal(bytearray)
+from ble_discovery import DiscoveryCache
+from ble_frames import payload_text
+from ble_session import SessionEventsMixin
 
-    def __init__(self, address, BLEApp):
-        super().__init__()
-        self.address = address
-        self.BLEApp = BLEApp
-
-    def run(self):
-        asyncio.run(self.connect_and_listen())
-
-    async def connect_and_listen(self):
-        try:
-            print(f"[CONNEXION] Connexion au périphérique BLE à l'adresse {self.address}...")
-            self.BLEApp.client = BleakClient(self.address)
-            await self.BLEApp.client.connect()
-            if self.BLEApp.client.is_connected:
-                self.connection_success.emit(self.address)
-
-                # Enable notifications
-                def handle_notification(sender, data):
-                    self.notification_received.emit(data)
-
-                char_uuid = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
-                await self.BLEApp.client.start_notify(char_uuid, handle_notification)
-
-                # Continuously listen for notifications
-                while self.BLEApp.client.is_connected:
-                    await asyncio.sleep(1)  # Check if still connected every second
-
-                print(f"[CONNEXION] Notifications désactivées pour {self.address}.")
-
-        except Exception as e:
-            self.connection_error.emit(str(e))
-
-
-class BLEWorker(QThread):
-    devices_found = pyqtSignal(dict)
-    error_occurred = pyqtSignal(str)
-
-    def run(self):
-        asyncio.run(self.scan_devices())
-
-    async def scan_devices(self):
-        print("[SCAN] Début du scan BLE...")
-        try:
-            devices = await BleakScanner.discover()
-            result = {device.name: device.address for device in devices if device.name}
-            print(f"[SCAN] Périphériques trouvés : {result}")
-            self.devices_found.emit(result)
-        except Exception as e:
-            print(f"[SCAN] Erreur lors du scan : {e}")
-            self.error_occurred.emit(str(e))
-
-class BLEApp(QWidget):
+class BLEApp(SessionEventsMixin, QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("BLE Device Manager")
@@ -82,7 +27,8 @@ class BLEApp(QWidget):
 
         self.devices = {}
         self.selected_device = None
-        self.client = None
+        self.address = None
+        self.connected = False
         self.is_logging = False
         self.log_timer = None
 
@@ -130,22 +76,34 @@ class BLEApp(QWidget):
         self.status_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.status_label)
 
+        self.link_label = QLabel("Liaison : -")  # Débit, gigue et pertes de la liaison BLE
+        self.link_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.link_label)
+
         self.data_label = QLabel("Données BLE :")
         layout.addWidget(self.data_label)
 
         self.text_area = QTextEdit()
         self.text_area.setReadOnly(True)
+        self.text_area.document().setMaximumBlockCount(1000)  # Only keep the last samples
         layout.addWidget(self.text_area)
 
         self.setLayout(layout)
 
+        # The BLE link and its notifications, drained 30 times per second (see SessionEventsMixin).
+        # The modules are scanned for in the background, so the scan shows them at once.
+        self.discovery = DiscoveryCache()
+        self.start_session(self.discovery)
+        self.event_timer = QTimer(self)
+        self.event_timer.timeout.connect(self.process_events)
+        self.event_timer.start(33)
+        self.link_timer = QTimer(self)
+        self.link_timer.timeout.connect(self.update_link_status)
+        self.link_timer.start(1000)
+
     def scan_devices(self):
         print("[SCAN] Bouton 'Scanner' cliqué.")
-        self.status_label.setText("Statut : Scan en cours...")
-        self.worker = BLEWorker()
-        self.worker.devices_found.connect(self.update_devices)
-        self.worker.error_occurred.connect(self.show_error)
-        self.worker.start()
+        self.update_devices(self.discovery.devices())
 
     def update_devices(self, devices):
         print(f"[SCAN] Mise à jour des périphériques : {devices}")
@@ -157,11 +115,6 @@ class BLEApp(QWidget):
         else:
             self.status_label.setText("Statut : Aucun périphérique trouvé.")
 
-    def show_error(self, error):
-        print(f"[ERREUR] {error}")
-        self.status_label.setText(f"Erreur : {error}")
-        QMessageBox.critical(self, "Erreur", f"Une erreur s'est produite : {error}")
-
     def connect_device(self):
         device_name = self.device_dropdown.currentText()
         print(f"[CONNEXION] Tentative de connexion au périphérique : {device_name}")
@@ -176,67 +129,47 @@ class BLEApp(QWidget):
             return
 
         self.status_label.setText(f"Statut : Connexion à {address}...")
-        self.client_worker = BLEClientWorker(address, self)
-        self.client_worker.connection_success.connect(self.on_connection_success)
-        self.client_worker.connection_error.connect(self.on_connection_error)
-        self.client_worker.notification_received.connect(self.on_notification_received)
-        self.client_worker.start()
-
-    def on_connection_success(self, address):
-        print(f"[CONNEXION] Connecté avec succès à {address}.")
-        self.status_label.setText(f"Statut : Connecté à {address}")
+        self.address = address
         self.connect_button.setEnabled(False)
         self.disconnect_button.setEnabled(True)
+        self.session_manager.connect(address)
 
-    def on_connection_error(self, error):
-        print(f"[CONNEXION] Erreur lors de la connexion : {error}")
-        self.status_label.setText(f"Erreur : {error}")
-        QMessageBox.critical(self, "Erreur", f"Une erreur s'est produite : {error}")
+    def update_link_status(self):
+        status = self.session_manager.telemetry.status_line()
+        self.link_label.setText(f"Liaison : {status or '-'}")
 
-    def on_notification_received(self, data):
-        data = data.decode('utf-8', errors='ignore')
-        print(f"[NOTIFICATION] {data}")
-        self.text_area.append(data)
+    def on_notifications_received(self, payloads):
+        text = "\n".join(payload_text(data) for data in payloads)  # Text lines or binary frames
+        self.text_area.append(text)  # One appended block per batch
         if self.is_logging:
-            self.save_log(data)
+            self.save_log(text.split("\n"))
 
     def disconnect_device(self):
-        if self.client and self.client.is_connected:
+        if self.address:
             print("[DÉCONNEXION] Déconnexion en cours...")
-            # Demander une déconnexion asynchrone dans la boucle événementielle
-            asyncio.ensure_future(self.async_disconnect_device())
-
-    async def async_disconnect_device(self):
-        try:
-            await self.client.disconnect()
-            print("[DÉCONNEXION] Déconnecté avec succès.")
-            
-            # Mettez à jour l'interface graphique dans le thread principal en utilisant QMetaObject
-            QMetaObject.invokeMethod(self, "on_disconnect_success", Qt.QueuedConnection)
-
-        except Exception as e:
-            print(f"[DÉCONNEXION] Erreur lors de la déconnexion : {e}")
-            # Mettez à jour l'interface graphique avec une erreur
-            QMetaObject.invokeMethod(self, "on_disconnect_error", Qt.QueuedConnection, Q_ARG(str, str(e)))
+            self.disconnect_button.setEnabled(False)
+            self.session_manager.disconnect(self.address)
 
     def on_disconnect_success(self):
+        print("[DÉCONNEXION] Déconnecté avec succès.")
         self.status_label.setText("Statut : Déconnecté.")
         self.connect_button.setEnabled(True)
         self.disconnect_button.setEnabled(False)
-        self.client = None
-
-    def on_disconnect_error(self, error):
-        self.status_label.setText(f"Erreur : {error}")
-        QMessageBox.critical(self, "Erreur", f"Une erreur s'est produite : {error}")
+        self.address = None
+        self.connected = False
 
     def close_application(self):
         print("[FERMETURE] Fermeture de l'application...")
-        if self.client and self.client.is_connected:
-            asyncio.run(self.async_disconnect_device())
         self.close()
 
+    def closeEvent(self, event):
+        self.event_timer.stop()
+        self.link_timer.stop()
+        self.session_manager.stop()
+        super().closeEvent(event)
+
     def start_logging(self):
-        if not self.client or not self.client.is_connected:
+        if not self.connected:
             QMessageBox.warning(self, "Avertissement", "Veuillez d'abord vous connecter à un périphérique.")
             return
 
@@ -282,21 +215,16 @@ class BLEApp(QWidget):
         csv_writer.writerow("time[us],acc_x[mg],acc_y[mg],acc_z[mg],gyro_x[mdps],gyro_y[mdps],gyro_z[mdps]".split(","))  # Header row
         return log_file
 
-    def save_log(self, data):
+    def save_log(self, lines):
         if self.is_logging and self.log_file:
-            print("Writing log")
+            print(f"Writing {len(lines)} log rows")
             csv_writer = csv.writer(self.log_file)
-            csv_writer.writerow(data.split(","))
+            csv_writer.writerows(line.split(",") for line in lines)
 
 if __name__ == "__main__":
     app = QApplication([])
 
-    # Boucle événementielle asynchrone
-    loop = QEventLoop(app)
-    asyncio.set_event_loop(loop)
-
     window = BLEApp()
     window.show()
 
-    with loop:
-        loop.run_forever()
+    sys.exit(app.exec_())
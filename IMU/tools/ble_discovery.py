@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+from bleak import BleakScanner
+
+DEVICE_NAME_PREFIX = "ESP32_EUC"  # Advertised name of every module
+
+# A device of the cache: device is bleak's BLEDevice, to connect without scanning
+# again, seen the time.monotonic() of its last advertisement.
+Device = namedtuple("Device", ["name", "address", "rssi", "seen", "device"])
+
+class DiscoveryCache:
+    """
+    Long-lived BLE scanner keeping the modules it hears in a cache, instead of a
+    blocking BleakScanner.discover() for each scan.
+
+    The cache keeps the devices whose name starts with name_prefix or whose
+    address is known, for ttl seconds after their last advertisement. A wait for
+    a device resolves as soon as its advertisement arrives.
+
+    Example:
+        discovery = DiscoveryCache()
+        discovery.start()
+        devices = discovery.devices()  # {name: address}, at once
+        device = discovery.find("F8:B3:B7:22:2E:3A").result()  # Device or None
+    """
+    def __init__(self, name_prefix=DEVICE_NAME_PREFIX, addresses=(), ttl=10.0, retry_interval=2.0):
+        """
+        Parameters:
+            name_prefix (str): Prefix of the names to keep (None: keep every named device).
+            addresses (iterable): Addresses to keep whatever their name.
+            ttl (float): Time a device stays in the cache after its last advertisement (s).
+            retry_interval (float): Delay before restarting the scanner after an error (s).
+        """
+        self.name_prefix = name_prefix
+        self.addresses = {address.upper() for address in addresses}
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+
+        self.cache = {}  # Device by address
+        self.lock = threading.Lock()  # The cache is read from the GUI threads
+        self.waiters = []  # (target, since, future) of the pending waits, only touched from the event loop
+        self.loop = None
+        self.thread = None
+        self.task = None
+        self.closing = None
+
+    def start(self, loop=None):
+        """
+        Start scanning in the background.
+
+        Parameters:
+            loop (asyncio.AbstractEventLoop): Running event loop to scan from, e.g.
+                the one of a BLESessionManager. By default, a new one in a daemon thread.
+        """
+        if self.loop is not None:
+            return
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=loop.run_forever, name="DiscoveryCache", daemon=True)
+            self.thread.start()
+        self.loop = loop
+        asyncio.run_coroutine_threadsafe(self.open(), loop).result()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop scanning, and the event loop thread if start() created it. Thread-safe.
+        """
+        if self.loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.close(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"[SCAN] Erreur lors de l'arrêt du scan : {e}")
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+            self.thread = None
+        self.loop = None
+
+    def matches(self, name, address):
+        if address.upper() in self.addresses:
+            return True
+        if self.name_prefix is None:
+            return bool(name)
+        return bool(name) and name.startswith(self.name_prefix)
+
+    def on_detection(self, device, advertisement_data):
+        # Called by bleak on the event loop for each advertisement
+        name = advertisement_data.local_name or device.name
+        if not self.matches(name, device.address):
+            return
+        entry = Device(name, device.address, advertisement_data.rssi, time.monotonic(), device)
+        with self.lock:
+            self.cache[device.address.upper()] = entry
+        for waiter in list(self.waiters):
+            target, since, future = waiter
+            if self.is_target(entry, target, since) and not future.done():
+                future.set_result(entry)
+
+    @staticmethod
+    def is_target(entry, target, since=None):
+        if since is not None and entry.seen < since:
+            return False
+        return entry.address.upper() == target.upper() or entry.name == target
+
+    def fresh(self):
+        """
+        Returns:
+            list: The devices heard less than ttl seconds ago, most recent first.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for address in [address for address, entry in self.cache.items() if now - entry.seen > self.ttl]:
+                del self.cache[address]
+            return sorted(self.cache.values(), key=lambda entry: entry.seen, reverse=True)
+
+    def devices(self):
+        """
+        Devices of the cache, without waiting. Thread-safe.
+
+        Returns:
+            dict: Addresses by name (by address for the unnamed ones).
+        """
+        return {entry.name or entry.address: entry.address for entry in self.fresh()}
+
+    async def wait_for(self, target, timeout=10.0, since=None):
+        """
+        Wait for a device, from the event loop.
+
+        Parameters:
+            target (str): Address or name of the device.
+            timeout (float): Maximum wait (s).
+            since (float): Only accept an advertisement received after this
+                time.monotonic(), e.g. after the device rebooted.
+
+        Returns:
+            Device or None: The device, None if it was not heard in time.
+        """
+        self.addresses.add(target.upper())  # Keep the target even if its name does not match
+        for entry in self.fresh():
+            if self.is_target(entry, target, since):
+                return entry
+
+        waiter = (target, since, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[2], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiters.remove(waiter)
+
+    def find(self, target, timeout=10.0, since=None):
+        """
+        Wait for a device, from any thread. See wait_for.
+
+        Returns:
+            concurrent.futures.Future: Resolved to the Device, or None.
+        """
+        return asyncio.run_coroutine_threadsafe(self.wait_for(target, timeout, since), self.loop)
+
+    async def open(self):
+        self.closing = asyncio.Event()
+        self.task = asyncio.ensure_future(self.scan())
+
+    async def close(self):
+        if self.task is None:
+            return
+        self.closing.set()
+        await self.task
+        self.task = None
+
+    async def scan(self):
+        """
+        Keep a scanner running until close(), restarting it after an error
+        (e.g. Bluetooth turned off).
+        """
+        while not self.closing.is_set():
+            scanner = BleakScanner(detection_callback=self.on_detection)
+            try:
+                await scanner.start()
+                print("[SCAN] Scan BLE en arrière-plan démarré.")
+                await self.closing.wait()
+            except Exception as e:
+                print(f"[SCAN] Erreur lors du scan : {e}")
+            finally:
+                try:
+                    await scanner.stop()
+                except Exception:
+                    pass
+            if not self.closing.is_set():
+                try:
+                    await asyncio.wait_for(self.closing.wait(), self.retry_interval)
+                except asyncio.TimeoutError:
+                    pass
@@ -0,0 +1,369 @@
+"""
+Binary frames of the IMU and TOF notifications, with a fallback to the text format.
+
+The modules send one CSV line per notification: "time,acc_x,acc_y,acc_z,gyro_x,gyro_y,gyro_z"
+for the IMU, and "distance:status," for each zone (or "X:X," when no target is
+detected) for the TOF. A binary frame packs several samples in one notification
+instead, decoded with np.frombuffer and no string parsing.
+
+Frame layout, little-endian:
+    header (8 bytes):
+        uint8  magic      0xA5, never the first byte of a text payload
+        uint8  version    FRAME_VERSION
+        uint8  kind       IMU_FRAME or TOF_FRAME
+        uint8  count      Samples in the frame
+        uint32 sequence   Index of the first sample since the module started (wraps)
+    count records:
+        IMU (22 bytes): uint32 time[us], int16 acc_x/y/z[mg], int32 gyro_x/y/z[mdps]
+        TOF (3 bytes per zone): int16 distance[mm] of each zone, then uint8 status
+            of each zone. 16 or 64 zones, given by the payload length. A zone
+            without target has INVALID_DISTANCE and INVALID_STATUS.
+
+At the default ATT MTU of 247 bytes, a frame holds 10 IMU samples or one 8x8 TOF frame.
+"""
+import argparse
+import glob
+import os
+import sys
+import warnings
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+FRAME_MAGIC = 0xA5
+FRAME_VERSION = 1
+IMU_FRAME = 1
+TOF_FRAME = 2
+
+MAX_PAYLOAD = 244  # ATT MTU of 247 bytes, minus the 3 bytes of the notification header
+INVALID_DISTANCE = -32768
+INVALID_STATUS = 255
+TOF_ZONES = (16, 64)
+
+HEADER_DTYPE = np.dtype([("magic", "u1"), ("version", "u1"), ("kind", "u1"), ("count", "u1"), ("sequence", "<u4")])
+IMU_DTYPE = np.dtype([("time", "<u4"), ("acc", "<i2", (3,)), ("gyro", "<i4", (3,))])
+MAX_IMU_SAMPLES = (MAX_PAYLOAD - HEADER_DTYPE.itemsize) // IMU_DTYPE.itemsize
+
+# A decoded frame: records is a structured array of IMU_DTYPE or tof_dtype(zones)
+Frame = namedtuple("Frame", ["kind", "sequence", "records"])
+
+def tof_dtype(zones):
+    return np.dtype([("distance", "<i2", (zones,)), ("status", "u1", (zones,))])
+
+def as_bytes(payload):
+    if isinstance(payload, str):
+        return payload.encode()
+    if not isinstance(payload, bytes):
+        return bytes(payload)
+    return payload
+
+def is_frame(payload):
+    """
+    Tell a binary frame from a text payload, from its first byte.
+    """
+    return len(payload) > 0 and payload[0] == FRAME_MAGIC
+
+def decode_frame(payload):
+    """
+    Decode a binary frame.
+
+    Parameters:
+        payload (bytes, bytearray or memoryview): The notification payload.
+
+    Returns:
+        Frame: The kind, sequence number and records of the frame.
+
+    Raises:
+        ValueError: If the payload is not a complete frame of a known version and kind.
+    """
+    payload = as_bytes(payload)
+    if len(payload) < HEADER_DTYPE.itemsize or not is_frame(payload):
+        raise ValueError(f"Not a frame: {payload[:16]!r}")
+    header = np.frombuffer(payload, HEADER_DTYPE, count=1)[0]
+    if header["version"] != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {header['version']}")
+
+    count = int(header["count"])
+    size = len(payload) - HEADER_DTYPE.itemsize
+    if header["kind"] == IMU_FRAME:
+        dtype = IMU_DTYPE
+    elif header["kind"] == TOF_FRAME and count and size % (3 * count) == 0 and size // (3 * count) in TOF_ZONES:
+        dtype = tof_dtype(size // (3 * count))
+    else:
+        raise ValueError(f"Malformed frame of kind {header['kind']} and {len(payload)} bytes")
+    if size != count * dtype.itemsize:
+        raise ValueError(f"Malformed frame, expected {count} record(s) of {dtype.itemsize} bytes, got {size} bytes")
+    records = np.frombuffer(payload, dtype, count=count, offset=HEADER_DTYPE.itemsize)
+    return Frame(int(header["kind"]), int(header["sequence"]), records)
+
+def frame_sequence(payload):
+    """
+    Returns:
+        int or None: The sequence number of a binary frame, None for a text payload.
+    """
+    if not is_frame(payload) or len(payload) < HEADER_DTYPE.itemsize:
+        return None
+    return int(np.frombuffer(as_bytes(payload), HEADER_DTYPE, count=1)[0]["sequence"])
+
+def fromstring_raises():
+    """
+    Tell whether np.fromstring raises on a field it cannot parse. NumPy before
+    2.x stops there with a DeprecationWarning and returns the values before.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        try:
+            np.fromstring(b"1,x", sep=",")
+        except ValueError:
+            return True
+    return False
+
+FROMSTRING_RAISES = fromstring_raises()
+
+# Characters of the comma-separated decimals the modules send. Without letters,
+# neither nan, inf nor an exponent (which could overflow to inf) gets through.
+DECIMAL_CHARACTERS = b"0123456789+-. \t,"
+# Without spaces either, so a lone sign (read as 0) is always next to a comma
+INTEGER_CHARACTERS = b"0123456789+-,"
+
+@lru_cache(maxsize=None)
+def is_integer(dtype):
+    return np.dtype(dtype).kind in "iu"
+
+def parse_values(text, dtype=float, count=None):
+    """
+    Parse comma-separated numbers with a single np.fromstring call.
+
+    Parameters:
+        text (bytes): The values, separated by commas only.
+        dtype (type): Type of the values. Integer types take integers only.
+        count (int): Number of values expected, one per field if not given.
+
+    Returns:
+        np.ndarray: One value per field.
+
+    Raises:
+        ValueError: On an empty, non-numeric, nan or infinite field.
+    """
+    integer = is_integer(dtype)
+    if text.translate(None, INTEGER_CHARACTERS if integer else DECIMAL_CHARACTERS):
+        raise ValueError(f"Malformed payload, non-numeric value: {text!r}")
+    # np.fromstring reads a lone sign as the integer 0
+    if integer and (b"-," in text or b"+," in text or text.endswith((b"-", b"+"))):
+        raise ValueError(f"Malformed payload, non-numeric value: {text!r}")
+    try:
+        if FROMSTRING_RAISES:
+            values = np.fromstring(text, dtype=dtype, sep=',')
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", DeprecationWarning)
+                values = np.fromstring(text, dtype=dtype, sep=',')
+    except (ValueError, DeprecationWarning):
+        raise ValueError(f"Malformed payload, non-numeric value: {text!r}") from None
+    # A trailing empty field ends the parse without an error
+    if values.size != (text.count(b',') + 1 if count is None else count):
+        raise ValueError(f"Malformed payload, empty value: {text!r}")
+    return values
+
+def is_imu_payload(payload, n_channels=7):
+    """
+    Tell the IMU samples from the other payloads of the characteristic, e.g. the
+    classification codes ("0", "1", "2") of the hand firmware, without parsing them.
+
+    Returns:
+        bool: True for an IMU frame, or for text lines of n_channels comma-separated fields.
+    """
+    payload = as_bytes(payload)
+    if is_frame(payload):
+        return len(payload) >= HEADER_DTYPE.itemsize and payload[2] == IMU_FRAME
+    return all(line.count(b",") == n_channels - 1 for line in payload.strip().split(b"\n"))
+
+def decode_imu(payload, n_channels=7, dtype=float):
+    """
+    Decode IMU samples from a binary frame or from "time,acc_x,acc_y,acc_z,gyro_x,gyro_y,gyro_z"
+    lines, without decoding them to Python strings or floats one by one.
+
+    Parameters:
+        payload (bytes, bytearray, memoryview or str): Raw notification payload,
+            text lines separated by newlines.
+        n_channels (int): Number of values per text line (7 for a frame).
+        dtype (type): Type of the values (e.g. np.int64 for the integer mg/mdps stream).
+
+    Returns:
+        np.ndarray: A (samples, n_channels) array.
+
+    Raises:
+        ValueError: If the payload is neither an IMU frame nor complete numeric lines.
+    """
+    payload = as_bytes(payload)
+    if is_frame(payload):
+        frame = decode_frame(payload)
+        if frame.kind != IMU_FRAME or n_channels != 7:
+            raise ValueError(f"Not an IMU frame of {n_channels} values per sample")
+        samples = np.empty((len(frame.records), 7), dtype=dtype)
+        samples[:, 0] = frame.records["time"]
+        samples[:, 1:4] = frame.records["acc"]
+        samples[:, 4:7] = frame.records["gyro"]
+        return samples
+
+    payload = payload.strip().replace(b'\r', b'')
+    if b'\n' not in payload:
+        # One sample per notification, the common case
+        if payload.count(b',') != n_channels - 1:
+            raise ValueError(f"Malformed payload, expected 1 line(s) of {n_channels} values: {payload!r}")
+        return parse_values(payload, dtype, n_channels).reshape(1, n_channels)
+    lines = payload.split(b'\n')
+    # Checked line by line, a short line followed by a long one has the right total
+    if any(line.count(b',') != n_channels - 1 for line in lines):
+        raise ValueError(f"Malformed payload, expected {len(lines)} line(s) of {n_channels} values: {payload!r}")
+    return parse_values(payload.replace(b'\n', b','), dtype, len(lines) * n_channels).reshape(len(lines), n_channels)
+
+def decode_tof(payload):
+    """
+    Decode TOF frames from a binary frame or from "distance:status," lines.
+
+    Returns:
+        tuple: The (frames, zones) int16 distances and uint8 status, with
+        INVALID_DISTANCE and INVALID_STATUS for the zones without target ("X:X").
+
+    Raises:
+        ValueError: If the payload is neither a TOF frame nor complete lines of 16 or 64 zones.
+    """
+    payload = as_bytes(payload)
+    if is_frame(payload):
+        frame = decode_frame(payload)
+        if frame.kind != TOF_FRAME:
+            raise ValueError("Not a TOF frame")
+        return frame.records["distance"], frame.records["status"]
+
+    payload = payload.strip().replace(b'\r', b'')
+    lines = [line.strip(b',') for line in payload.split(b'\n')]
+    zones = lines[0].count(b':')
+    # Checked line by line, as the IMU lines
+    if zones not in TOF_ZONES or any(line.count(b':') != zones or line.count(b',') != zones - 1 for line in lines):
+        raise ValueError(f"Malformed TOF payload, expected {len(lines)} line(s) of 16 or 64 zones: {payload[:64]!r}")
+    text = b','.join(lines).replace(b'X:X', b'%d:%d' % (INVALID_DISTANCE, INVALID_STATUS))
+    pairs = parse_values(text.replace(b':', b','), np.int32, 2 * zones * len(lines)).reshape(len(lines), zones, 2)
+    return pairs[:, :, 0].astype(np.int16), pairs[:, :, 1].astype(np.uint8)
+
+def payload_text(payload):
+    """
+    Text form of a payload, as the modules send it without frames: the payload
+    itself for text, one line per sample for a frame.
+    """
+    payload = as_bytes(payload)
+    if not is_frame(payload):
+        return payload.decode('utf-8', errors='ignore').strip()
+    try:
+        frame = decode_frame(payload)
+    except ValueError as e:
+        return f"[FRAMES] {e}"
+    if frame.kind == IMU_FRAME:
+        return "\n".join(",".join(str(value) for value in row) for row in decode_imu(payload, dtype=np.int64))
+    lines = []
+    for distances, status in zip(frame.records["distance"], frame.records["status"]):
+        lines.append("".join("X:X," if s == INVALID_STATUS else f"{d}:{s}," for d, s in zip(distances, status)))
+    return "\n".join(lines)
+
+def encode_imu_frame(samples, sequence):
+    """
+    Pack IMU samples in a frame, as the modules would.
+
+    Parameters:
+        samples (np.ndarray): (samples, 7) time[us], acc[mg] and gyro[mdps], at most MAX_IMU_SAMPLES.
+        sequence (int): Index of the first sample.
+
+    Returns:
+        bytes: The frame.
+    """
+    samples = np.asarray(samples)
+    if not 0 < len(samples) <= MAX_IMU_SAMPLES:
+        raise ValueError(f"A frame holds 1 to {MAX_IMU_SAMPLES} IMU samples, got {len(samples)}")
+    records = np.empty(len(samples), IMU_DTYPE)
+    records["time"] = np.asarray(samples[:, 0], dtype=np.int64) % (1 << 32)
+    records["acc"] = samples[:, 1:4]
+    records["gyro"] = samples[:, 4:7]
+    return encode_header(IMU_FRAME, len(samples), sequence) + records.tobytes()
+
+def encode_tof_frame(distances, status, sequence):
+    """
+    Pack TOF frames in a frame, see encode_imu_frame.
+
+    Parameters:
+        distances, status (np.ndarray): (frames, zones) as returned by decode_tof.
+        sequence (int): Index of the first TOF frame.
+    """
+    distances = np.atleast_2d(distances)
+    records = np.empty(len(distances), tof_dtype(distances.shape[1]))
+    records["distance"] = distances
+    records["status"] = np.atleast_2d(status)
+    return encode_header(TOF_FRAME, len(distances), sequence) + records.tobytes()
+
+def encode_header(kind, count, sequence):
+    header = np.array([(FRAME_MAGIC, FRAME_VERSION, kind, count, sequence % (1 << 32))], HEADER_DTYPE)
+    return header.tobytes()
+
+def check_imu_log(path):
+    """
+    Pack an IMU log in frames and check that they decode to the text samples.
+
+    Returns:
+        tuple: (identical, text bytes, frame bytes, notifications with text, with frames)
+    """
+    lines = [line.strip().encode() for line in open(path) if line[:1].isdigit()]
+    expected = decode_imu(b"\n".join(lines), dtype=np.int64)
+    frames = [encode_imu_frame(expected[start:start + MAX_IMU_SAMPLES], start)
+              for start in range(0, len(expected), MAX_IMU_SAMPLES)]
+    decoded = np.concatenate([decode_imu(frame, dtype=np.int64) for frame in frames])
+    identical = np.array_equal(decoded, expected) and frame_sequence(frames[-1]) == (len(frames) - 1) * MAX_IMU_SAMPLES
+    return identical, sum(map(len, lines)), sum(map(len, frames)), len(lines), len(frames)
+
+def check_tof_archive(path):
+    """
+    Pack a TOF archive (Timestamp,Data CSV) in frames, see check_imu_log. The
+    lines that are not a whole TOF frame (split notifications) are skipped.
+
+    Returns:
+        tuple or None: See check_imu_log, None if the archive has no whole TOF frame.
+    """
+    lines = []
+    for line in open(path):
+        if line[:1].isdigit():
+            try:
+                decode_tof(line.strip().split(",", 1)[1])
+            except ValueError:
+                continue
+            lines.append(line.strip().split(",", 1)[1].encode())
+    if not lines:
+        return None
+    distances, status = decode_tof(b"\n".join(lines))
+    frames = [encode_tof_frame(distances[i], status[i], i) for i in range(len(distances))]
+    decoded = [decode_tof(frame) for frame in frames]
+    identical = (np.array_equal(np.concatenate([d for d, _ in decoded]), distances)
+                 and np.array_equal(np.concatenate([s for _, s in decoded]), status)
+                 and [payload_text(frame).encode() for frame in frames] == lines)
+    return identical, sum(map(len, lines)), sum(map(len, frames)), len(lines), len(frames)
+
+if __name__ == "__main__":
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    parser = argparse.ArgumentParser(description="Pack the recorded logs in frames and check the decoder.")
+    parser.add_argument("--imu", nargs="*", help="IMU logs (default: IMU/data_processing/peak_detection/logs)")
+    parser.add_argument("--tof", nargs="*", help="TOF archives (default: TOF/Data_processing/Archives_csv)")
+    args = parser.parse_args()
+
+    imu_paths = args.imu or sorted(glob.glob(os.path.join(root, "IMU", "data_processing", "peak_detection", "logs", "*.csv")))
+    tof_paths = args.tof or sorted(glob.glob(os.path.join(root, "TOF", "Data_processing", "Archives_csv", "*.csv")))
+    all_identical = True
+    for check, paths in ((check_imu_log, imu_paths), (check_tof_archive, tof_paths)):
+        for path in paths:
+            result = check(path)
+            if result is None:
+                print(f"[FRAMES] {os.path.basename(path):<22}skipped, no whole frame")
+                continue
+            identical, text_size, frame_size, text_count, frame_count = result
+            all_identical &= identical
+            print(f"[FRAMES] {os.path.basename(path):<22}{'OK' if identical else 'MISMATCH':<10}"
+                  f"{text_count} notifications, {text_size} bytes -> {frame_count} frames, {frame_size} bytes "
+                  f"({text_size / frame_size:.1f}x smaller)")
+    sys.exit(0 if all_identical else 1)
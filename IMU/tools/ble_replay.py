@@ -0,0 +1,350 @@
+"""
+Stand-in for bleak's BleakClient that replays recorded logs as notifications,
+to run the BLE tools and load-test them without the modules.
+
+ReplayClient implements the part of the BleakClient API the tools use
+(connect, disconnect, is_connected, start_notify, stop_notify, get_services,
+async with). Each address replays one log, registered with add_source:
+
+    import ble_replay, ble_session
+    ble_replay.add_source(IMU_ADDRESS, "peak_detection/logs/chest_tap.csv", speed=10)
+    ble_session.BleakClient = ble_replay.ReplayClient
+
+IMU logs (BLE_visualizer CSV) are timed by their time[us] column, TOF archives
+(Timestamp,Data CSV) by their Timestamp column.
+
+Run as a script, it replays logs through a BLESessionManager at several speeds
+and reports, for each speed, whether a consumer keeps up.
+"""
+import argparse
+import asyncio
+import glob
+import io
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import numpy as np
+
+from ble_frames import MAX_IMU_SAMPLES, decode_imu, decode_tof, encode_imu_frame, encode_tof_frame
+from ble_session import BLESessionManager, CHARACTERISTIC_UUID, NOTIFICATION
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+IMU_LOGS_PATH = os.path.join(ROOT_PATH, "IMU", "data_processing", "peak_detection", "logs")
+TOF_ARCHIVES_PATH = os.path.join(ROOT_PATH, "TOF", "Data_processing", "Archives_csv")
+SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
+
+def read_log(path, frames=False):
+    """
+    Read the notifications of an IMU log or a TOF archive, with their times.
+
+    Parameters:
+        path (str): Path to the CSV file.
+        frames (bool): Pack the samples in binary frames (see ble_frames) instead
+            of one text line per notification. TOF lines that are not a whole
+            frame are then skipped.
+
+    Returns:
+        tuple: The times of the notifications (s, from the first one) and their payloads (bytes).
+    """
+    with open(path, "rb") as file:
+        lines = [line.strip() for line in file if line[:1].isdigit()]
+    if not lines:
+        return np.zeros(0), []
+
+    if b"T" in lines[0].split(b",", 1)[0]:  # "2025-01-17T15:17:35.518975,..." TOF archive
+        stamps = [line.split(b",", 1) for line in lines]
+        times = np.array([datetime.fromisoformat(stamp.decode()).timestamp() for stamp, _ in stamps])
+        payloads = [data for _, data in stamps]
+        if frames:
+            kept = []
+            for i, data in enumerate(payloads):
+                try:
+                    distances, status = decode_tof(data)
+                except ValueError:
+                    continue
+                kept.append((times[i], encode_tof_frame(distances, status, len(kept))))
+            times = np.array([t for t, _ in kept])
+            payloads = [frame for _, frame in kept]
+    else:
+        samples = decode_imu(b"\n".join(lines), dtype=np.int64)
+        times = samples[:, 0] * 1e-6
+        payloads = lines
+        if frames:
+            # A frame is sent once its last sample is read
+            starts = range(0, len(samples), MAX_IMU_SAMPLES)
+            payloads = [encode_imu_frame(samples[start:start + MAX_IMU_SAMPLES], start) for start in starts]
+            times = np.array([times[min(start + MAX_IMU_SAMPLES, len(samples)) - 1] for start in starts])
+    return times - times[0] if len(times) else times, payloads
+
+class ReplaySource:
+    """
+    One log replayed by the ReplayClient of an address. The position is kept
+    between connections, so a reconnected client carries on where it stopped.
+    """
+    def __init__(self, path, speed=1.0, jitter=0.0, drop_rate=0.0, disconnect_rate=0.0, frames=False, loop=True,
+                 seed=None):
+        """
+        Parameters:
+            path (str): IMU log or TOF archive.
+            speed (float): Replay rate, relative to the recorded one (e.g. 1, 10 or 100).
+            jitter (float): Maximum random extra delay of each notification (s),
+                so that notifications arrive in bursts as over the air.
+            drop_rate (float): Probability that a notification is lost.
+            disconnect_rate (float): Probability that the link drops after a notification.
+            frames (bool): Send binary frames, see read_log.
+            loop (bool): Start over at the end of the log, else stop notifying.
+            seed (int): Seed of the random generator, for repeatable runs.
+        """
+        self.path = path
+        self.times, self.payloads = read_log(path, frames)
+        if not self.payloads:
+            raise ValueError(f"No notification to replay in {path}")
+        # Delay before each notification, the first one gets the median period
+        periods = np.diff(self.times, prepend=self.times[0])
+        periods[0] = np.median(periods[1:]) if len(periods) > 1 else 0.0
+        self.periods = np.maximum(periods, 0.0)  # Clock jumps backwards are replayed without delay
+
+        self.speed = speed
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.loop = loop
+        self.random = random.Random(seed)
+
+        self.position = 0
+        self.sent = 0
+        self.dropped = 0
+        self.disconnects = 0
+
+    def rate(self):
+        """
+        Returns:
+            float: Notifications per second at the replay speed.
+        """
+        return self.speed / np.mean(self.periods) if np.mean(self.periods) > 0 else float("inf")
+
+sources = {}  # ReplaySource of each address
+default_source = None  # ReplaySource of the other addresses
+
+def add_source(address, path, **options):
+    """
+    Replay a log for an address (None: for any address without its own log).
+
+    Parameters:
+        options: See ReplaySource.
+
+    Returns:
+        ReplaySource: The source, to read its counters.
+    """
+    global default_source
+    source = ReplaySource(path, **options)
+    if address is None:
+        default_source = source
+    else:
+        sources[address] = source
+    return source
+
+class ReplayCharacteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.properties = ["read", "notify"]
+
+class ReplayService:
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+class ReplayClient:
+    """
+    Drop-in replacement of bleak.BleakClient, notifying the log of ReplaySource.
+    """
+    def __init__(self, address_or_ble_device, disconnected_callback=None, timeout=10.0, **kwargs):
+        self.address = getattr(address_or_ble_device, "address", address_or_ble_device)
+        self.disconnected_callback = disconnected_callback
+        self.timeout = timeout
+        self.source = sources.get(self.address, default_source)
+        self.is_connected = False
+        self.services = [ReplayService(SERVICE_UUID, [ReplayCharacteristic(CHARACTERISTIC_UUID)])]
+        self.task = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.disconnect()
+
+    async def connect(self, timeout=None, **kwargs):
+        if self.source is None:
+            raise Exception(f"Device with address {self.address} was not found.")
+        await asyncio.sleep(0)
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        await self.stop_notify(CHARACTERISTIC_UUID)
+        self.is_connected = False
+        return True
+
+    async def get_services(self):
+        return self.services
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        if not self.is_connected:
+            raise Exception("Not connected")
+        if getattr(char_specifier, "uuid", char_specifier) != CHARACTERISTIC_UUID:
+            raise Exception(f"Characteristic {char_specifier} was not found!")
+        self.task = asyncio.ensure_future(self.notify(callback))
+
+    async def stop_notify(self, char_specifier):
+        task, self.task = self.task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def notify(self, callback):
+        """
+        Send the notifications of the source at its speed, from its position.
+        """
+        source = self.source
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while self.is_connected:
+            if source.position >= len(source.payloads):
+                if not source.loop:
+                    return
+                source.position = 0
+            deadline += source.periods[source.position] / source.speed
+            delay = deadline - loop.time() + source.jitter * source.random.random()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)  # Behind schedule: send at once, but let the loop run
+
+            payload = source.payloads[source.position]
+            source.position += 1
+            if source.random.random() < source.drop_rate:
+                source.dropped += 1
+                continue
+            source.sent += 1
+            callback(CHARACTERISTIC_UUID, bytearray(payload))
+
+            if source.random.random() < source.disconnect_rate:
+                source.disconnects += 1
+                self.is_connected = False
+                self.task = None
+                if self.disconnected_callback is not None:
+                    self.disconnected_callback(self)
+                return
+
+def classify_consumer():
+    """
+    Consumer classifying each IMU notification, as the BLEApp of classification.py.
+    """
+    sys.path.append(os.path.join(ROOT_PATH, "IMU", "data_processing", "peak_detection"))
+    from classification import Classification
+
+    classification = Classification(hop=4, hold=52)
+    return lambda event: classification.add_data(event.data)
+
+def print_consumer():
+    """
+    Consumer printing each notification, as BLE_terminal.py, to a discarded buffer.
+    """
+    from ble_frames import payload_text
+
+    output = io.StringIO()
+    def consume(event):
+        with redirect_stdout(output):
+            for line in payload_text(event.data).split("\n"):
+                print(f"{event.address}\t{line.replace(',', chr(9))}")
+        output.seek(0)
+        output.truncate()
+    return consume
+
+CONSUMERS = {"none": lambda: (lambda event: None), "print": print_consumer, "classify": classify_consumer}
+
+def load_test(paths, speed, duration, consumer, maxsize=1024, **options):
+    """
+    Replay logs, one device each, through a BLESessionManager into a consumer thread.
+
+    Parameters:
+        paths (list): Logs to replay.
+        speed (float): Replay speed.
+        duration (float): Length of the test (s).
+        consumer (str): Key of CONSUMERS.
+        maxsize (int): Bound of the event queue.
+        options: Other ReplaySource options.
+
+    Returns:
+        dict: Offered and consumed notifications per second, notifications
+        dropped by the replay and by the full queue, and the maximum and final
+        delay between reception and consumption (s).
+    """
+    import ble_session
+    ble_session.BleakClient = ReplayClient
+    sources.clear()
+    addresses = [f"REPLAY:{i:02d}" for i in range(len(paths))]
+    replays = [add_source(address, path, speed=speed, **options) for address, path in zip(addresses, paths)]
+
+    consume = CONSUMERS[consumer]()
+    manager = BLESessionManager(maxsize=maxsize)
+    manager.start()
+    for address in addresses:
+        manager.connect(address)
+
+    consumed = 0
+    max_lag = lag = 0.0
+    stop = time.monotonic() + duration
+    while time.monotonic() < stop:
+        try:
+            event = manager.events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if event.kind != NOTIFICATION:
+            continue
+        consume(event)
+        consumed += 1
+        lag = time.monotonic() - event.time
+        max_lag = max(max_lag, lag)
+    manager.stop()
+
+    backpressure = manager.events.backpressure()
+    return {
+        "offered": sum(source.rate() for source in replays),
+        "consumed": consumed / duration,
+        "replay_dropped": sum(source.dropped for source in replays),
+        "queue_dropped": sum(counts["dropped"] for counts in backpressure.values()),
+        "disconnects": sum(source.disconnects for source in replays),
+        "max_lag": max_lag,
+        "final_lag": lag,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded logs as BLE notifications and load-test a consumer.")
+    parser.add_argument("paths", nargs="*", help="IMU logs or TOF archives, one device each (default: the IMU logs)")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1, 10, 100], help="Replay speeds")
+    parser.add_argument("--duration", type=float, default=5.0, help="Length of each test (s)")
+    parser.add_argument("--consumer", choices=CONSUMERS, default="classify", help="Work done per notification")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum extra delay of a notification (s)")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probability that a notification is lost")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Probability of a disconnection per notification")
+    parser.add_argument("--frames", action="store_true", help="Replay binary frames instead of text lines")
+    parser.add_argument("--tof", action="store_true", help="Default to the TOF archives instead of the IMU logs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(TOF_ARCHIVES_PATH if args.tof else IMU_LOGS_PATH, "*.csv")))[:1]
+    for speed in args.speeds:
+        result = load_test(paths, speed, args.duration, args.consumer, jitter=args.jitter, drop_rate=args.drop_rate,
+                           disconnect_rate=args.disconnect_rate, frames=args.frames, seed=args.seed)
+        # Falling behind: the queue overflows or the delay keeps growing
+        behind = result["queue_dropped"] > 0 or result["final_lag"] > 1.0
+        print(f"[REPLAY] x{speed:<6g}{result['offered']:9.0f} notif/s offered, {result['consumed']:9.0f} consumed, "
+              f"{result['replay_dropped']} lost, {result['queue_dropped']} dropped (queue full), "
+              f"{result['disconnects']} disconnects, lag max {result['max_lag'] * 1000:.1f} ms"
+              f"{'  FALLING BEHIND' if behind else ''}")
@@ -0,0 +1,456 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+
+from bleak import BleakClient
+
+from ble_telemetry import Telemetry
+
+CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"  # Notification characteristic of the modules
+
+# Kinds of events put in the queue
+NOTIFICATION = "notification"
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+ERROR = "error"
+CLOSED = "closed"
+
+# One item of the queue: data is the payload (bytes) for a notification, the
+# error message for an error, else None. time is time.monotonic() on reception.
+BLEEvent = namedtuple("BLEEvent", ["kind", "address", "data", "time"])
+
+class SessionClosing(Exception):
+    """
+    close() was called while a session was connecting.
+    """
+
+class FanInQueue(queue.Queue):
+    """
+    Queue merging the events of every device, with a bound on the whole queue
+    and on the notifications pending for each device.
+
+    offer() never blocks the event loop: a notification that does not fit is
+    dropped, and counted for its device. Connection events always fit, so that
+    the consumers never miss a connection change.
+    """
+    def __init__(self, maxsize=0, device_maxsize=0):
+        """
+        Parameters:
+            maxsize (int): Maximum number of pending notifications (0: unbounded).
+            device_maxsize (int): Maximum number of pending notifications per
+                device (0: unbounded), so that one device cannot fill the queue.
+        """
+        super().__init__(maxsize)
+        self.device_maxsize = device_maxsize
+        self.received = Counter()  # Notifications offered, by address
+        self.dropped = Counter()  # Notifications dropped because the queue was full
+        self.pending = Counter()  # Notifications in the queue
+        self.high_water = Counter()  # Maximum of pending
+
+    def _put(self, item):
+        super()._put(item)
+        if item.kind == NOTIFICATION:
+            self.pending[item.address] += 1
+            self.high_water[item.address] = max(self.high_water[item.address], self.pending[item.address])
+
+    def _get(self):
+        item = super()._get()
+        if item.kind == NOTIFICATION:
+            self.pending[item.address] -= 1
+        return item
+
+    def offer(self, item):
+        """
+        Put an event in the queue without blocking.
+
+        Returns:
+            bool: False if the notification was dropped.
+        """
+        with self.not_full:
+            if item.kind == NOTIFICATION:
+                self.received[item.address] += 1
+                full = 0 < self.maxsize <= sum(self.pending.values())
+                device_full = 0 < self.device_maxsize <= self.pending[item.address]
+                if full or device_full:
+                    self.dropped[item.address] += 1
+                    return False
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True
+
+    def backpressure(self):
+        """
+        Snapshot of the per-device accounting.
+
+        Returns:
+            dict: By address, the received, dropped and pending notifications,
+            and the maximum number of notifications pending at once.
+        """
+        with self.mutex:
+            return {
+                address: {
+                    "received": self.received[address],
+                    "dropped": self.dropped[address],
+                    "pending": self.pending[address],
+                    "high_water": self.high_water[address],
+                }
+                for address in self.received
+            }
+
+class NotificationRing:
+    """
+    Fixed-size ring buffer handing the notifications from the event loop thread
+    to one consumer, which drains them in batches (e.g. a GUI timer).
+
+    Single producer, single consumer and no lock: only the producer advances
+    written and only the consumer advances read, and each store of an int is
+    atomic in CPython. A slot is filled before written moves past it. When the
+    consumer falls behind by the whole capacity, new notifications are dropped
+    and counted.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.written = 0  # Total notifications pushed, only advanced by push()
+        self.read = 0  # Total notifications drained, only advanced by drain()
+        self.dropped = 0
+
+    def __len__(self):
+        return self.written - self.read
+
+    def push(self, item):
+        """
+        Store one item. Called from the producer thread.
+
+        Returns:
+            bool: False if the ring was full and the item dropped.
+        """
+        if self.written - self.read >= self.capacity:
+            self.dropped += 1
+            return False
+        self.slots[self.written % self.capacity] = item
+        self.written += 1
+        return True
+
+    def drain(self, limit=None):
+        """
+        Take every stored item, oldest first. Called from the consumer thread.
+
+        Parameters:
+            limit (int): Maximum number of items to take.
+
+        Returns:
+            list: The items.
+        """
+        end = self.written
+        if limit is not None:
+            end = min(end, self.read + limit)
+        items = [self.slots[index % self.capacity] for index in range(self.read, end)]
+        self.read = end
+        return items
+
+class BLESession:
+    """
+    One BLE link: connect, subscribe to the notifications, and reconnect with
+    exponential backoff as soon as bleak reports the disconnection. Runs on the
+    event loop of a BLESessionManager.
+    """
+    def __init__(self, manager, address, characteristic_uuid=CHARACTERISTIC_UUID):
+        self.manager = manager
+        self.address = address
+        self.characteristic_uuid = characteristic_uuid
+        self.client = None
+        self.connected = False
+        self.closing = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.task = None
+
+    def on_disconnect(self, client):
+        # Called by bleak on the event loop when the link drops
+        self.disconnected.set()
+
+    def on_notification(self, sender, data):
+        self.manager.publish(NOTIFICATION, self.address, bytes(data))
+
+    async def run(self):
+        """
+        Keep the link up until close() is called.
+        """
+        manager = self.manager
+        delay = 0  # The first reconnection is immediate
+        since = None  # After a failure, wait for a new advertisement of the device
+        while not self.closing.is_set():
+            try:
+                self.disconnected.clear()
+                print(f"[CONNEXION] Connexion au périphérique BLE à l'adresse {self.address}...")
+                target = self.address
+                if manager.discovery is not None:
+                    # Connect as soon as the device advertises, without a scan of its own
+                    entry = await self.unless_closing(manager.discovery.wait_for(self.address, manager.connect_timeout, since))
+                    if entry is None:
+                        raise Exception(f"Périphérique {self.address} introuvable")
+                    target = entry.device
+                self.client = BleakClient(target, disconnected_callback=self.on_disconnect)
+                await self.unless_closing(self.client.connect(timeout=manager.connect_timeout))
+                await self.unless_closing(self.client.start_notify(self.characteristic_uuid, self.on_notification))
+
+                self.connected = True
+                delay = 0
+                manager.publish(CONNECTED, self.address)
+
+                # Wait for bleak's disconnect callback, or for close()
+                waiters = [asyncio.ensure_future(self.disconnected.wait()), asyncio.ensure_future(self.closing.wait())]
+                try:
+                    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+            except asyncio.CancelledError:
+                raise
+            except SessionClosing:
+                pass
+            except Exception as e:
+                manager.publish(ERROR, self.address, str(e))
+                # E.g. start_notify failed on a connected client: disconnect it before
+                # retrying, the module does not advertise while it is connected
+                await self.release()
+            finally:
+                if self.connected:
+                    self.connected = False
+                    manager.publish(DISCONNECTED, self.address)
+
+            if self.closing.is_set():
+                break
+            since = time.monotonic()
+            if delay:
+                print(f"[CONNEXION] Nouvelle tentative pour {self.address} dans {delay:.1f} s...")
+                try:
+                    await asyncio.wait_for(self.closing.wait(), delay * (1 + manager.jitter * random.random()))
+                except asyncio.TimeoutError:
+                    pass
+            delay = min(max(delay * 2, manager.initial_backoff), manager.max_backoff)
+
+        await self.release()
+        manager.publish(CLOSED, self.address)
+
+    async def unless_closing(self, awaitable):
+        """
+        Await a step of the connection, cancelled as soon as close() is called,
+        so that closing never waits for connect_timeout.
+
+        Returns:
+            The result of awaitable.
+
+        Raises:
+            SessionClosing: close() was called first.
+        """
+        task = asyncio.ensure_future(awaitable)
+        closing = asyncio.ensure_future(self.closing.wait())
+        try:
+            await asyncio.wait([task, closing], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            closing.cancel()
+            if not task.done():
+                task.cancel()
+        if task.cancelled() or not task.done():
+            raise SessionClosing()
+        return task.result()
+
+    async def release(self):
+        client, self.client = self.client, None
+        if client is not None and client.is_connected:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                print(f"[DÉCONNEXION] Erreur lors de la déconnexion : {e}")
+
+class BLESessionManager:
+    """
+    Own one asyncio event loop, in a background thread, for every BLE link of
+    the application. The links run concurrently, and their notifications and
+    connection changes are merged into one FanInQueue of BLEEvent, tagged with
+    the device address and the monotonic reception time. The telemetry of each
+    link (rates, jitter, lost samples, reconnections) is kept in telemetry.
+
+    Example:
+        manager = BLESessionManager()
+        manager.start()
+        manager.connect("F8:B3:B7:22:2E:3A")
+        manager.connect("24:62:AB:F4:F4:7E")
+        event = manager.events.get()
+    """
+    def __init__(self, maxsize=0, device_maxsize=0, connect_timeout=10.0, initial_backoff=0.5, max_backoff=5.0,
+                 jitter=0.2, notifications=None, discovery=None):
+        """
+        Parameters:
+            maxsize, device_maxsize (int): Bounds of the event queue, see FanInQueue.
+            connect_timeout (float): Timeout of each connection attempt (s).
+            initial_backoff (float): Delay before the second reconnection attempt (s),
+                doubled at each failure up to max_backoff. The first one is immediate.
+            jitter (float): Random extra fraction of each delay, so that several
+                links do not retry in step.
+            notifications (NotificationRing): Ring receiving the notifications
+                instead of the event queue, for consumers that drain them in
+                batches. The connection events still go to the queue.
+            discovery (DiscoveryCache): Background scanner to find the devices
+                from, started on the event loop of the manager. Without it,
+                bleak scans for the device at each connection attempt.
+        """
+        self.events = FanInQueue(maxsize, device_maxsize)
+        self.connect_timeout = connect_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.notifications = notifications
+        self.discovery = discovery
+        self.telemetry = Telemetry()
+
+        self.loop = None
+        self.thread = None
+        self.sessions = {}  # By address, only touched from the event loop
+
+    def start(self):
+        """
+        Start the event loop thread.
+        """
+        if self.thread is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="BLESessionManager", daemon=True)
+        self.thread.start()
+        if self.discovery is not None:
+            self.discovery.start(self.loop)
+
+    def publish(self, kind, address, data=None):
+        """
+        Put an event in the queue. Called from the event loop, so it drops the
+        notification rather than wait when the queue is full.
+        """
+        event = BLEEvent(kind, address, data, time.monotonic())
+        if kind == NOTIFICATION:
+            self.telemetry.record_notification(address, event.data, event.time)
+        elif kind in (CONNECTED, DISCONNECTED):
+            self.telemetry.record_connection(address, kind == CONNECTED)
+        if kind == NOTIFICATION and self.notifications is not None:
+            self.notifications.push(event)
+        else:
+            self.events.offer(event)
+
+    def connect(self, address, characteristic_uuid=CHARACTERISTIC_UUID):
+        """
+        Open a link to a device and keep it up. Thread-safe.
+
+        Returns:
+            concurrent.futures.Future: Done once the session is started (not connected).
+        """
+        return asyncio.run_coroutine_threadsafe(self.open_session(address, characteristic_uuid), self.loop)
+
+    def disconnect(self, address):
+        """
+        Close the link to a device. Thread-safe.
+
+        Returns:
+            concurrent.futures.Future: Done once the link is closed.
+        """
+        return asyncio.run_coroutine_threadsafe(self.close_session(address), self.loop)
+
+    def is_connected(self, address):
+        session = self.sessions.get(address)
+        return session is not None and session.connected
+
+    def stop(self, timeout=5.0):
+        """
+        Close every link and stop the event loop thread. Thread-safe.
+        """
+        if self.thread is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.close_all(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"[DÉCONNEXION] Erreur lors de la fermeture des connexions : {e}")
+        if self.discovery is not None:
+            self.discovery.stop(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.thread = None
+
+    async def open_session(self, address, characteristic_uuid):
+        if address in self.sessions:
+            return
+        session = BLESession(self, address, characteristic_uuid)
+        self.sessions[address] = session
+        session.task = asyncio.ensure_future(session.run())
+
+    async def close_session(self, address):
+        session = self.sessions.pop(address, None)
+        if session is None:
+            return
+        session.closing.set()
+        await session.task
+
+    async def close_all(self):
+        await asyncio.gather(*(self.close_session(address) for address in list(self.sessions)))
+
+class SessionEventsMixin:
+    """
+    Connection handling shared by the GUIs of the modules. One event loop for
+    the BLE link, which reconnects by itself when it drops. The notifications
+    are handed over in batches, drained by process_events from a GUI timer.
+
+    The GUI provides status_label, on_disconnect_success() and
+    on_notifications_received(payloads), calls start_session() once and
+    process_events() about 30 times per second.
+    """
+    def start_session(self, discovery=None):
+        """
+        Start a BLESessionManager delivering its notifications to a NotificationRing.
+
+        Parameters:
+            discovery (DiscoveryCache): Background scanner, see BLESessionManager.
+        """
+        self.connected = False
+        self.notifications = NotificationRing()
+        self.session_manager = BLESessionManager(notifications=self.notifications, discovery=discovery)
+        self.session_manager.start()
+
+    def process_events(self):
+        """
+        Handle the events queued by the BLE session manager, then the
+        notifications received since the last call, in the GUI thread.
+        """
+        while True:
+            try:
+                event = self.session_manager.events.get_nowait()
+            except queue.Empty:
+                break
+            if event.kind == CONNECTED:
+                self.on_connection_success(event.address)
+            elif event.kind == DISCONNECTED:
+                self.on_connection_lost(event.address)
+            elif event.kind == ERROR:
+                self.on_connection_error(event.data)
+            elif event.kind == CLOSED:
+                self.on_disconnect_success()
+
+        notifications = self.notifications.drain()
+        if notifications:
+            self.on_notifications_received([event.data for event in notifications])
+
+    def on_connection_success(self, address):
+        print(f"[CONNEXION] Connecté avec succès à {address}.")
+        self.connected = True
+        self.status_label.setText(f"Statut : Connecté à {address}")
+
+    def on_connection_lost(self, address):
+        print(f"[CONNEXION] Connexion perdue avec {address}, reconnexion...")
+        self.connected = False
+        self.status_label.setText(f"Statut : Connexion perdue, reconnexion à {address}...")
+
+    def on_connection_error(self, error):
+        # The session manager retries by itself, so no blocking dialog here
+        print(f"[CONNEXION] Erreur lors de la connexion : {error}")
+        self.status_label.setText(f"Erreur : {error} (nouvelle tentative)")
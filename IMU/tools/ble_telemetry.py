@@ -0,0 +1,204 @@
+import bisect
+import math
+import threading
+import time
+from collections import deque
+
+from ble_frames import decode_frame, frame_sequence, is_frame
+
+# Upper bounds of the inter-arrival histogram bins (s), the last bin is open
+INTER_ARRIVAL_BINS = (0.001, 0.002, 0.005, 0.01, 0.015, 0.02, 0.025, 0.03, 0.04, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0)
+RATE_WINDOW = 5.0  # Seconds of notifications the rates are computed on
+GAP_FACTOR = 1.5  # A step of time[us] over GAP_FACTOR sample periods is a gap
+TIME_WRAP = 1 << 32  # time[us] is the 32-bit micros() of the module
+SEQUENCE_WRAP = 1 << 32
+IMU_FIELDS = 7  # "time,acc_x,acc_y,acc_z,gyro_x,gyro_y,gyro_z"
+
+class LinkTelemetry:
+    """
+    Statistics of the notifications of one link: rates, inter-arrival times,
+    and the samples lost over the air, inferred from the frame sequence numbers
+    or from the IMU time[us] field. Other text payloads (TOF, classification
+    codes) only get the rates and inter-arrival times.
+    """
+    def __init__(self, rate_window=RATE_WINDOW):
+        self.rate_window = rate_window
+        self.notifications = 0
+        self.bytes = 0
+        self.samples = 0
+        self.recent = deque()  # (reception time, bytes) of the last rate_window seconds
+
+        self.histogram = [0] * (len(INTER_ARRIVAL_BINS) + 1)
+        self.last_arrival = None
+        self.arrival_mean = 0.0  # Welford mean and sum of squares of the inter-arrival times
+        self.arrival_m2 = 0.0
+        self.arrivals = 0
+
+        self.gaps = 0  # Breaks in the sample stream
+        self.missing = 0  # Samples lost in the breaks
+        self.next_sequence = None
+        self.last_time = None  # Last IMU time[us]
+        self.sample_period = None  # Estimated from time[us] (us)
+
+        self.connections = 0
+        self.reconnects = 0
+        self.disconnects = 0
+        self.connected = False
+
+    def record_connection(self, connected):
+        self.connected = connected
+        if connected:
+            if self.connections:
+                self.reconnects += 1
+            self.connections += 1
+            self.last_arrival = None  # No inter-arrival time across a reconnection
+        else:
+            self.disconnects += 1
+
+    def record_notification(self, data, arrival):
+        """
+        Parameters:
+            data (bytes): The payload.
+            arrival (float): time.monotonic() of its reception.
+        """
+        self.notifications += 1
+        self.bytes += len(data)
+        self.recent.append((arrival, len(data)))
+        while self.recent[0][0] < arrival - self.rate_window:
+            self.recent.popleft()
+
+        if self.last_arrival is not None:
+            interval = arrival - self.last_arrival
+            self.histogram[bisect.bisect_left(INTER_ARRIVAL_BINS, interval)] += 1
+            self.arrivals += 1
+            delta = interval - self.arrival_mean
+            self.arrival_mean += delta / self.arrivals
+            self.arrival_m2 += delta * (interval - self.arrival_mean)
+        self.last_arrival = arrival
+
+        if is_frame(data):
+            self.record_frame(data)
+        else:
+            self.record_text(data)
+
+    def record_frame(self, data):
+        try:
+            count = len(decode_frame(data).records)
+        except ValueError:
+            return
+        sequence = frame_sequence(data)
+        self.samples += count
+        if self.next_sequence is not None:
+            missing = (sequence - self.next_sequence) % SEQUENCE_WRAP
+            if 0 < missing < SEQUENCE_WRAP // 2:
+                self.gaps += 1
+                self.missing += missing
+            # Else a repeated or older frame, or the module restarted its count
+        self.next_sequence = (sequence + count) % SEQUENCE_WRAP
+
+    def record_text(self, data):
+        # Only the IMU sample lines are counted: the classification codes of the
+        # firmware ("0", "1", ...) share the characteristic and have no time[us]
+        for line in data.strip().split(b"\n"):
+            if line.count(b",") != IMU_FIELDS - 1:
+                continue
+            try:
+                sample_time = int(line.split(b",", 1)[0])
+            except ValueError:
+                continue  # Malformed
+            self.samples += 1
+            if self.last_time is not None:
+                self.record_step((sample_time - self.last_time) % TIME_WRAP)
+            self.last_time = sample_time
+
+    def record_step(self, step):
+        if step == 0 or step > TIME_WRAP // 2:  # Repeated sample, or the module restarted
+            return
+        if self.sample_period is None:
+            self.sample_period = step
+        elif step > GAP_FACTOR * self.sample_period:
+            self.gaps += 1
+            self.missing += round(step / self.sample_period) - 1
+        else:
+            self.sample_period += 0.05 * (step - self.sample_period)
+
+    def snapshot(self, now=None):
+        """
+        Returns:
+            dict: The counters, the rates over the last rate_window seconds, the
+            inter-arrival mean, standard deviation (jitter) and histogram (counts
+            per bin of INTER_ARRIVAL_BINS, the last one above 1 s).
+        """
+        now = time.monotonic() if now is None else now
+        recent = [(arrival, size) for arrival, size in self.recent if arrival >= now - self.rate_window]
+        span = min(self.rate_window, now - recent[0][0]) if recent else 0.0
+        expected = self.samples + self.missing
+        return {
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "bytes": self.bytes,
+            "samples": self.samples,
+            "rate": len(recent) / span if span > 0 else 0.0,
+            "byte_rate": sum(size for _, size in recent) / span if span > 0 else 0.0,
+            "inter_arrival_mean": self.arrival_mean,
+            "jitter": math.sqrt(self.arrival_m2 / self.arrivals) if self.arrivals else 0.0,
+            "histogram": list(self.histogram),
+            "gaps": self.gaps,
+            "missing": self.missing,
+            "loss": self.missing / expected if expected else 0.0,
+            "reconnects": self.reconnects,
+            "disconnects": self.disconnects,
+        }
+
+class Telemetry:
+    """
+    LinkTelemetry of every device, fed by a BLESessionManager from its event
+    loop and read from any thread.
+
+    Example:
+        snapshot = manager.telemetry.snapshot()  # {address: dict}
+        print(manager.telemetry.status_line())
+    """
+    def __init__(self, rate_window=RATE_WINDOW):
+        self.rate_window = rate_window
+        self.links = {}
+        self.lock = threading.Lock()
+
+    def link(self, address):
+        if address not in self.links:
+            self.links[address] = LinkTelemetry(self.rate_window)
+        return self.links[address]
+
+    def record_notification(self, address, data, arrival):
+        with self.lock:
+            self.link(address).record_notification(data, arrival)
+
+    def record_connection(self, address, connected):
+        with self.lock:
+            self.link(address).record_connection(connected)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: LinkTelemetry.snapshot() of each address.
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {address: link.snapshot(now) for address, link in self.links.items()}
+
+    def status_line(self, names=None):
+        """
+        One compact line for all the links, e.g.
+        "IMU 52.6/s 2.2 kB/s jitter 3.1 ms lost 4 (0.2%) reco 1".
+
+        Parameters:
+            names (dict): Names to show instead of the addresses.
+        """
+        parts = []
+        for address, stats in self.snapshot().items():
+            name = (names or {}).get(address, address)
+            state = "" if stats["connected"] else " (déconnecté)"
+            parts.append(f"{name}{state} {stats['rate']:.1f}/s {stats['byte_rate'] / 1000:.1f} kB/s "
+                         f"jitter {stats['jitter'] * 1000:.1f} ms lost {stats['missing']} ({stats['loss']:.1%}) "
+                         f"reco {stats['reconnects']}")
+        return " | ".join(parts)
@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import scrolledtext, ttk
 import asyncio
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 import threading
 import serial
 import matplotlib.pyplot as plt
@@ -12,10 +12,16 @@ import csv
 import os
 from datetime import datetime
 
+from ble_discovery import DiscoveryCache
+
 # Constants for BLE
 SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
 
+# Background BLE scan, read by the "Scan BLE" button and the connection.
+# Started with the window, not on import.
+discovery = DiscoveryCache()
+
 # Variables for Serial
 ser = None
 
@@ -82,7 +88,12 @@ def update_graph():
 
 # BLE Functions
 async def log_ble_data(device_address):
-    async with BleakClient(device_address) as client:
+    # Connect with the cached BLEDevice, so bleak does not scan again
+    device = await asyncio.wrap_future(discovery.find(device_address))
+    if device is None:
+        text_area.insert(tk.END, f"Error: {device_address} not found\n")
+        return
+    async with BleakClient(device.device) as client:
         await client.start_notify(CHARACTERISTIC_UUID, handle_ble_notification)
         while True:
             await asyncio.sleep(1)
@@ -100,12 +111,11 @@ def handle_ble_notification(sender, data):
     except ValueError:
         pass
 
-async def scan_ble_devices():
-    devices = await BleakScanner.discover()
-    ble_device_combobox['values'] = [f"{device.name} ({device.address})" for device in devices]
-    scan_text_area.delete(1.0, tk.END)
-    for device in devices:
-        scan_text_area.insert(tk.END, f"Name: {device.name}, Address: {device.address}\n")
+def scan_ble_devices():
+    devices = discovery.devices()
+    ble_device_combobox['values'] = [f"{name} ({address})" for name, address in devices.items()]
+    for name, address in devices.items():
+        text_area.insert(tk.END, f"Name: {name}, Address: {address}\n")
 
 # Serial Functions
 def connect_serial():
@@ -154,7 +164,7 @@ connection_dropdown.pack(side=tk.LEFT)
 ble_frame = tk.Frame(root)
 ble_device_combobox = ttk.Combobox(ble_frame, width=30)
 ble_device_combobox.pack(side=tk.LEFT, padx=5)
-tk.Button(ble_frame, text="Scan BLE", command=lambda: asyncio.run(scan_ble_devices())).pack(side=tk.LEFT)
+tk.Button(ble_frame, text="Scan BLE", command=scan_ble_devices).pack(side=tk.LEFT)
 tk.Button(ble_frame, text="Connect BLE", command=lambda: asyncio.run(log_ble_data(ble_device_combobox.get().split('(')[-1].strip(')')))).pack(side=tk.LEFT)
 
 # Serial Frame
@@ -204,4 +214,7 @@ def update_connection_view(*args):
 connection_type.trace_add("write", update_connection_view)
 update_connection_view()
 
-root.mainloop()
+if __name__ == "__main__":
+    discovery.start()
+    root.mainloop()
+    discovery.stop()
@@ -1,9 +1,17 @@
 import asyncio
-from bleak import BleakClient, BleakScanner
+from bleak import BleakScanner
 import csv
 import os
+import queue
+import sys
+import time
 from datetime import datetime
 
+# Le gestionnaire de sessions BLE est partagé avec les outils IMU
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "IMU", "tools"))
+from ble_frames import payload_text
+from ble_session import BLESessionManager, CONNECTED, DISCONNECTED, ERROR, NOTIFICATION
+
 # Configuration des archives
 archive_folder_csv = "Archives_csv"
 if not os.path.exists(archive_folder_csv):
@@ -13,54 +21,73 @@ archive_filename_csv = os.path.join(archive_folder_csv, f"archive_{datetime.now(
 # Configuration BLE
 SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
+MAX_PENDING = 1024  # Notifications en attente d'écriture, tous périphériques confondus
+MAX_PENDING_PER_DEVICE = 512
 
-def save_to_csv(data):
+def save_to_csv(data, filename=archive_filename_csv, timestamp=None):
     """
     Enregistre les données reçues dans un fichier CSV.
     :param data: Chaîne contenant les données à sauvegarder.
+    :param filename: Fichier CSV de destination.
+    :param timestamp: Date de réception (datetime), par défaut maintenant.
     """
-    timestamp = datetime.now().isoformat()
-    file_exists = os.path.isfile(archive_filename_csv)
-    with open(archive_filename_csv, "a", newline="") as csvfile:
+    timestamp = (timestamp or datetime.now()).isoformat()
+    file_exists = os.path.isfile(filename)
+    with open(filename, "a", newline="") as csvfile:
         writer = csv.writer(csvfile)
         if not file_exists:
             writer.writerow(["Timestamp", "Data"])  # En-têtes du fichier
         writer.writerow([timestamp] + data.split(','))
 
-async def log_ble_data(device_address):
+def archive_filename(device_address, device_addresses):
     """
-    Se connecte à un périphérique BLE et enregistre les données reçues.
-    :param device_address: Adresse MAC du périphérique BLE.
+    Fichier CSV d'un périphérique : un fichier par périphérique s'il y en a plusieurs.
     """
-    async with BleakClient(device_address) as client:
-        print(f"Connexion au périphérique {device_address}")
-
-        # Vérifiez les services et caractéristiques du périphérique
-        services = await client.get_services()
-        characteristic_found = any(
-            char.uuid == CHARACTERISTIC_UUID
-            for service in services
-            for char in service.characteristics
-        )
-
-        if not characteristic_found:
-            print("Caractéristique non trouvée.")
-            return
+    if len(device_addresses) == 1:
+        return archive_filename_csv
+    root, extension = os.path.splitext(archive_filename_csv)
+    return f"{root}_{device_address.replace(':', '')}{extension}"
 
-        def handle_notification(sender, data):
-            line = data.decode("utf-8").strip()
-            print(f"Données reçues : {line}")
-            save_to_csv(line)
+def log_ble_data(device_addresses):
+    """
+    Se connecte simultanément à un ou plusieurs périphériques BLE et enregistre
+    les données reçues, avec leur date de réception.
+    :param device_addresses: Adresses MAC des périphériques BLE.
+    """
+    manager = BLESessionManager(maxsize=MAX_PENDING, device_maxsize=MAX_PENDING_PER_DEVICE)
+    manager.start()
+    for device_address in device_addresses:
+        print(f"Connexion au périphérique {device_address}")
+        manager.connect(device_address, CHARACTERISTIC_UUID)
 
-        await client.start_notify(CHARACTERISTIC_UUID, handle_notification)
-        print("Notifications activées. Appuyez sur Ctrl+C pour arrêter.")
-        try:
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
-            print("Arrêt des notifications.")
-        finally:
-            await client.stop_notify(CHARACTERISTIC_UUID)
+    # Les dates de réception sont monotones, converties une seule fois en date réelle
+    clock_offset = time.time() - time.monotonic()
+    print("Appuyez sur Ctrl+C pour arrêter.")
+    try:
+        while True:
+            try:
+                event = manager.events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if event.kind == NOTIFICATION:
+                # Une ligne par image TOF, en texte ou dans une trame binaire
+                for line in payload_text(event.data).split("\n"):
+                    print(f"Données reçues ({event.address}) : {line}")
+                    save_to_csv(line, archive_filename(event.address, device_addresses),
+                                datetime.fromtimestamp(event.time + clock_offset))
+            elif event.kind == CONNECTED:
+                print(f"Notifications activées pour {event.address}.")
+            elif event.kind == DISCONNECTED:
+                print(f"Connexion perdue avec {event.address}, reconnexion...")
+            elif event.kind == ERROR:
+                print(f"Erreur avec {event.address} : {event.data}")
+    except KeyboardInterrupt:
+        print("Arrêt des notifications.")
+    finally:
+        manager.stop()
+        for device_address, counts in manager.events.backpressure().items():
+            print(f"{device_address} : {counts['received']} notification(s) reçue(s), "
+                  f"{counts['dropped']} perdue(s) (file pleine)")
 
 async def scan_devices():
     """
@@ -86,8 +113,8 @@ def main():
     if choice == "1":
         asyncio.run(scan_devices())
     elif choice == "2":
-        device_address = input("Entrez l'adresse MAC du périphérique : ")
-        asyncio.run(log_ble_data(device_address))
+        device_addresses = input("Entrez les adresses MAC des périphériques, séparées par des virgules : ")
+        log_ble_data([address.strip() for address in device_addresses.split(",") if address.strip()])
     else:
         print("Option invalide.")
 
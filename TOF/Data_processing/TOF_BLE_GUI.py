@@ -3,12 +3,17 @@ from tkinter import scrolledtext, ttk
 import asyncio
 from bleak import BleakClient
 import re
-from bleak import BleakScanner
 import json
 import csv
 import os
+import sys
 from datetime import datetime
 
+# Décodage des trames binaires, partagé avec les outils IMU
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "IMU", "tools"))
+from ble_discovery import DiscoveryCache
+from ble_frames import payload_text
+
 ##################################
 #
 # Archives
@@ -36,9 +41,18 @@ archive_filename_csv = os.path.join(archive_folder_csv, f"archive_{datetime.now(
 SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"  # Remplacez si nécessaire
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"  # Remplacez si nécessaire
 
+# Scan BLE en arrière-plan, lu par le bouton "Scan" et la connexion sans bloquer
+# l'interface. Démarré avec la fenêtre, pas à l'import.
+discovery = DiscoveryCache()
+
 async def log_ble_data():
     DEVICE_ADDRESS = device_address_entry.get()  # Récupérer l'adresse du périphérique saisie
-    async with BleakClient(DEVICE_ADDRESS) as client:
+    # Connexion avec le BLEDevice du cache, sans que bleak ne scanne à nouveau
+    device = await asyncio.wrap_future(discovery.find(DEVICE_ADDRESS))
+    if device is None:
+        print(f"Périphérique {DEVICE_ADDRESS} introuvable.")
+        return
+    async with BleakClient(device.device) as client:
         print(f"Connexion au périphérique {DEVICE_ADDRESS}")
 
         # Vérifiez les services et caractéristiques du périphérique
@@ -63,7 +77,7 @@ async def log_ble_data():
 
         # Fonction pour traiter les notifications BLE
         def handle_notification(sender, data):
-            line = data.decode("utf-8").strip()
+            line = payload_text(data)  # Texte ou trame binaire
             print(f"Données reçues : {line}")
             text_area.delete(1.0, tk.END)
             text_area.insert(tk.END, f"{line}\n")
@@ -82,18 +96,15 @@ async def log_ble_data():
         while True:
             await asyncio.sleep(1)
 
-async def scan_ble_devices():
+def scan_ble_devices():
     scan_text_area.delete(1.0, tk.END)  # Effacer le contenu précédent de la text_area du scan
-    scan_text_area.insert(tk.END, "Scan des périphériques BLE en cours...\n")  # Ajouter un message initial
-    devices = await BleakScanner.discover()
+    devices = discovery.devices()  # Modules "ESP32_EUC" entendus ces dernières secondes
     if not devices:
         scan_text_area.insert(tk.END, "Aucun périphérique détecté.\n")
     else:
         scan_text_area.insert(tk.END, f"{len(devices)} périphérique(s) détecté(s) :\n")
-        for device in devices:
-            name = device.name
-            if "ESP32_EUC" in name:  # Vérifie s'il contient "ESP32_EUC"
-                scan_text_area.insert(tk.END, f"Nom : {name}, Adresse MAC : {device.address}\n")
+        for name, address in devices.items():
+            scan_text_area.insert(tk.END, f"Nom : {name}, Adresse MAC : {address}\n")
 
 
 ##################################
@@ -206,7 +217,7 @@ connect_button = tk.Button(settings_frame, text="Connect", command=lambda: async
 connect_button.pack(side=tk.LEFT, padx=10)
 
 # Scan button
-scan_button = tk.Button(settings_frame, text="Scan", command=lambda: asyncio.run(scan_ble_devices()))
+scan_button = tk.Button(settings_frame, text="Scan", command=scan_ble_devices)
 scan_button.pack(side=tk.LEFT, padx=10)
 
 # Stop button
@@ -236,5 +247,8 @@ for row in range(8):
     grid_labels.append(row_labels)
 
 # Run the Tkinter event loop
-root.mainloop()
+if __name__ == "__main__":
+    discovery.start()
+    root.mainloop()
+    discovery.stop()
 